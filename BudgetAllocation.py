@@ -1,45 +1,221 @@
 
-from themeBaseCode import (
-    os,
-    llm,
-    StrOutputParser,
-    PromptTemplate,
-    re,
-    json
-)
+import os
+import json
+from langchain_core.prompts import PromptTemplate
+from modelRouter import RoutedChain
+from llmOutputParser import LLMOutputError, parse_budget_allocation, parse_budget_and_keywords
+from rateLimiter import UpstreamUnavailable
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-def allocate_budget_with_guided_llm(user_input):
+# "rules" allocates deterministically; "llm" asks Gemini for the allocation;
+# "fused" asks Gemini for the allocation and the decoration keywords in one call
+BUDGET_ALLOCATION_MODE = os.getenv("BUDGET_ALLOCATION_MODE", "rules")
+# Ask Gemini for richer reasoning in the background when allocating by rules. Off by
+# default: it adds an LLM call to every plan, including batch and speculative ones
+BUDGET_REASONING_ENRICHMENT = os.getenv("BUDGET_REASONING_ENRICHMENT", "0").lower() in ("1", "true", "yes")
+# How long the decoration step waits for the enriched reasoning to put it in the plan
+BUDGET_REASONING_WAIT_SECONDS = float(os.getenv("BUDGET_REASONING_WAIT_SECONDS", 2))
+# Most recently used allocations whose enriched reasoning is kept
+BUDGET_REASONING_MAX_ENTRIES = int(os.getenv("BUDGET_REASONING_MAX_ENTRIES", 256))
+
+# Define rule-based allocation ratios by event type
+ALLOCATION_GUIDELINES = {
+    "Wedding": {
+        "food_ratio": "45-55%",
+        "entertainment_ratio": "20-30%",
+        "decorations_ratio": "20-30%",
+    },
+    "Birthday": {
+        "food_ratio": "35-45%",
+        "entertainment_ratio": "35-45%",
+        "decorations_ratio": "15-25%",
+    },
+    "Corporate": {
+        "food_ratio": "30-40%",
+        "entertainment_ratio": "30-40%",
+        "decorations_ratio": "25-35%",
+    }
+}
+
+
+def get_allocation_guidelines(event_type):
     """
-    Allocates the total budget into categories (food, entertainment, decorations) using a hybrid approach:
-    1. Uses rule-based percentage guidelines based on event type.
-    2. Uses an LLM to refine the allocation specifically for the event's theme and detailed requirements.
-    3. Ensures the total sum exactly matches the budget.
+    Returns the allocation guidelines for an event type, matching names like
+    "Birthday Party" to "Birthday". Falls back to the Wedding guidelines.
+    """
+    if event_type in ALLOCATION_GUIDELINES:
+        return ALLOCATION_GUIDELINES[event_type]
+    for name, guidelines in ALLOCATION_GUIDELINES.items():
+        if name.lower() in str(event_type).lower():
+            return guidelines
+    return ALLOCATION_GUIDELINES["Wedding"]
+
+
+def _parse_ratio(ratio):
+    """
+    Converts a ratio range like "45-55%" into (0.45, 0.55).
+    """
+    low, high = ratio.rstrip("%").split("-")
+    return float(low) / 100, float(high) / 100
+
+
+def allocate_budget_rule_based(user_input):
+    """
+    Allocates the total budget deterministically, without calling the LLM:
+    1. Food is the per-guest food cost times the guest count, capped at the top of
+       its guideline range so entertainment and decorations keep their minimum
+       shares; the part of the food cost over the cap is reported as a shortfall.
+    2. The rest is split between entertainment and decorations in proportion to the
+       midpoints of their guideline ranges, kept inside those ranges where possible.
+    3. Amounts are whole numbers and always sum to the total budget.
+
+    Returns:
+        dict: Same shape as allocate_budget_with_guided_llm
+              (food, entertainment, decorations, total, reasoning), plus
+              "shortfall" ({category: amount not covered}) when food was capped.
     """
-    # Define rule-based allocation ratios by event type
-    allocation_guidelines = {
-        "Wedding": {
-            "food_ratio": "45-55%",
-            "entertainment_ratio": "20-30%",
-            "decorations_ratio": "20-30%",
-        },
-        "Birthday": {
-            "food_ratio": "35-45%",
-            "entertainment_ratio": "35-45%",
-            "decorations_ratio": "15-25%",
-        },
-        "Corporate": {
-            "food_ratio": "30-40%",
-            "entertainment_ratio": "30-40%",
-            "decorations_ratio": "25-35%",
-        }
-    }
-    
-    # Get event type and use default if not found
     event_type = user_input.get("event_type", "Wedding")
-    guidelines = allocation_guidelines.get(event_type, allocation_guidelines["Wedding"])
-    
-    # Create a prompt that incorporates the rule-based guidelines
-    prompt = PromptTemplate.from_template("""
+    guidelines = get_allocation_guidelines(event_type)
+    total_budget = int(user_input.get("total_budget", 0))
+    guest_count = int(user_input.get("guest_count", 100))
+    theme_name = user_input.get("theme", {}).get("Name", "Classic")
+
+    food_low, food_high = _parse_ratio(guidelines["food_ratio"])
+    ent_low, ent_high = _parse_ratio(guidelines["entertainment_ratio"])
+    dec_low, dec_high = _parse_ratio(guidelines["decorations_ratio"])
+
+    # Step 1: food from the per-guest cost, or the guideline midpoint if no cost is given
+    per_guest = user_input.get("food_guest_per_person")
+    shortfall = {}
+    if per_guest:
+        currency = user_input.get("currency", "INR")
+        food_cost = int(per_guest) * guest_count
+        food = min(food_cost, int(total_budget * food_high))
+        food_note = f"Food covers {guest_count} guests at {per_guest} {currency} per guest."
+        if food < food_cost:
+            shortfall["food"] = food_cost - food
+            food_note = (f"Food for {guest_count} guests at {per_guest} {currency} per guest costs {food_cost}, "
+                         f"more than the {guidelines['food_ratio']} guideline allows, so food is capped at "
+                         f"{food}; the remaining {shortfall['food']} is not covered by this budget.")
+    else:
+        food = round(total_budget * (food_low + food_high) / 2)
+        food_note = f"Food is set to the middle of the {guidelines['food_ratio']} guideline."
+
+    # Step 2: split the remainder by the guideline midpoints
+    remaining = total_budget - food
+    ent_mid = (ent_low + ent_high) / 2
+    dec_mid = (dec_low + dec_high) / 2
+    entertainment = remaining * ent_mid / (ent_mid + dec_mid)
+
+    # Keep both categories inside their ranges when the remainder allows it
+    lower = max(ent_low * total_budget, remaining - dec_high * total_budget)
+    upper = min(ent_high * total_budget, remaining - dec_low * total_budget)
+    if lower <= upper:
+        entertainment = min(max(entertainment, lower), upper)
+        range_note = "Entertainment and decorations are within their guideline ranges."
+    else:
+        range_note = ("The amount left after food does not fit both guideline ranges, "
+                      "so it is split in proportion to them.")
+
+    # Step 3: whole numbers that sum exactly to the budget
+    entertainment = round(entertainment)
+    decorations = remaining - entertainment
+
+    allocation = {
+        "food": food,
+        "entertainment": entertainment,
+        "decorations": decorations,
+        "total": total_budget,
+        "reasoning": (
+            f"Rule-based allocation for a {event_type} with the \"{theme_name}\" theme. "
+            f"{food_note} {range_note} "
+            f"Guidelines: food {guidelines['food_ratio']}, entertainment {guidelines['entertainment_ratio']}, "
+            f"decorations {guidelines['decorations_ratio']}."
+        ),
+    }
+    if shortfall:
+        allocation["shortfall"] = shortfall
+    return allocation
+
+
+reasoning_prompt = PromptTemplate.from_template("""
+    You are an expert event planner. A budget has already been allocated for the event below.
+    Explain in 3-4 sentences why this split suits the event and its theme, and how the
+    entertainment and decoration money could best be used. Do not change the amounts.
+
+    Event Type: {event_type}
+    Theme: {theme_name} - {theme_description}
+    Guests: {guest_count}
+    Total Budget: {total_budget} {currency}
+    Food: {food}
+    Entertainment: {entertainment}
+    Decorations: {decorations}
+    """)
+
+_reasoning_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="budget-reasoning")
+# LRU of reasoning futures by allocation; the UI reads an entry again on every rerun
+_reasoning_futures = OrderedDict()
+_reasoning_lock = threading.Lock()
+
+
+def _reasoning_key(allocation):
+    fields = [allocation.get(k) for k in ("food", "entertainment", "decorations", "total", "reasoning")]
+    return hashlib.sha256(json.dumps(fields, default=str).encode("utf-8")).hexdigest()
+
+
+def request_reasoning_enrichment(user_input, allocation):
+    """
+    Starts a background LLM call that writes richer reasoning for an allocation.
+    The result is picked up later with get_enriched_reasoning(allocation).
+    """
+    key = _reasoning_key(allocation)
+    theme = user_input.get("theme", {})
+    inputs = {
+        "event_type": user_input.get("event_type", "Wedding"),
+        "theme_name": theme.get("Name", "Classic"),
+        "theme_description": theme.get("Description", "A traditional event"),
+        "guest_count": user_input.get("guest_count", 100),
+        "total_budget": allocation.get("total", 0),
+        "currency": user_input.get("currency", "INR"),
+        "food": allocation.get("food", 0),
+        "entertainment": allocation.get("entertainment", 0),
+        "decorations": allocation.get("decorations", 0),
+    }
+    with _reasoning_lock:
+        if key not in _reasoning_futures:
+            chain = RoutedChain("budget_reasoning", reasoning_prompt)
+            _reasoning_futures[key] = _reasoning_executor.submit(chain.invoke, inputs)
+            while len(_reasoning_futures) > BUDGET_REASONING_MAX_ENTRIES:
+                _, evicted = _reasoning_futures.popitem(last=False)
+                evicted.cancel()
+        _reasoning_futures.move_to_end(key)
+        return _reasoning_futures[key]
+
+
+def get_enriched_reasoning(allocation, wait=0):
+    """
+    Returns the LLM-written reasoning for an allocation once it is ready, waiting
+    up to `wait` seconds for it; None if it is not ready, failed or was never requested.
+    """
+    key = _reasoning_key(allocation)
+    with _reasoning_lock:
+        future = _reasoning_futures.get(key)
+        if future is not None:
+            _reasoning_futures.move_to_end(key)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=wait).strip()
+    except Exception:
+        # Still running, failed or cancelled
+        return None
+
+
+# Create a prompt that incorporates the rule-based guidelines
+budget_prompt = PromptTemplate.from_template("""
     You are an expert event planner with knowledge of Indian wedding and event costs. Given the following event details and budget guidelines, please allocate the total budget across three categories: food, entertainment, and decorations.
     
     Event Details:
@@ -70,86 +246,217 @@ def allocate_budget_with_guided_llm(user_input):
       "reasoning": "detailed explanation of your allocation decisions, including theme considerations"
     }}
     """)
-    
-    
-    chain = prompt | llm | StrOutputParser()
 
+
+def _budget_prompt_inputs(user_input):
+    """
+    Builds the budget prompt inputs from the event details and guidelines.
+    """
+    # Get event type and use default if not found
+    event_type = user_input.get("event_type", "Wedding")
+    guidelines = get_allocation_guidelines(event_type)
     # Extract theme details for the prompt
     theme = user_input.get("theme", {})
-    total_budget = user_input.get("total_budget", 0)
+    return {
+        "event_type": event_type,
+        "total_budget": user_input.get("total_budget", 0),
+        "currency": user_input.get("currency", "INR"),
+        "guest_count": user_input.get("guest_count", 100),
+        "veg_count": user_input.get("veg_count", 50),
+        "nonveg_count": user_input.get("nonveg_count", 50),
+        "theme_name": theme.get("Name", "Classic"),
+        "theme_description": theme.get("Description", "A traditional event"),
+        "theme_aesthetic": theme.get("Aesthetic/Visual Style", "Elegant and simple"),
+        "food_ratio": guidelines["food_ratio"],
+        "entertainment_ratio": guidelines["entertainment_ratio"],
+        "decorations_ratio": guidelines["decorations_ratio"],
+    }
+
+
+def _reconcile_allocation(response, total_budget):
+    """
+    Parses the LLM response and adjusts it so the categories sum to the total budget.
+    Raises LLMOutputError if the response is not a valid allocation.
+    """
+    response_dict = parse_budget_allocation(response)
+    
+    # Validate the allocation to ensure it matches the total budget
+    actual_total = response_dict.get("food", 0) + response_dict.get("entertainment", 0) + response_dict.get("decorations", 0)
+    if actual_total != total_budget:
+        # Adjust to match total budget (add/subtract from largest category)
+        diff = total_budget - actual_total
+        max_category = max(["food", "entertainment", "decorations"], 
+                          key=lambda x: response_dict.get(x, 0))
+        response_dict[max_category] += diff
+        response_dict["total"] = total_budget
+        response_dict["reasoning"] += f" (Adjusted {max_category} by {diff} to ensure total matches budget.)"
+    
+    return response_dict
+
+
+def _default_allocation(total_budget, error):
+    # Fallback: Return a default allocation
+    return {
+        "food": int(total_budget * 0.45),
+        "entertainment": int(total_budget * 0.25),
+        "decorations": int(total_budget * 0.30),
+        "total": total_budget,
+        "reasoning": "Default allocation due to response parsing error",
+        "error": str(error)
+    }
+
+
+# Budget prompt plus the decoration keyword request, answered in one JSON object
+fused_prompt = PromptTemplate.from_template("""
+    You are an expert event planner with knowledge of Indian wedding and event costs. Given the following event details and budget guidelines, return the budget allocation and decoration keywords for this event: allocate the total budget across food, entertainment and decorations, and suggest 3 decoration product search keywords for Amazon that are easily available.
+
+    Event Details:
+    - Event Type: {event_type}
+    - Total Budget: {total_budget} {currency}
+    - Number of Guests: {guest_count} (Vegetarian: {veg_count}, Non-vegetarian: {nonveg_count})
+    - Theme: {theme_name}
+    - Theme Description: {theme_description}
+    - Theme Aesthetic: {theme_aesthetic}
+
+    Budget Allocation Guidelines for {event_type}:
+    - Food should typically be around {food_ratio} of the total budget
+    - Entertainment should typically be around {entertainment_ratio} of the total budget
+    - Decorations should typically be around {decorations_ratio} of the total budget
+
+    Important Considerations:
+    1. For food, calculate based on the number of vegetarian and non-vegetarian guests using the per-guest cost guidelines.
+    2. For a theme like "{theme_name}", adjust the decoration and entertainment allocations to best achieve the aesthetic described.
+    3. The sum of all allocations must exactly equal the total budget of {total_budget} {currency}.
+    4. Round all amounts to whole numbers.
+    5. The keywords should match the theme's visual style.
+
+    Return only a JSON object with the following structure:
+    {{
+      "food": allocated_amount_for_food,
+      "entertainment": allocated_amount_for_entertainment,
+      "decorations": allocated_amount_for_decorations,
+      "total": total_budget,
+      "reasoning": "detailed explanation of your allocation decisions, including theme considerations",
+      "keywords": ["keyword1", "keyword2", "keyword3"]
+    }}
+    """)
+
+
+def allocate_budget_with_guided_llm(user_input, bypass_cache=False):
+    """
+    Allocates the total budget into categories (food, entertainment, decorations) using a hybrid approach:
+    1. Uses rule-based percentage guidelines based on event type.
+    2. Uses an LLM to refine the allocation specifically for the event's theme and detailed requirements.
+    3. Ensures the total sum exactly matches the budget.
+    """
+    chain = RoutedChain("budget_allocation", budget_prompt)
+    prompt_inputs = _budget_prompt_inputs(user_input)
+    total_budget = prompt_inputs["total_budget"]
     
     try:
         # Invoke the chain with proper error handling
-        response = chain.invoke({
-            "event_type": user_input.get("event_type", "Wedding"),
-            "total_budget": total_budget,
-            "currency": user_input.get("currency", "INR"),
-            "guest_count": user_input.get("guest_count", 100),
-            "veg_count": user_input.get("veg_count", 50),
-            "nonveg_count": user_input.get("nonveg_count", 50),
-            "theme_name": theme.get("Name", "Classic"),
-            "theme_description": theme.get("Description", "A traditional event"),
-            "theme_aesthetic": theme.get("Aesthetic/Visual Style", "Elegant and simple"),
-            "food_ratio": guidelines["food_ratio"],
-            "entertainment_ratio": guidelines["entertainment_ratio"],
-            "decorations_ratio": guidelines["decorations_ratio"],
-        })
+        response = chain.invoke(prompt_inputs, bypass=bypass_cache)
+        return _reconcile_allocation(response, total_budget)
         
-        json_match = re.search(r'(\{.*\})', response, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(1)
-            response_dict = json.loads(json_str)
-        else:
-            response_dict = json.loads(response)
-        
-        # Validate the allocation to ensure it matches the total budget
-        actual_total = response_dict.get("food", 0) + response_dict.get("entertainment", 0) + response_dict.get("decorations", 0)
-        if actual_total != total_budget:
-            # Adjust to match total budget (add/subtract from largest category)
-            diff = total_budget - actual_total
-            max_category = max(["food", "entertainment", "decorations"], 
-                              key=lambda x: response_dict.get(x, 0))
-            response_dict[max_category] += diff
-            response_dict["total"] = total_budget
-            response_dict["reasoning"] += f" (Adjusted {max_category} by {diff} to ensure total matches budget.)"
-        
-        return response_dict
-        
-    except json.JSONDecodeError as e:
+    except LLMOutputError as e:
         print(f"JSON parse error: {e}")
-        # Try to extract any valid JSON from the response
-        try:
-            json_pattern = r'(\{.*\})'
-            match = re.search(json_pattern, response, re.DOTALL)
-            if match:
-                json_str = match.group(1)
-                response_dict = json.loads(json_str)
-                return response_dict
-        except Exception as inner_e:
-            print(f"Failed to extract JSON with regex: {inner_e}")
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        return _default_allocation(total_budget, e)
+    except UpstreamUnavailable as e:
+        # Gemini is down, over quota or too slow on every tier: fall back to the rule-based allocation
+        print(f"Budget LLM unavailable, using rule-based allocation: {e}")
+        return dict(allocate_budget_rule_based(user_input), error=str(e))
+    except Exception as e:
+        print(f"Error during allocation: {e}")
+        return {"error": str(e)}
+
+
+async def aallocate_budget_with_guided_llm(user_input, bypass_cache=False):
+    """
+    Async version of allocate_budget_with_guided_llm.
+    """
+    chain = RoutedChain("budget_allocation", budget_prompt)
+    prompt_inputs = _budget_prompt_inputs(user_input)
+    total_budget = prompt_inputs["total_budget"]
+    
+    try:
+        response = await chain.ainvoke(prompt_inputs, bypass=bypass_cache)
+        return _reconcile_allocation(response, total_budget)
         
-        # Fallback: Return a default allocation
-        return {
-            "food": int(total_budget * 0.45),
-            "entertainment": int(total_budget * 0.25),
-            "decorations": int(total_budget * 0.30),
-            "total": total_budget,
-            "reasoning": "Default allocation due to response parsing error",
-            "error": str(e)
-        }
+    except LLMOutputError as e:
+        print(f"JSON parse error: {e}")
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        return _default_allocation(total_budget, e)
+    except UpstreamUnavailable as e:
+        # Gemini is down, over quota or too slow on every tier: fall back to the rule-based allocation
+        print(f"Budget LLM unavailable, using rule-based allocation: {e}")
+        return dict(allocate_budget_rule_based(user_input), error=str(e))
     except Exception as e:
         print(f"Error during allocation: {e}")
         return {"error": str(e)}
 
 
-def get_BudgetData(input_data):
+def allocate_budget_and_keywords(user_input, bypass_cache=False):
+    """
+    Asks the LLM for the budget allocation and the decoration search keywords in
+    one call, instead of one call each: the event and theme context is sent once.
+
+    Returns:
+        tuple: (allocation, keywords), the allocation adjusted to sum to the total budget.
+
+    Raises:
+        LLMOutputError: If either part of the response is invalid; the cached
+            response is dropped so the caller can fall back to the separate calls.
+        UpstreamUnavailable: If no model tier answered within the route's budget.
+    """
+    chain = RoutedChain("budget_keywords", fused_prompt)
+    prompt_inputs = _budget_prompt_inputs(user_input)
+    response = chain.invoke(prompt_inputs, bypass=bypass_cache)
+    try:
+        allocation, keywords = parse_budget_and_keywords(response)
+        return _reconcile_allocation(allocation, prompt_inputs["total_budget"]), keywords
+    except LLMOutputError:
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        raise
+
+
+async def aallocate_budget_and_keywords(user_input, bypass_cache=False):
+    """
+    Async version of allocate_budget_and_keywords.
+    """
+    chain = RoutedChain("budget_keywords", fused_prompt)
+    prompt_inputs = _budget_prompt_inputs(user_input)
+    response = await chain.ainvoke(prompt_inputs, bypass=bypass_cache)
+    try:
+        allocation, keywords = parse_budget_and_keywords(response)
+        return _reconcile_allocation(allocation, prompt_inputs["total_budget"]), keywords
+    except LLMOutputError:
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        raise
+
+
+def get_BudgetData(input_data, mode=None):
     """
     Wrapper function to generate budget allocation and structure the response.
+    By default the allocation is rule-based and needs no LLM call; with
+    BUDGET_REASONING_ENRICHMENT the LLM also writes richer reasoning in the background.
+    Pass mode="llm" (or set BUDGET_ALLOCATION_MODE) to ask the LLM for the allocation.
+    In "fused" mode the graph normally allocates with allocate_budget_and_keywords;
+    this wrapper only runs when that response was invalid, and then asks the LLM.
     Returns:
         dict: Combined dictionary of input event details and the calculated budget allocation.
     """
-    # Test the function
-    result = allocate_budget_with_guided_llm(input_data)
+    mode = mode or BUDGET_ALLOCATION_MODE
+    if mode in ("llm", "fused"):
+        result = allocate_budget_with_guided_llm(input_data)
+    else:
+        result = allocate_budget_rule_based(input_data)
+        if BUDGET_REASONING_ENRICHMENT:
+            request_reasoning_enrichment(input_data, result)
 
     combined_output = {
         "event_details": input_data,
@@ -157,4 +464,22 @@ def get_BudgetData(input_data):
     }
     return combined_output
 
+
+async def aget_BudgetData(input_data, mode=None):
+    """
+    Async version of get_BudgetData. The rule-based path needs no I/O and runs inline.
+    """
+    mode = mode or BUDGET_ALLOCATION_MODE
+    if mode in ("llm", "fused"):
+        result = await aallocate_budget_with_guided_llm(input_data)
+    else:
+        result = allocate_budget_rule_based(input_data)
+        if BUDGET_REASONING_ENRICHMENT:
+            request_reasoning_enrichment(input_data, result)
+
+    return {
+        "event_details": input_data,
+        "budget_allocation": result
+    }
+
 # print(get_BudgetData())
\ No newline at end of file
@@ -1,31 +1,29 @@
-from BudgetAllocation import (
-    llm,
-    get_BudgetData,
-    StrOutputParser,
-    PromptTemplate,
-    json
-)
+import json
+from langchain_core.prompts import PromptTemplate
+from BudgetAllocation import get_BudgetData
 import requests
+import requests.adapters
 import os
+import asyncio
+import weakref
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from dotenv import load_dotenv
+from productCache import get_product_cache, ProductSearchCache, PRODUCT_CACHE_DISABLED
+from singleFlight import get_single_flight
+from rateLimiter import RETRYABLE_STATUS, UpstreamError, get_upstream, parse_retry_after
+from planTracing import span, current_span
+from imageCache import prefetch_product_images
+from productRanking import (CANDIDATE_POOL_SIZE, candidate_from_product, parse_numbers, rank_products,
+                            warm_up as warm_up_ranking)
+from basketOptimizer import optimize_basket
+from modelRouter import RoutedChain, RouteUnavailable
+from llmOutputParser import LLMOutputError, parse_keywords
 
 load_dotenv()
 
-def get_amazon_products_for_decorations_with_allData(response_Dict):
-    """
-    Generates Amazon search keywords for decorations based on the event theme and budget using an LLM.
-    Then fetches actual product data from Amazon using the RapidAPI Real-Time Amazon Data API.
-    
-    Args:
-        response_Dict: Dictionary containing event details and budget allocation.
-        
-    Returns:
-        dict: The input dictionary updated with 'Decoration_Recommandations'.
-    """
-    # step 1 fetch busget data with event data
-    print(response_Dict)
-    # Step 2: Create Prompt Template
-    prompt_template = PromptTemplate.from_template("""
+# Keyword prompt only needs the event and theme, so it can run before the budget is known
+keyword_prompt = PromptTemplate.from_template("""
     You are an expert {event_type} planner.
     Suggest 3 main decoration product search keywords on Amazon for the following: also it should be easily available.
 
@@ -33,93 +31,500 @@ def get_amazon_products_for_decorations_with_allData(response_Dict):
     Theme: {theme_name}
     Theme Description: {theme_desc}
     Visual Style: {visual_style}
-    Total Budget: {decorations_budget} {currency}
-    Divide this {decorations_budget} by 3, that is the cost for each product keyword you generate.
+    Total Event Budget: {total_budget} {currency}
 
-    Just return a Python list like ["keyword1", "keyword2", amount_per_product, total_amount]
+    Just return a Python list like ["keyword1", "keyword2", "keyword3"]
     """)
-    print(response_Dict['event_details']['theme'],type(response_Dict['event_details']['theme']))
-    prompt_inputs = {
-        "event_type": response_Dict['event_details']['event_type'],
-        "currency": response_Dict['event_details']['currency'],
-        "theme_name": response_Dict['event_details']['theme']['Name'],  # Changed from 'Name' to 'theme_name'
-        "theme_desc": response_Dict['event_details']['theme']['Description'],  # Changed from 'Description' to 'description'
-        "visual_style": response_Dict['event_details']['theme']['Aesthetic/Visual Style'],  # Changed from 'Aesthetic/Visual Style' to 'aesthetic_visual_style'
-        "decorations_budget": response_Dict['budget_allocation']['decorations'],
+
+
+def _keyword_prompt_inputs(event_details):
+    theme = event_details['theme']
+    return {
+        "event_type": event_details['event_type'],
+        "currency": event_details['currency'],
+        "total_budget": event_details['total_budget'],
+        "theme_name": theme['Name'],
+        "theme_desc": theme['Description'],
+        "visual_style": theme['Aesthetic/Visual Style'],
     }
-    # Step 3: Get product keywords
-    chain = prompt_template | llm | StrOutputParser()
-    response = chain.invoke(prompt_inputs)
-    keyword_data = eval(response[10:-4])
+
+
+def fallback_decoration_keywords(event_details):
+    """
+    Builds search keywords from the event and theme names without an LLM, for
+    when the "decoration_keywords" route has no tier left within its latency budget.
+    """
+    event_type = str(event_details.get('event_type') or "party").strip().lower()
+    theme_name = str(event_details.get('theme', {}).get('Name') or event_type).strip().lower()
+    return [f"{theme_name} decorations", f"{event_type} backdrop", f"{event_type} balloon decoration kit"]
+
+
+def generate_decoration_keywords(event_details):
+    """
+    Generates Amazon search keywords for decorations from the event theme using an LLM.
+    Does not depend on the budget allocation, so it can run in parallel with it.
+
+    Args:
+        event_details: Event details including the selected theme.
+
+    Returns:
+        list: Search keywords; fallback_decoration_keywords when the route is unavailable.
+    """
+    prompt_inputs = _keyword_prompt_inputs(event_details)
+    chain = RoutedChain("decoration_keywords", keyword_prompt)
+    try:
+        response = chain.invoke(prompt_inputs)
+    except RouteUnavailable as e:
+        print(f"Keyword LLM unavailable, using fallback keywords: {e}")
+        return fallback_decoration_keywords(event_details)
+    try:
+        return parse_keywords(response)
+    except LLMOutputError:
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        raise
+
+
+async def agenerate_decoration_keywords(event_details):
+    """
+    Async version of generate_decoration_keywords.
+    """
+    prompt_inputs = _keyword_prompt_inputs(event_details)
+    chain = RoutedChain("decoration_keywords", keyword_prompt)
+    try:
+        response = await chain.ainvoke(prompt_inputs)
+    except RouteUnavailable as e:
+        print(f"Keyword LLM unavailable, using fallback keywords: {e}")
+        return fallback_decoration_keywords(event_details)
+    try:
+        return parse_keywords(response)
+    except LLMOutputError:
+        # Don't serve the unparseable response from the cache next time
+        chain.invalidate(prompt_inputs)
+        raise
+
+
+def apply_price_constraint(keywords, decorations_budget):
+    """
+    Joins the keywords with the decorations budget into the keyword data format
+    ["keyword1", "keyword2", amount_per_product, total_amount].
+    """
+    total_amount = int(decorations_budget)
+    amount_per_product = total_amount // len(keywords) if keywords else 0
+    return list(keywords) + [amount_per_product, total_amount]
+
+
+def get_amazon_products_for_decorations_with_allData(response_Dict):
+    """
+    Generates Amazon search keywords for decorations based on the event theme using an LLM,
+    splits the decorations budget across them, then fetches actual product data from Amazon
+    using the RapidAPI Real-Time Amazon Data API.
+    
+    Args:
+        response_Dict: Dictionary containing event details and budget allocation.
+        
+    Returns:
+        dict: The input dictionary updated with 'Decoration_Recommandations'.
+    """
+    keywords = generate_decoration_keywords(response_Dict['event_details'])
+    keyword_data = apply_price_constraint(keywords, response_Dict['budget_allocation']['decorations'])
     result = fetch_amazon_products_from_keywords(keyword_data)
     response_Dict["Decoration_Recommandations"] = result
     return response_Dict
 
-def fetch_amazon_products_from_keywords(keyword_data):
-    """
-    Fetches product information from Amazon for the generated keywords.
-    Uses RapidAPI to search for products within the allocated per-item budget.
-    """
-    keywords = keyword_data[:-2]
-    amount_per_product = keyword_data[-2]
-    total_amount = keyword_data[-1]
 
-    url = "https://real-time-amazon-data.p.rapidapi.com/search"
+RAPIDAPI_HOST = "real-time-amazon-data.p.rapidapi.com"
+# Overridable so benchmarks can point searches at a local stand-in
+RAPIDAPI_SEARCH_URL = os.getenv("RAPIDAPI_SEARCH_URL", f"https://{RAPIDAPI_HOST}/search")
+
+# Per-request timeout (connect, read) and deadline for the whole keyword batch, in seconds
+REQUEST_TIMEOUT = (3.05, 10)
+FETCH_DEADLINE_SECONDS = 15
+MAX_FETCH_WORKERS = 8
+# Result pages requested per keyword while the candidate pool is still short of CANDIDATE_POOL_SIZE
+SEARCH_MAX_PAGES = int(os.getenv("SEARCH_MAX_PAGES", 3))
+
+# One pooled session and one bounded pool shared by every plan in this process
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_FETCH_WORKERS))
+_fetch_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix="amazon-fetch")
+# Identical searches in flight at the same time share one RapidAPI request
+_search_flight = get_single_flight("product_search")
+# Quota, retries and circuit breaker shared by every RapidAPI request in this process
+_rapidapi = get_upstream("rapidapi")
 
+
+def _search_request(keyword, amount_per_product, page=1):
+    """
+    Returns the RapidAPI headers and query parameters for one page of a keyword search.
+    """
     headers = {
         "x-rapidapi-key": os.getenv("RAPIDAPI_KEY"),
-        "x-rapidapi-host": "real-time-amazon-data.p.rapidapi.com"
+        "x-rapidapi-host": RAPIDAPI_HOST
     }
+    querystring = {
+        "query":keyword,
+        "page":str(page),
+        "country":"IN",
+        "sort_by":"RELEVANCE",
+        "max_price":amount_per_product,
+        "product_condition":"ALL",
+        "is_prime":"false",
+        "deals_and_discounts":"NONE"
+        }
+    return headers, querystring
+
+
+def _page_products(data):
+    return data.get("data", {}).get("products", []) if data.get("status") == "OK" else []
+
+
+def _next_page(pages):
+    """
+    Returns the next page to request for a keyword search, or None once the pages
+    fetched so far fill the candidate pool, the results run out or SEARCH_MAX_PAGES is reached.
+    """
+    last = pages[-1]
+    products = _page_products(last)
+    found = sum(len(_page_products(data)) for data in pages)
+    total = last.get("data", {}).get("total_products")
+    if (not products or found >= CANDIDATE_POOL_SIZE or len(pages) >= SEARCH_MAX_PAGES
+            or (isinstance(total, int) and found >= total)):
+        return None
+    return len(pages) + 1
+
+
+def _parse_search_response(keyword, amount_per_product, pages, use_cache=True):
+    """
+    Turns the RapidAPI response pages of a search into the {"keyword", "candidates"} block;
+    the candidates are ranked into "items" when the results are assembled. Products
+    repeated across pages are kept once. Successful searches are written to the
+    product search cache.
+    """
+    first = pages[0]
+    if first.get("status") == "OK":
+        products, seen = [], set()
+        for data in pages:
+            for product in _page_products(data):
+                product_id = product.get("asin") or product.get("product_url")
+                if product_id is not None and product_id in seen:
+                    continue
+                seen.add(product_id)
+                products.append(product)
+        block = {
+            "keyword": keyword,
+            "candidates": [candidate_from_product(product) for product in products[:CANDIDATE_POOL_SIZE]]
+        }
+        if use_cache:
+            get_product_cache().set(keyword, amount_per_product, block)
+        return block
+    return {
+        "keyword": keyword,
+        "items": [],
+        "error": first.get("error", "Unknown error")
+    }
+
+
+def _check_status(res):
+    """
+    Raises UpstreamError for responses worth retrying (429 and 5xx), with their Retry-After.
+    """
+    if res.status_code in RETRYABLE_STATUS:
+        raise UpstreamError(f"RapidAPI returned HTTP {res.status_code}", res.status_code,
+                            parse_retry_after(res.headers.get("Retry-After")))
+    return res
+
+
+def _search_attempt(headers, querystring):
+    return _check_status(_session.get(RAPIDAPI_SEARCH_URL, headers=headers, params=querystring,
+                                      timeout=REQUEST_TIMEOUT))
+
+
+def _search_keyword(keyword, amount_per_product, use_cache=True):
+    """
+    Searches RapidAPI for a single keyword and returns its {"keyword", "items"} block,
+    or None if the first request failed. Further result pages are requested one at a
+    time until the candidate pool is full (see _next_page). Requests wait for the
+    RapidAPI quota and are retried with backoff on 429s, server errors and connection errors.
+    """
+    pages = []
+    page = 1
+    while page is not None:
+        headers, querystring = _search_request(keyword, amount_per_product, page)
+        with span("rapidapi.search", "http", keyword=keyword, page=page, retries=0) as s:
+            try:
+                res = _rapidapi.call(_search_attempt, headers, querystring)
+                s.set(status_code=res.status_code, response_bytes=len(res.content))
+                pages.append(res.json())
+            except Exception as e:
+                # Failed keywords are skipped; the span keeps the error
+                s.error = f"{type(e).__name__}: {e}"
+                if not pages:
+                    return None
+                # Keep the pages already fetched, but don't cache the short pool
+                use_cache = False
+                break
+        page = _next_page(pages)
+    return _parse_search_response(keyword, amount_per_product, pages, use_cache)
 
+
+def _flight_key(keyword, amount_per_product):
+    return f"{ProductSearchCache.make_key(keyword, amount_per_product)}|{amount_per_product}"
+
+
+def _coalesced_search(keyword, amount_per_product, use_cache=True):
+    """
+    _search_keyword, sharing one request among concurrent identical searches.
+    """
+    block, _ = _search_flight.do(_flight_key(keyword, amount_per_product),
+                                 _search_keyword, keyword, amount_per_product, use_cache)
+    return dict(block, keyword=keyword) if block is not None else None
+
+
+def _within_price(block, amount_per_product):
+    """
+    Drops the candidates priced above amount_per_product from a cached block. Cache keys
+    bucket the price (PRICE_BUCKET_SIZE), so a block cached for a higher limit in the
+    same bucket can hold them. Candidates without a readable price are kept.
+    """
+    candidates = block.get("candidates")
+    if not candidates:
+        return block
+    prices = parse_numbers([candidate.get("price") for candidate in candidates])
+    # NaN (no price) compares False, so those stay
+    kept = [candidate for candidate, price in zip(candidates, prices) if not price > amount_per_product]
+    return dict(block, candidates=kept)
+
+
+def _cached_blocks(keywords, amount_per_product, use_cache):
+    """
+    Returns the cached {"keyword", "items"} blocks for the keywords that are in the
+    product cache, without candidates above amount_per_product.
+    """
+    cached = {}
+    if use_cache:
+        cache = get_product_cache()
+        for keyword in keywords:
+            with span("product_cache", "cache", keyword=keyword) as s:
+                block = cache.get(keyword, amount_per_product)
+                s.set(cache="hit" if block is not None else "miss")
+            if block is not None:
+                cached[keyword] = dict(_within_price(block, amount_per_product), keyword=keyword)
+    return cached
+
+
+def _assemble_results(keyword_data, blocks):
+    """
+    Builds the results dict in keyword order from per-keyword blocks, ranking the
+    candidates of all keywords in one pass and choosing a basket that fits the budget.
+    A missing keyword timed out; a None block means the request failed and is skipped.
+    """
+    keywords = keyword_data[:-2]
     results = {
         "keywords": keywords,
-        "amount_per_product": amount_per_product,
-        "total_amount": total_amount,
+        "amount_per_product": keyword_data[-2],
+        "total_amount": keyword_data[-1],
         "products": []
     }
-
     for keyword in keywords:
-        querystring = {
-            "query":keyword,
-            "page":"1",
-            "country":"IN",
-            "sort_by":"RELEVANCE",
-            "max_price":amount_per_product,
-            "product_condition":"ALL",
-            "is_prime":"false",
-            "deals_and_discounts":"NONE"
-            }
-
-
-        try:
-            res = requests.get(url, headers=headers, params=querystring)
-            data = res.json()
-        except Exception as e:
-            print(f"Error fetching keyword '{keyword}': {e}")
-            continue
-
-        if data.get("status") == "OK":
-            keyword_products = []
-            for product in data.get("data", {}).get("products", [])[:5]:  # Top 5 results
-                keyword_products.append({
-                    "title": product.get("product_title", "Not Available"),
-                    "price": product.get("product_price", "Not Available"),
-                    "url": product.get("product_url", "Not Available"),
-                    "rating": product.get("product_star_rating", "Not Available"),
-                    "imageUrl": product.get("product_photo", "Not Available")
-                })
-            results["products"].append({
-                "keyword": keyword,
-                "items": keyword_products
-            })
-        else:
+        if keyword not in blocks:
+            if current_span() is not None:
+                current_span().add("timed_out_keywords")
             results["products"].append({
                 "keyword": keyword,
                 "items": [],
-                "error": data.get("error", "Unknown error")
+                "error": "Timed out"
             })
+        elif blocks[keyword] is not None:
+            results["products"].append(blocks[keyword])
+
+    with span("rank_products", "compute") as s:
+        s.set(candidates=sum(len(block.get("candidates", [])) for block in results["products"]))
+        results["products"] = rank_products(results["products"], results["amount_per_product"])
+
+    with span("optimize_basket", "compute") as s:
+        results["basket"] = optimize_basket(results)
+        s.set(basket_items=len(results["basket"]["items"]))
+    return results
+
+
+def _streamed_block(block, amount_per_product, on_block):
+    """
+    Ranks a single keyword block as soon as it arrives and hands it to on_block.
+    Without a callback the block is kept as is and ranked with the others at assembly.
+    """
+    if on_block is None or block is None:
+        return block
+    block = rank_products([block], amount_per_product)[0]
+    on_block(block)
+    return block
+
+
+def fetch_amazon_products_from_keywords(keyword_data, deadline=FETCH_DEADLINE_SECONDS, use_cache=True,
+                                        on_block=None):
+    """
+    Fetches product information from Amazon for the generated keywords.
+    Uses RapidAPI to search for products within the allocated per-item budget.
+    Keywords are searched concurrently over a pooled session; results keep keyword order.
+    Searches already in the on-disk product cache are answered without calling RapidAPI.
+    Product photo thumbnails are prefetched in the background once the results are in.
+
+    Args:
+        keyword_data: List like ["keyword1", "keyword2", amount_per_product, total_amount].
+        deadline: Seconds to wait for the whole batch; slower keywords are reported as timed out.
+        use_cache: Set to False to bypass the product search cache (or set PRODUCT_CACHE_DISABLED=1).
+        on_block: Optional callback, called with each keyword's ranked {"keyword", "items"}
+            block as soon as its search completes (cached keywords first), e.g. to stream
+            the products into the UI. Failed and timed-out searches are not passed to it.
+    """
+    keywords = keyword_data[:-2]
+    amount_per_product = keyword_data[-2]
+    use_cache = use_cache and not PRODUCT_CACHE_DISABLED
+
+    if on_block is not None:
+        # Streamed blocks are ranked one by one; load the ranking libraries during the searches
+        _fetch_executor.submit(warm_up_ranking)
+    # Answer what we can from the cache and only search the misses
+    blocks = _cached_blocks(keywords, amount_per_product, use_cache)
+    for keyword in keywords:
+        if keyword in blocks:
+            blocks[keyword] = _streamed_block(blocks[keyword], amount_per_product, on_block)
+    # Each search runs in a copy of this context so its spans nest under the caller's
+    futures = {
+        _fetch_executor.submit(contextvars.copy_context().run,
+                               _coalesced_search, keyword, amount_per_product, use_cache): keyword
+        for keyword in keywords if keyword not in blocks
+    }
+    try:
+        for future in as_completed(futures, timeout=deadline):
+            blocks[futures[future]] = _streamed_block(future.result(), amount_per_product, on_block)
+    except FuturesTimeoutError:
+        for future in futures:
+            future.cancel()
+
+    results = _assemble_results(keyword_data, blocks)
+    # Start downloading the product thumbnails before the UI asks for them
+    prefetch_product_images(results)
+    return results
+
+
+# One async HTTP client per event loop, reused by every plan running on that loop,
+# kept with the generator that closes it
+_async_clients = weakref.WeakKeyDictionary()
+
+
+async def _close_on_loop_shutdown(client):
+    """
+    Suspends until the event loop finalizes its async generators on shutdown
+    (asyncio.run does, via loop.shutdown_asyncgens), then closes the client.
+    """
+    try:
+        yield
+    finally:
+        await client.aclose()
+
+
+async def _get_async_client():
+    loop = asyncio.get_running_loop()
+    entry = _async_clients.get(loop)
+    if entry is None:
+        # Imported on first async fetch; the sync path never needs httpx
+        import httpx
+
+        client = httpx.AsyncClient(
+            timeout=httpx.Timeout(REQUEST_TIMEOUT[1], connect=REQUEST_TIMEOUT[0]),
+            limits=httpx.Limits(max_connections=MAX_FETCH_WORKERS * 4, max_keepalive_connections=MAX_FETCH_WORKERS),
+        )
+        closer = _close_on_loop_shutdown(client)
+        # Started on this loop, so the loop tracks it until shutdown
+        await closer.__anext__()
+        entry = _async_clients[loop] = (client, closer)
+    return entry[0]
+
+
+async def _asearch_attempt(headers, querystring):
+    import httpx
+
+    try:
+        client = await _get_async_client()
+        res = await client.get(RAPIDAPI_SEARCH_URL, headers=headers, params=querystring)
+    except httpx.TransportError as e:
+        # Connection errors and timeouts are retried like in the sync path
+        raise UpstreamError(f"{type(e).__name__}: {e}") from e
+    return _check_status(res)
+
+
+async def _asearch_keyword(keyword, amount_per_product, use_cache=True):
+    """
+    Async version of _search_keyword over the shared httpx client.
+    """
+    pages = []
+    page = 1
+    while page is not None:
+        headers, querystring = _search_request(keyword, amount_per_product, page)
+        with span("rapidapi.search", "http", keyword=keyword, page=page, retries=0) as s:
+            try:
+                res = await _rapidapi.acall(_asearch_attempt, headers, querystring)
+                s.set(status_code=res.status_code, response_bytes=len(res.content))
+                pages.append(res.json())
+            except Exception as e:
+                s.error = f"{type(e).__name__}: {e}"
+                if not pages:
+                    return None
+                use_cache = False
+                break
+        page = _next_page(pages)
+    if use_cache:
+        # Writes the product cache (SQLite), so keep it off the event loop
+        return await asyncio.to_thread(_parse_search_response, keyword, amount_per_product, pages, use_cache)
+    return _parse_search_response(keyword, amount_per_product, pages, use_cache)
+
+
+async def _acoalesced_search(keyword, amount_per_product, use_cache=True):
+    """
+    _asearch_keyword, sharing one request among concurrent identical searches on the loop.
+    """
+    block, _ = await _search_flight.ado(_flight_key(keyword, amount_per_product),
+                                        _asearch_keyword, keyword, amount_per_product, use_cache)
+    return dict(block, keyword=keyword) if block is not None else None
+
+
+async def afetch_amazon_products_from_keywords(keyword_data, deadline=FETCH_DEADLINE_SECONDS, use_cache=True,
+                                               on_block=None):
+    """
+    Async version of fetch_amazon_products_from_keywords. Keywords are searched
+    concurrently on the running event loop; the result has the same structure and order.
+    """
+    keywords = keyword_data[:-2]
+    amount_per_product = keyword_data[-2]
+    use_cache = use_cache and not PRODUCT_CACHE_DISABLED
+
+    # Product cache reads are SQLite queries, so they run off the event loop
+    blocks = await asyncio.to_thread(_cached_blocks, keywords, amount_per_product, use_cache) if use_cache else {}
+    for keyword in keywords:
+        if keyword in blocks:
+            blocks[keyword] = _streamed_block(blocks[keyword], amount_per_product, on_block)
+    tasks = {
+        asyncio.ensure_future(_acoalesced_search(keyword, amount_per_product, use_cache)): keyword
+        for keyword in keywords if keyword not in blocks
+    }
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    pending = set(tasks)
+    while pending:
+        done, pending = await asyncio.wait(pending, timeout=max(0.0, end - loop.time()),
+                                           return_when=asyncio.FIRST_COMPLETED)
+        if not done:
+            break
+        for task in done:
+            blocks[tasks[task]] = _streamed_block(task.result(), amount_per_product, on_block)
 
+    for task in pending:
+        task.cancel()
 
+    results = _assemble_results(keyword_data, blocks)
+    # Start downloading the product thumbnails before the UI asks for them
+    prefetch_product_images(results)
     return results
 
 # response_Dict = get_BudgetData()
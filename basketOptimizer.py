@@ -0,0 +1,143 @@
+import os
+import math
+from productRanking import parse_numbers
+
+# Basket settings, overridable from the environment
+# Most units of one product the basket may hold
+BASKET_MAX_QUANTITY = int(os.getenv("BASKET_MAX_QUANTITY", 3))
+# The budget is split into this many integer cells for the knapsack; prices are
+# rounded up to whole cells, so the basket never exceeds the budget and leaves at
+# most one cell per keyword unused
+BASKET_RESOLUTION = int(os.getenv("BASKET_RESOLUTION", 2000))
+# Value added for covering a keyword at all; product scores are in [0, 1], so
+# covering one more keyword always beats upgrading another one
+COVERAGE_BONUS = 1.0
+# Each extra unit of the same product is worth this fraction of the previous one
+QUANTITY_DECAY = 0.5
+# Value of products without a ranking score (e.g. older cache entries)
+DEFAULT_PRODUCT_SCORE = 0.5
+
+
+def _options(blocks, budget):
+    """
+    Lists every (keyword block, item, quantity) choice that fits the budget on its own.
+
+    Returns:
+        list: One list of (item, quantity, cost, value) tuples per block.
+    """
+    items = [item for block in blocks for item in block.get("items", [])]
+    prices = parse_numbers([item.get("price") for item in items]) if items else []
+
+    options, row = [], 0
+    for block in blocks:
+        group = []
+        for item in block.get("items", []):
+            # Plain floats, so the basket serializes into checkpoints
+            price = float(prices[row])
+            row += 1
+            if not (price > 0):
+                continue
+            score = item.get("score", DEFAULT_PRODUCT_SCORE)
+            for quantity in range(1, BASKET_MAX_QUANTITY + 1):
+                cost = price * quantity
+                if cost > budget:
+                    break
+                # score * (1 + decay + decay^2 + ...) for quantity units
+                value = COVERAGE_BONUS + score * (1 - QUANTITY_DECAY ** quantity) / (1 - QUANTITY_DECAY)
+                group.append((item, quantity, cost, value))
+        options.append(group)
+    return options
+
+
+def optimize_basket(decoration_results, budget=None):
+    """
+    Chooses a concrete basket across the keyword results that fits the decorations
+    budget: at most one product per keyword, in a quantity up to BASKET_MAX_QUANTITY,
+    maximizing keyword coverage first and product scores second.
+
+    Solved as a multiple-choice knapsack with dynamic programming over the budget
+    split into at most BASKET_RESOLUTION cells; each keyword's options are applied
+    to the whole DP row at once with NumPy.
+
+    Args:
+        decoration_results (dict): Output of fetch_amazon_products_from_keywords.
+        budget: Spending limit; defaults to the results' "total_amount".
+
+    Returns:
+        dict: {"items": [...], "budget", "total_cost", "remaining_budget", "score"}.
+              Each item holds keyword, title, url, imageUrl, price, unit_price,
+              quantity and line_total.
+    """
+    if budget is None:
+        budget = decoration_results.get("total_amount", 0)
+    try:
+        budget = float(budget)
+    except (TypeError, ValueError):
+        budget = 0.0
+
+    blocks = [block for block in decoration_results.get("products", []) if block.get("items")]
+    groups = _options(blocks, budget) if budget > 0 else []
+    if not any(groups):
+        return {"items": [], "budget": budget, "total_cost": 0.0, "remaining_budget": budget, "score": 0.0}
+
+    import numpy as np
+
+    cells = max(1, min(BASKET_RESOLUTION, math.ceil(budget)))
+    cell_size = budget / cells
+    capacity = np.arange(cells + 1)
+
+    # best[c]: highest value using at most c cells over the keywords so far
+    best = np.zeros(cells + 1)
+    choices = []
+    for group in groups:
+        if not group:
+            choices.append(None)
+            continue
+        # Small epsilon so exact multiples of the cell size do not round up a cell
+        weights = np.array([math.ceil(cost / cell_size - 1e-9) for _, _, cost, _ in group])
+        values = np.array([value for _, _, _, value in group])
+        # Only options worth more than every cheaper one can ever be picked
+        order = np.lexsort((-values, weights))
+        previous_best = np.maximum.accumulate(np.concatenate(([-np.inf], values[order][:-1])))
+        useful = np.sort(order[values[order] > previous_best])
+        group = [group[i] for i in useful]
+        weights, values = weights[useful], values[useful]
+        remaining = capacity[None, :] - weights[:, None]
+        candidates = np.where(remaining >= 0, best[np.maximum(remaining, 0)] + values[:, None], -np.inf)
+        pick = candidates.argmax(axis=0)
+        picked_value = candidates[pick, capacity]
+        improved = picked_value > best
+        choices.append((group, weights, np.where(improved, pick, -1)))
+        best = np.where(improved, picked_value, best)
+
+    # Walk back from the full budget to recover the chosen option per keyword
+    chosen, cell = [], cells
+    for block, choice in zip(reversed(blocks), reversed(choices)):
+        if choice is None:
+            continue
+        group, weights, pick = choice
+        option = int(pick[cell])
+        if option < 0:
+            continue
+        item, quantity, cost, _ = group[option]
+        cell -= int(weights[option])
+        chosen.append({
+            "keyword": block.get("keyword"),
+            "title": item.get("title"),
+            "url": item.get("url"),
+            "imageUrl": item.get("imageUrl"),
+            "price": item.get("price"),
+            "unit_price": round(cost / quantity, 2),
+            "quantity": quantity,
+            "line_total": round(cost, 2),
+        })
+    chosen.reverse()
+
+    total_cost = round(sum(item["line_total"] for item in chosen), 2)
+    return {
+        "items": chosen,
+        "budget": budget,
+        "total_cost": total_cost,
+        "remaining_budget": round(budget - total_cost, 2),
+        "score": round(float(best[cells]), 4),
+    }
@@ -0,0 +1,175 @@
+"""
+Headless batch planner: plans many events from a CSV or JSONL file.
+
+Each input row needs event_type, total_budget and guest_count, and may set
+currency, food_guest_per_person, veg_count, nonveg_count and theme_index.
+Plans are written to a JSONL file as soon as each one completes.
+
+Usage:
+    python batchPlanner.py events.csv --output plans.jsonl --concurrency 8
+"""
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from langgprahCode import run_event_planning
+from themeBaseCode import generate_themes, invalidate_theme_cache
+from llmOutputParser import LLMOutputError, parse_themes
+
+NUMERIC_FIELDS = ("total_budget", "guest_count", "food_guest_per_person", "veg_count", "nonveg_count", "theme_index")
+
+
+def load_events(path):
+    """
+    Loads event rows from a .csv or .jsonl file, converting numeric fields to numbers.
+    """
+    with open(path, encoding="utf-8") as f:
+        if os.path.splitext(path)[1].lower() == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    events = []
+    for row in rows:
+        event = {k: v for k, v in row.items() if v not in ("", None)}
+        for field in NUMERIC_FIELDS:
+            if field in event:
+                event[field] = int(float(event[field]))
+        event.setdefault("currency", "INR")
+        events.append(event)
+    return events
+
+
+def _percentile(values, pct):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def plan_event(event, default_theme_index=1):
+    """
+    Generates themes for one event, picks one and runs the planning graph.
+
+    Args:
+        event (dict): Event row; its theme_index (1-based) overrides default_theme_index.
+        default_theme_index (int): Theme to pick when the row does not choose one.
+
+    Returns:
+        dict: Record with the selected theme index, the plan and per-stage timings in seconds.
+    """
+    user_input = {k: v for k, v in event.items() if k != "theme_index"}
+    user_input.setdefault("veg_count", user_input.get("guest_count", 0))
+    user_input.setdefault("nonveg_count", 0)
+    timings = {}
+
+    start = time.perf_counter()
+    try:
+        themes = parse_themes(generate_themes(user_input))
+    except LLMOutputError:
+        invalidate_theme_cache(user_input)
+        raise
+    timings["theme_generation"] = time.perf_counter() - start
+
+    theme_index = min(int(event.get("theme_index", default_theme_index)), len(themes))
+    graph_state = {
+        "event_data": user_input,
+        "themes_json": themes,
+        "selected_theme_index": theme_index,
+        "event_details": {},
+        "budget_allocation": {},
+        "Decoration_Recommandations": {}
+    }
+    plan = run_event_planning(graph_state, stage_timings=timings)
+    timings["total"] = time.perf_counter() - start
+
+    return {
+        "theme_index": theme_index,
+        "plan": {
+            "event_details": plan.get("event_details", {}),
+            "budget_allocation": plan.get("budget_allocation", {}),
+            "Decoration_Recommandations": plan.get("Decoration_Recommandations", {}),
+        },
+        "timings": timings,
+    }
+
+
+def run_batch(events, output_path, concurrency=4, default_theme_index=1):
+    """
+    Plans every event with bounded concurrency, appending each result to a JSONL
+    file as it completes. All plans share the compiled graph and connection pools.
+
+    Returns:
+        dict: Summary with counts, throughput in plans/sec and per-stage latency percentiles.
+    """
+    stage_latencies = {}
+    succeeded = 0
+    failed = 0
+    write_lock = threading.Lock()
+
+    start = time.perf_counter()
+    with open(output_path, "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-plan") as executor:
+        futures = {executor.submit(plan_event, event, default_theme_index): i for i, event in enumerate(events)}
+        for future in as_completed(futures):
+            row = futures[future]
+            record = {"row": row, "input": events[row]}
+            try:
+                record.update(future.result())
+                succeeded += 1
+                for stage, seconds in record["timings"].items():
+                    stage_latencies.setdefault(stage, []).append(seconds)
+            except Exception as e:
+                print(f"Planning failed for row {row}: {e}")
+                record["error"] = str(e)
+                failed += 1
+            with write_lock:
+                out.write(json.dumps(record, default=str) + "\n")
+                out.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "events": len(events),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "plans_per_second": succeeded / elapsed if elapsed else 0.0,
+        "stage_latency_seconds": {
+            stage: {
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "p99": _percentile(values, 99),
+            }
+            for stage, values in stage_latencies.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan many events from a CSV or JSONL file.")
+    parser.add_argument("input", help="CSV or JSONL file of events")
+    parser.add_argument("--output", default="plans.jsonl", help="JSONL file to write plans to")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of plans run at once")
+    parser.add_argument("--theme-index", type=int, default=1,
+                        help="Theme (1-based) to pick for rows without a theme_index")
+    args = parser.parse_args()
+
+    events = load_events(args.input)
+    summary = run_batch(events, args.output, args.concurrency, args.theme_index)
+
+    print(f"Planned {summary['succeeded']}/{summary['events']} events in {summary['elapsed_seconds']:.1f}s "
+          f"({summary['plans_per_second']:.2f} plans/sec), {summary['failed']} failed")
+    print(f"{'stage':<20} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}")
+    for stage, pcts in summary["stage_latency_seconds"].items():
+        print(f"{stage:<20} {pcts['p50']:>9.3f} {pcts['p95']:>9.3f} {pcts['p99']:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
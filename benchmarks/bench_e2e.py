@@ -0,0 +1,330 @@
+"""
+Offline end-to-end benchmark of theme generation plus run_event_planning.
+
+Gemini is replaced by FakeGeminiModel and RapidAPI by a local stand-in server
+(see offline_standins.py), both answering with recorded payloads after a
+configurable latency, so no API keys or network access are needed. Each
+scenario runs in a fresh interpreter and reports end-to-end and per-stage
+p50/p95/p99 latency, throughput and peak memory. The results are compared
+against the committed baseline (benchmarks/e2e_baseline.json, or --baseline)
+and the script exits non-zero on a regression.
+
+Usage:
+    python benchmarks/bench_e2e.py [--scenarios sequential concurrent] [--llm-latency 0.2 --api-latency 0.15]
+    python benchmarks/bench_e2e.py --save-baseline benchmarks/e2e_baseline.json
+    python benchmarks/bench_e2e.py --baseline other_run.json --max-regression 15
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Run with the default latencies and the offline stand-ins; compared against by default
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "e2e_baseline.json")
+
+# Standard scenarios. "cache" keeps the LLM and product caches on and repeats one
+# event; otherwise both caches are disabled and every plan gets a distinct event.
+# "api_quota" makes the stand-in answer 429 above that many searches per second;
+# "rapidapi_rps" sizes the planner's RapidAPI rate limiter (0 = no limiter).
+# "large_llm_latency" makes the large model tier that slow; "llm_routes" is passed
+# to the planner as LLM_ROUTES (see modelRouter.ROUTES).
+SCENARIOS = {
+    "sequential": {"plans": 20, "concurrency": 1, "async": False, "cache": False, "budget_mode": "rules"},
+    "concurrent": {"plans": 48, "concurrency": 8, "async": False, "cache": False, "budget_mode": "rules"},
+    "async": {"plans": 48, "concurrency": 8, "async": True, "cache": False, "budget_mode": "rules"},
+    "llm_budget": {"plans": 24, "concurrency": 4, "async": False, "cache": False, "budget_mode": "llm"},
+    "fused_llm": {"plans": 24, "concurrency": 4, "async": False, "cache": False, "budget_mode": "fused"},
+    "warm_cache": {"plans": 48, "concurrency": 8, "async": False, "cache": True, "budget_mode": "rules"},
+    "quota_limited": {"plans": 48, "concurrency": 8, "async": False, "cache": False, "budget_mode": "rules",
+                      "api_quota": 20, "rapidapi_rps": 20},
+    "quota_unlimited": {"plans": 48, "concurrency": 8, "async": False, "cache": False, "budget_mode": "rules",
+                        "api_quota": 20, "rapidapi_rps": 0},
+    "slow_large_model": {"plans": 24, "concurrency": 4, "async": False, "cache": False, "budget_mode": "llm",
+                         "large_llm_latency": 3.0,
+                         "llm_routes": {"theme_generation": {"timeout": 1.0}, "budget_allocation": {"timeout": 1.0}}},
+}
+
+EVENT_TYPES = ["Birthday Party", "Wedding", "Corporate Event", "Baby Shower", "Anniversary", "Engagement"]
+
+# Stage spans reported per plan, besides the end-to-end total
+STAGES = ["theme_generation", "theme_selection", "budget_step", "keyword_step", "budget_keyword_step",
+          "decoration_step"]
+
+
+def make_events(count, distinct=True):
+    events = []
+    for i in range(count):
+        n = i if distinct else 0
+        guests = 50 + (n % 6) * 25
+        events.append({
+            "event_type": EVENT_TYPES[n % len(EVENT_TYPES)],
+            "total_budget": 100000 + n * 10000,
+            "currency": "INR",
+            "guest_count": guests,
+            "food_guest_per_person": 300,
+            "veg_count": guests // 2,
+            "nonveg_count": guests - guests // 2,
+        })
+    return events
+
+
+def peak_memory_mb():
+    """
+    Peak resident set size of this process in MB, or None where unavailable.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def run_scenario(name, llm_latency, api_latency, jitter):
+    """
+    Runs one scenario in this process. Must be called before any planner module
+    is imported, since the planner reads its settings from the environment.
+
+    Returns:
+        dict: Counts, throughput, per-stage latency percentiles and peak memory.
+    """
+    scenario = SCENARIOS[name]
+    workdir = tempfile.mkdtemp(prefix=f"bench_e2e_{name}_")
+    os.environ.update({
+        "LLM_CACHE_DISABLED": "0" if scenario["cache"] else "1",
+        "PRODUCT_CACHE_DISABLED": "0" if scenario["cache"] else "1",
+        # The recorded product photos are not served offline
+        "IMAGE_PREFETCH_DISABLED": "1",
+        "PRODUCT_CACHE_PATH": os.path.join(workdir, "product_cache.sqlite3"),
+        "BUDGET_ALLOCATION_MODE": scenario["budget_mode"],
+        "TRACE_BUFFER_SIZE": "200000",
+        "TRACE_JSONL_PATH": "",
+        # The stand-ins have no quota unless the scenario sets one
+        "GEMINI_REQUESTS_PER_MINUTE": "0",
+        "RAPIDAPI_REQUESTS_PER_SECOND": str(scenario.get("rapidapi_rps", 0)),
+        "RAPIDAPI_BURST": str(scenario.get("rapidapi_rps", 0) or 1),
+        "LLM_ROUTES": json.dumps(scenario.get("llm_routes", {})),
+    })
+
+    from offline_standins import FakeGeminiModel, RapidAPIStandIn, load_payloads
+
+    payloads = load_payloads()
+    with RapidAPIStandIn(payloads["search_response"], latency=api_latency, jitter=jitter,
+                         quota=scenario.get("api_quota", 0)) as api:
+        os.environ["RAPIDAPI_SEARCH_URL"] = api.search_url
+        os.environ.setdefault("RAPIDAPI_KEY", "offline-benchmark")
+
+        from llmClient import set_llm
+        from llmOutputParser import parse_themes
+        from planTracing import span, get_recent_spans, get_span_recorder
+        from themeBaseCode import generate_themes, agenerate_themes
+        from langgprahCode import run_event_planning, arun_event_planning
+        from batchPlanner import _percentile as percentile
+
+        set_llm(FakeGeminiModel(payloads=payloads, latency=llm_latency, jitter=jitter))
+        if "large_llm_latency" in scenario:
+            set_llm(FakeGeminiModel(payloads=payloads, latency=scenario["large_llm_latency"], jitter=jitter,
+                                    model="fake-gemini-large"), "large")
+
+        def initial_state(event, themes):
+            return {
+                "event_data": event,
+                "themes_json": themes,
+                "selected_theme_index": 1,
+                "event_details": {},
+                "budget_allocation": {},
+                "Decoration_Recommandations": {}
+            }
+
+        def plan(event):
+            with span("bench_plan", "bench"):
+                themes = parse_themes(generate_themes(event))
+                return run_event_planning(initial_state(event, themes))
+
+        async def aplan(event, semaphore):
+            async with semaphore:
+                with span("bench_plan", "bench"):
+                    themes = parse_themes(await agenerate_themes(event))
+                    return await arun_event_planning(initial_state(event, themes))
+
+        async def arun_all(events):
+            semaphore = asyncio.Semaphore(scenario["concurrency"])
+            return await asyncio.gather(*(aplan(e, semaphore) for e in events), return_exceptions=True)
+
+        # Warm up imports, graph compilation and connection pools outside the measurement
+        warmup = make_events(1, distinct=False)[0]
+        warmup["total_budget"] = 10 ** 7
+        plan(warmup)
+        get_span_recorder().clear()
+
+        events = make_events(scenario["plans"], distinct=not scenario["cache"])
+        start = time.perf_counter()
+        if scenario["async"]:
+            results = asyncio.run(arun_all(events))
+        else:
+            def safe_plan(event):
+                try:
+                    return plan(event)
+                except Exception as e:
+                    return e
+            with ThreadPoolExecutor(max_workers=scenario["concurrency"]) as executor:
+                results = list(executor.map(safe_plan, events))
+        elapsed = time.perf_counter() - start
+        api_requests = api.requests
+        api_throttled = api.throttled
+
+    failed = sum(1 for r in results if isinstance(r, BaseException))
+    spans = get_recent_spans()
+    plans = {s["trace_id"]: {"total": s["duration_ms"] / 1000}
+             for s in spans if s["kind"] == "bench" and s["status"] == "ok"}
+    routed = {}
+    for s in spans:
+        if s["trace_id"] not in plans:
+            continue
+        if s["name"] in STAGES and s["kind"] in ("node", "llm"):
+            plans[s["trace_id"]][s["name"]] = s["duration_ms"] / 1000
+        elif s["kind"] == "route" and s["name"].split(":")[0] in STAGES:
+            # A routed chain takes as long as its tier attempts together; an
+            # abandoned attempt's own llm span keeps running after the plan moved on
+            key = (s["trace_id"], s["name"].split(":")[0])
+            routed[key] = routed.get(key, 0.0) + s["duration_ms"] / 1000
+    for (trace_id, stage), seconds in routed.items():
+        plans[trace_id][stage] = seconds
+    # Chain calls that reached the model (cache hits and coalesced calls report no tokens)
+    llm_calls = [s for s in spans if s["trace_id"] in plans and s["kind"] == "llm"
+                 and s["attributes"].get("prompt_tokens")]
+
+    latency = {}
+    for stage in ["total"] + STAGES:
+        values = [p[stage] for p in plans.values() if stage in p]
+        latency[stage] = {
+            "p50": percentile(values, 50),
+            "p95": percentile(values, 95),
+            "p99": percentile(values, 99),
+        }
+
+    return {
+        "scenario": name,
+        "plans": len(events),
+        "failed": failed,
+        "elapsed_seconds": elapsed,
+        "plans_per_second": (len(events) - failed) / elapsed if elapsed else 0.0,
+        "rapidapi_requests": api_requests,
+        "rapidapi_throttled": api_throttled,
+        # Failed searches are dropped from the results, so count against the keyword list
+        "products_missing": sum(
+            len(r["Decoration_Recommandations"].get("keywords", []))
+            - sum(1 for block in r["Decoration_Recommandations"].get("products", []) if block.get("items"))
+            for r in results if not isinstance(r, BaseException)),
+        # Model tier attempts that timed out or failed and moved on to the next tier
+        "route_fallbacks": sum(1 for s in spans if s["kind"] == "route"
+                               and s["attributes"].get("outcome") in ("timeout", "failed")),
+        "llm_calls_per_plan": len(llm_calls) / len(plans) if plans else 0.0,
+        "prompt_tokens_per_plan": sum(s["attributes"]["prompt_tokens"] for s in llm_calls) / len(plans) if plans else 0.0,
+        "latency_seconds": latency,
+        "peak_memory_mb": peak_memory_mb(),
+    }
+
+
+def run_in_subprocess(name, args):
+    """
+    Runs a scenario in a fresh interpreter so caches, pools and peak memory start clean.
+    """
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", name,
+           "--llm-latency", str(args.llm_latency), "--api-latency", str(args.api_latency),
+           "--jitter", str(args.jitter)]
+    result = subprocess.run(cmd, cwd=REPO_ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed:\n{result.stderr[-3000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def print_report(results):
+    for result in results.values():
+        memory = f"{result['peak_memory_mb']:.0f} MB" if result["peak_memory_mb"] is not None else "n/a"
+        print(f"\n{result['scenario']}: {result['plans'] - result['failed']}/{result['plans']} plans in "
+              f"{result['elapsed_seconds']:.2f}s ({result['plans_per_second']:.2f} plans/sec), "
+              f"{result['rapidapi_requests']} RapidAPI requests ({result.get('rapidapi_throttled', 0)} throttled), "
+              f"{result.get('products_missing', 0)} keywords without products, "
+              f"{result.get('route_fallbacks', 0)} model tier fallbacks, peak memory {memory}")
+        print(f"    {result.get('llm_calls_per_plan', 0):.1f} LLM calls and "
+              f"{result.get('prompt_tokens_per_plan', 0):.0f} prompt tokens per plan")
+        print(f"    {'stage':<20} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9}")
+        for stage, pcts in result["latency_seconds"].items():
+            print(f"    {stage:<20} {pcts['p50']:>9.3f} {pcts['p95']:>9.3f} {pcts['p99']:>9.3f}")
+
+
+def compare(results, baseline, max_regression):
+    """
+    Prints end-to-end p95 and throughput against the baseline.
+
+    Returns:
+        bool: True if any scenario regressed by more than max_regression percent.
+    """
+    regressed = False
+    print(f"\n{'scenario':<16} {'p95 base':>9} {'p95 now':>9} {'change':>8} "
+          f"{'plans/s base':>13} {'plans/s now':>12} {'change':>8}")
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        p95_before = before["latency_seconds"]["total"]["p95"]
+        p95_now = result["latency_seconds"]["total"]["p95"]
+        p95_change = (p95_now - p95_before) / p95_before * 100 if p95_before else 0.0
+        tput_before = before["plans_per_second"]
+        tput_now = result["plans_per_second"]
+        tput_change = (tput_now - tput_before) / tput_before * 100 if tput_before else 0.0
+        status = ""
+        if p95_change > max_regression or -tput_change > max_regression:
+            regressed = True
+            status = "  REGRESSION"
+        print(f"{name:<16} {p95_before:>9.3f} {p95_now:>9.3f} {p95_change:>+7.1f}% "
+              f"{tput_before:>13.2f} {tput_now:>12.2f} {tput_change:>+7.1f}%{status}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end planning benchmark.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Seconds per fake Gemini call")
+    parser.add_argument("--api-latency", type=float, default=0.15, help="Seconds per stand-in RapidAPI search")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter added to both latencies")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="JSON file from --save-baseline to compare against (default: the committed baseline)")
+    parser.add_argument("--no-baseline", action="store_true", help="Skip the baseline comparison")
+    parser.add_argument("--max-regression", type=float, default=15.0,
+                        help="Allowed p95 slowdown or throughput drop over the baseline, in percent")
+    parser.add_argument("--save-baseline", help="Write this run's results to a JSON file")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.llm_latency, args.api_latency, args.jitter)))
+        return
+
+    results = {name: run_in_subprocess(name, args) for name in args.scenarios}
+    print_report(results)
+
+    regressed = False
+    if args.baseline and not args.no_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressed = compare(results, json.load(f), args.max_regression)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
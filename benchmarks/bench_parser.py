@@ -0,0 +1,129 @@
+"""
+Micro-benchmark for llmOutputParser against the regex/eval parsing it replaced.
+
+Runs every sample in parser_corpus.json through both parsers, reports how many
+samples each one parses correctly, and the mean time per parse. Then checks that
+extraction stays linear on truncated output whose brackets never close, and
+exits with status 1 if it takes longer than --max-pathological-seconds.
+
+Usage:
+    python benchmarks/bench_parser.py [--repeat 2000] [--max-pathological-seconds 0.5]
+"""
+import os
+import sys
+import ast
+import re
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmOutputParser import LLMOutputError, extract_json, parse_themes, parse_budget_allocation, parse_keywords
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parser_corpus.json")
+
+
+def legacy_themes(text):
+    match = re.search(r"```json\s*([\s\S]*?)\s*```", text)
+    return json.loads(match.group(1))
+
+
+def legacy_budget(text):
+    match = re.search(r'(\{.*\})', text, re.DOTALL)
+    return json.loads(match.group(1) if match else text)
+
+
+def legacy_keywords(text):
+    # The original code used eval(); literal_eval keeps the benchmark safe
+    return ast.literal_eval(text[10:-4])
+
+
+# Truncated or streamed output whose brackets never close, at growing sizes; a
+# rescan per bracket made these quadratic (8,000 braces took 12 s)
+PATHOLOGICAL_SIZES = (2000, 8000, 32000)
+PATHOLOGICAL_SHAPES = {
+    "unclosed braces": lambda n: "{" * n,
+    "unclosed brackets and braces": lambda n: "[{" * (n // 2),
+    "unclosed objects with strings": lambda n: '{"a": ' * (n // 6),
+}
+
+PARSERS = {
+    "themes": (parse_themes, legacy_themes),
+    "budget": (parse_budget_allocation, legacy_budget),
+    "keywords": (parse_keywords, legacy_keywords),
+}
+
+
+def _succeeds(parser, text):
+    try:
+        parser(text)
+        return True
+    except (LLMOutputError, ValueError, SyntaxError, TypeError, AttributeError):
+        return False
+
+
+def _mean_us(parser, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            parser(text)
+        except (LLMOutputError, ValueError, SyntaxError, TypeError, AttributeError):
+            pass
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def check_pathological(max_seconds):
+    """
+    Times extract_json on PATHOLOGICAL_SHAPES. Returns False if any input took
+    longer than max_seconds.
+    """
+    print(f"\n{'pathological input':<32} {'chars':>7} {'seconds':>9}")
+    ok = True
+    for shape, build in PATHOLOGICAL_SHAPES.items():
+        for size in PATHOLOGICAL_SIZES:
+            text = build(size)
+            start = time.perf_counter()
+            try:
+                extract_json(text)
+            except LLMOutputError:
+                pass
+            elapsed = time.perf_counter() - start
+            ok = ok and elapsed <= max_seconds
+            print(f"{shape:<32} {len(text):>7} {elapsed:>9.4f}{'' if elapsed <= max_seconds else '  TOO SLOW'}")
+    return ok
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--repeat", type=int, default=2000)
+    arg_parser.add_argument("--max-pathological-seconds", type=float, default=0.5)
+    args = arg_parser.parse_args()
+
+    with open(CORPUS_PATH, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    print(f"{'kind':<9} {'sample':<58} {'new':>5} {'old':>5} {'new us':>8} {'old us':>8}")
+    correct = {"new": 0, "old": 0}
+    for sample in corpus:
+        new_parser, old_parser = PARSERS[sample["kind"]]
+        results = {}
+        for name, parser in (("new", new_parser), ("old", old_parser)):
+            ok = _succeeds(parser, sample["text"])
+            # A sample is handled correctly when parsing succeeds exactly for valid payloads
+            results[name] = ok == sample["valid"]
+            correct[name] += results[name]
+        print(
+            f"{sample['kind']:<9} {sample['description'][:58]:<58} "
+            f"{'ok' if results['new'] else 'FAIL':>5} {'ok' if results['old'] else 'FAIL':>5} "
+            f"{_mean_us(new_parser, sample['text'], args.repeat):>8.1f} "
+            f"{_mean_us(old_parser, sample['text'], args.repeat):>8.1f}"
+        )
+    print(f"\nHandled correctly: new {correct['new']}/{len(corpus)}, old {correct['old']}/{len(corpus)}")
+
+    if not check_pathological(args.max_pathological_seconds):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark for productRanking.rank_products.
+
+Builds synthetic keyword blocks with RapidAPI-style price, rating and review
+strings and reports the median time to rank them at several result sizes.
+
+Usage:
+    python benchmarks/bench_ranking.py [--repeat 50] [--top-n 5]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from productRanking import rank_products
+
+# (keywords, candidates per keyword)
+SIZES = [(3, 48), (10, 48), (30, 96), (60, 144)]
+
+
+def make_blocks(keywords, pool_size, seed=0):
+    rng = random.Random(seed)
+    blocks = []
+    for k in range(keywords):
+        candidates = []
+        for i in range(pool_size):
+            price = rng.uniform(50, 3000)
+            candidates.append({
+                "title": f"Product {k}-{i}",
+                "price": f"₹{price:,.2f}" if rng.random() > 0.05 else None,
+                "url": f"https://www.amazon.in/dp/{k:04d}{i:04d}",
+                "rating": f"{rng.uniform(1, 5):.1f}" if rng.random() > 0.1 else None,
+                "imageUrl": f"https://m.media-amazon.com/images/I/{k}-{i}.jpg",
+                "reviews": rng.randint(0, 50000),
+            })
+        blocks.append({"keyword": f"keyword {k}", "candidates": candidates})
+    return blocks
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    arg_parser.add_argument("--repeat", type=int, default=50)
+    arg_parser.add_argument("--top-n", type=int, default=5)
+    args = arg_parser.parse_args()
+
+    # Load NumPy and pyarrow outside the measurement
+    rank_products(make_blocks(1, 4), 500, args.top_n)
+
+    print(f"{'keywords':>8} {'pool':>5} {'candidates':>10} {'median ms':>10} {'us/candidate':>13}")
+    for keywords, pool_size in SIZES:
+        blocks = make_blocks(keywords, pool_size)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            rank_products(blocks, 800, args.top_n)
+            timings.append(time.perf_counter() - start)
+        candidates = keywords * pool_size
+        median_ms = statistics.median(timings) * 1000
+        print(f"{keywords:>8} {pool_size:>5} {candidates:>10} {median_ms:>10.2f} "
+              f"{median_ms * 1000 / candidates:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
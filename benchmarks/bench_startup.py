@@ -0,0 +1,124 @@
+"""
+Cold-start benchmark based on `python -X importtime`.
+
+Imports each module in a fresh interpreter several times, reports the median
+cumulative import time and the slowest imports it pulls in, and checks that the
+UI entry point does not load the LLM stack. With --baseline the medians are
+compared against a saved run and the script exits non-zero on a regression.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--save-baseline startup_baseline.json]
+    python benchmarks/bench_startup.py --baseline startup_baseline.json --max-regression 20
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose cold start is tracked
+MODULES = ["main", "langgprahCode"]
+
+# Packages that must stay out of the UI shell's import graph
+DEFERRED_PACKAGES = {
+    "main": ["pandas", "langgraph", "langchain_google_genai", "langchain_core", "httpx"],
+}
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def import_times(module):
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        dict: Cumulative microseconds per imported module, in import order.
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+
+def measure(module, repeat):
+    """
+    Returns the median cumulative import time of a module, its slowest imports
+    and any deferred packages it loaded.
+    """
+    runs = [import_times(module) for _ in range(repeat)]
+    medians = {}
+    for name in runs[0]:
+        medians[name] = statistics.median(run.get(name, 0) for run in runs)
+
+    loaded = set().union(*runs)
+    deferred = [pkg for pkg in DEFERRED_PACKAGES.get(module, []) if pkg in loaded]
+    slowest = sorted(
+        ((name, us) for name, us in medians.items() if name != module and "." not in name),
+        key=lambda item: item[1], reverse=True
+    )[:8]
+    return {
+        "total_ms": medians.get(module, 0) / 1000,
+        "slowest_ms": {name: us / 1000 for name, us in slowest},
+        "deferred_loaded": deferred,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--baseline", help="JSON file from --save-baseline to compare against")
+    parser.add_argument("--max-regression", type=float, default=20.0,
+                        help="Allowed slowdown over the baseline, in percent")
+    parser.add_argument("--save-baseline", help="Write this run's results to a JSON file")
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.repeat) for module in args.modules}
+    failed = False
+
+    for module, result in results.items():
+        print(f"{module}: {result['total_ms']:.1f} ms (median of {args.repeat} cold imports)")
+        for name, ms in result["slowest_ms"].items():
+            print(f"    {name:<32} {ms:>8.1f} ms")
+        if result["deferred_loaded"]:
+            failed = True
+            print(f"    FAIL: loads deferred packages at import: {', '.join(result['deferred_loaded'])}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n{'module':<16} {'baseline (ms)':>14} {'now (ms)':>10} {'change':>8}")
+        for module, result in results.items():
+            if module not in baseline:
+                continue
+            before = baseline[module]["total_ms"]
+            change = (result["total_ms"] - before) / before * 100 if before else 0.0
+            status = ""
+            if change > args.max_regression:
+                failed = True
+                status = "  REGRESSION"
+            print(f"{module:<16} {before:>14.1f} {result['total_ms']:>10.1f} {change:>+7.1f}%{status}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
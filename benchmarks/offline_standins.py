@@ -0,0 +1,162 @@
+"""
+Offline stand-ins for Gemini and the RapidAPI product search, used by the benchmarks.
+
+FakeGeminiModel answers each planner prompt with a recorded payload from
+e2e_payloads.json after a configurable latency. RapidAPIStandIn serves the
+recorded search response from a local HTTP server; point the planner at it
+with the RAPIDAPI_SEARCH_URL environment variable.
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+PAYLOADS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "e2e_payloads.json")
+
+# Prompt markers, checked in order, mapped to the recorded payload they get
+PROMPT_ROUTES = (
+    ("budget allocation and decoration keywords", "budget_keywords"),
+    ("A budget has already been allocated", "reasoning"),
+    ("allocate the total budget", "budget"),
+    ("decoration product search keywords", "keywords"),
+    ("unique and creative", "themes"),
+)
+
+
+def load_payloads(path=PAYLOADS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class FakeGeminiModel(BaseChatModel):
+    """
+    Chat model that returns the recorded payload for the prompt it receives,
+    after sleeping for latency +/- jitter seconds.
+    """
+    payloads: dict
+    latency: float = 0.2
+    jitter: float = 0.0
+    model: str = "fake-gemini"
+    temperature: float = 0.2
+
+    @property
+    def _llm_type(self):
+        return "fake-gemini"
+
+    def _delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def _result(self, messages):
+        prompt = messages[-1].content
+        route = next((name for marker, name in PROMPT_ROUTES if marker in prompt), "themes")
+        text = self.payloads[route]
+        message = AIMessage(content=text, usage_metadata={
+            "input_tokens": len(prompt) // 4,
+            "output_tokens": len(text) // 4,
+            "total_tokens": (len(prompt) + len(text)) // 4,
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay())
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay())
+        return self._result(messages)
+
+
+class _SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not self.path.startswith("/search"):
+            self.send_error(404)
+            return
+        server = self.server
+        with server.stats_lock:
+            server.requests += 1
+            throttled = server.quota_exceeded()
+        if throttled:
+            server.throttled += 1
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        time.sleep(max(0.0, server.latency + random.uniform(-server.jitter, server.jitter)))
+        data = server.response_body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops concurrent connects into SYN retries
+    request_queue_size = 128
+
+    def quota_exceeded(self):
+        # Fixed one-second window, like RapidAPI's per-second plan limits; call under stats_lock
+        if not self.quota:
+            return False
+        window = int(time.monotonic())
+        if window != self.window:
+            self.window, self.window_requests = window, 0
+        self.window_requests += 1
+        return self.window_requests > self.quota
+
+
+class RapidAPIStandIn:
+    """
+    Local HTTP server answering /search like real-time-amazon-data.p.rapidapi.com,
+    with the recorded response and a configurable latency. With a quota, requests
+    beyond quota per second are answered 429 with Retry-After, like an exhausted plan.
+
+    Usage:
+        with RapidAPIStandIn(payloads["search_response"], latency=0.15) as api:
+            os.environ["RAPIDAPI_SEARCH_URL"] = api.search_url
+    """
+
+    def __init__(self, response, latency=0.15, jitter=0.0, quota=0, host="127.0.0.1", port=0):
+        self.server = _StandInServer((host, port), _SearchHandler)
+        self.server.response_body = json.dumps(response).encode("utf-8")
+        self.server.latency = latency
+        self.server.jitter = jitter
+        self.server.requests = 0
+        self.server.throttled = 0
+        self.server.quota = quota
+        self.server.window = 0
+        self.server.window_requests = 0
+        self.server.stats_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def search_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/search"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def throttled(self):
+        return self.server.throttled
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
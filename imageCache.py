@@ -0,0 +1,196 @@
+import os
+import io
+import hashlib
+import threading
+import functools
+import requests
+import requests.adapters
+from concurrent.futures import ThreadPoolExecutor
+from singleFlight import get_single_flight
+from planTracing import span
+
+# Image cache settings, overridable from the environment
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(".cache", "thumbnails"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+# Thumbnails fit in this box (the product grid shows three per row)
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 80
+IMAGE_FETCH_TIMEOUT = (3.05, 10)
+MAX_IMAGE_WORKERS = int(os.getenv("MAX_IMAGE_WORKERS", 8))
+IMAGE_PREFETCH_DISABLED = os.getenv("IMAGE_PREFETCH_DISABLED", "").lower() in ("1", "true", "yes")
+
+# One pooled session and one bounded pool for all image downloads in this process
+_session = requests.Session()
+_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_IMAGE_WORKERS))
+_image_executor = ThreadPoolExecutor(max_workers=MAX_IMAGE_WORKERS, thread_name_prefix="image-fetch")
+# Concurrent requests for the same photo share one download
+_image_flight = get_single_flight("product_image")
+
+
+class ThumbnailCache:
+    """
+    Bounded on-disk cache of JPEG thumbnails, one file per image URL hash.
+    A hit refreshes the file's modification time; when the cache grows past
+    max_bytes the least recently used files are deleted.
+    """
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".jpg")
+
+    def get(self, url):
+        """
+        Returns the cached thumbnail bytes for the image URL, or None.
+        """
+        path = self._path(url)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            return None
+
+    def set(self, url, data):
+        """
+        Stores a thumbnail and evicts least recently used files over the size bound.
+        """
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # Readers never see a half-written file
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Thumbnail cache write failed: {e}")
+            return
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self.directory) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+        # Trim to 90% so every write near the bound does not trigger a rescan
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except OSError:
+                pass
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_thumbnail_cache():
+    """
+    Returns the process-wide thumbnail cache.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThumbnailCache()
+    return _cache
+
+
+def make_thumbnail(data):
+    """
+    Downscales image bytes to fit THUMBNAIL_SIZE and returns them as JPEG bytes.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        image.thumbnail(THUMBNAIL_SIZE)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+def _download_thumbnail(url):
+    with span("product_image", "http") as s:
+        try:
+            res = _session.get(url, timeout=IMAGE_FETCH_TIMEOUT)
+            res.raise_for_status()
+            s.set(status_code=res.status_code, response_bytes=len(res.content))
+            thumbnail = make_thumbnail(res.content)
+        except Exception as e:
+            # The UI falls back to the original URL
+            s.error = f"{type(e).__name__}: {e}"
+            return None
+        s.set(thumbnail_bytes=len(thumbnail))
+    get_thumbnail_cache().set(url, thumbnail)
+    return thumbnail
+
+
+def is_image_url(url):
+    return isinstance(url, str) and url.startswith(("http://", "https://"))
+
+
+def get_thumbnail(url):
+    """
+    Returns the thumbnail bytes for a product photo URL, downloading and
+    downscaling it on a cache miss. Returns None if the URL is not an image
+    that could be fetched.
+    """
+    if not is_image_url(url):
+        return None
+    cached = get_thumbnail_cache().get(url)
+    if cached is not None:
+        return cached
+    thumbnail, _ = _image_flight.do(url, _download_thumbnail, url)
+    return thumbnail
+
+
+def get_thumbnails(urls):
+    """
+    Returns {url: thumbnail bytes or None} for many URLs, fetching misses in parallel.
+    """
+    urls = list(dict.fromkeys(urls))
+    return dict(zip(urls, _image_executor.map(get_thumbnail, urls)))
+
+
+def prefetch_product_images(decoration_results):
+    """
+    Starts downloading thumbnails for every product photo in a fetch result in
+    the background, so they are cached by the time the UI renders the grid.
+    """
+    if IMAGE_PREFETCH_DISABLED:
+        return
+    for block in decoration_results.get("products", []):
+        for item in block.get("items", []):
+            url = item.get("imageUrl")
+            if is_image_url(url):
+                _image_executor.submit(get_thumbnail, url)
+
+
+@functools.lru_cache(maxsize=64)
+def placeholder_image(text, size=(320, 240)):
+    """
+    Generates a plain placeholder PNG with the text centred on it, instead of
+    calling an external placeholder service.
+    """
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", size, "#e9e4fb")
+    draw = ImageDraw.Draw(image)
+    left, top, right, bottom = draw.textbbox((0, 0), text)
+    draw.text(((size[0] - (right - left)) / 2, (size[1] - (bottom - top)) / 2), text, fill="#6c5ce7")
+    out = io.BytesIO()
+    image.save(out, format="PNG")
+    return out.getvalue()
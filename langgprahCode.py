@@ -1,9 +1,36 @@
-from typing import Dict, Any, TypedDict
+from typing import Dict, Any, List, TypedDict
+import asyncio
+import threading
+import time
+import weakref
 from langgraph.graph import StateGraph, END
+from langgraph.config import get_stream_writer
 # Import your existing functions from their respective files
-from themeBaseCode import generate_themes,extract_theme_details
-from BudgetAllocation import get_BudgetData,json
-from EventKeyGenAmazonLink import get_amazon_products_for_decorations_with_allData
+from themeBaseCode import generate_themes,select_theme
+from BudgetAllocation import (
+    get_BudgetData,
+    aget_BudgetData,
+    allocate_budget_and_keywords,
+    aallocate_budget_and_keywords,
+    allocate_budget_rule_based,
+    get_enriched_reasoning,
+    BUDGET_ALLOCATION_MODE,
+    BUDGET_REASONING_ENRICHMENT,
+    BUDGET_REASONING_WAIT_SECONDS,
+    json
+)
+from llmOutputParser import LLMOutputError
+from rateLimiter import UpstreamUnavailable
+from planCheckpoints import get_checkpointer, get_async_checkpointer, prune_checkpoints
+from planTracing import traced, current_span, start_span, end_span, span_context
+from EventKeyGenAmazonLink import (
+    generate_decoration_keywords,
+    agenerate_decoration_keywords,
+    fallback_decoration_keywords,
+    apply_price_constraint,
+    fetch_amazon_products_from_keywords,
+    afetch_amazon_products_from_keywords
+)
 
 
 # Define the state schema
@@ -12,104 +39,255 @@ class GraphState(TypedDict):
     Represents the state of the event planning graph.
     Attributes:
         event_data: Raw event data.
-        themes_json: JSON string containing generated themes.
+        themes_json: Parsed list of generated themes (raw LLM text is also accepted).
         selected_theme_index: Index of the selected theme (1-based).
         event_details: Processed event details including selected theme.
         budget_allocation: storage for budget breakdown.
+        decoration_keywords: Amazon search keywords generated from the theme.
         Decoration_Recommandations: Storage for Amazon product recommendations.
+
+    Each node returns only the keys it owns, so parallel branches never write the same key.
     """
     event_data: Dict[str, Any]
-    themes_json: Dict[str, Any]
+    themes_json: List[Dict[str, Any]]
     selected_theme_index: int
     event_details: Dict[str, Any]
     budget_allocation: Dict[str, Any]
+    decoration_keywords: List[str]
     Decoration_Recommandations: Dict[str, Any]
 
 
+@traced("theme_selection", "node")
 def select_theme_node(state: GraphState) -> GraphState:
     """
     Node to select a specific theme from the generated options.
-    It parses the theme JSON and updates the event details in the state.
+    It validates the parsed theme list and updates the event details in the state.
     """
 
     # Get the selected index and extract the theme details
     selected_index = state.get("selected_theme_index", 1)
     
-    # Try to extract theme details
-    selected_theme = extract_theme_details(str(state["themes_json"]), selected_index)
-    print(selected_theme,type(selected_theme))
+    # Pick the theme straight from the parsed theme list
+    theme_data = select_theme(state["themes_json"], selected_index)
     
-    if selected_theme is None or selected_theme == "{}":
+    if theme_data is None:
         print("Failed to extract theme details, providing default empty theme")
-        state["event_data"]["theme"] = {"error": "Theme data is missing"}
-    else:
-        try:
-            # Try to load the theme string into a Python dictionary
-            theme_data = json.loads(selected_theme)
-            state["event_data"]["theme"] = theme_data
-            print("Selected Theme:", theme_data)
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON: {e}")
-            state["event_data"]["theme"] = {"error": "Invalid theme data"}
-            print("Fallback to error data:", state["event_data"]["theme"])
+        theme_data = {"error": "Theme data is missing"}
     
-    r = {"event_details": state["event_data"]}
-    return r
+    # Build new event details instead of mutating the input state
+    return {"event_details": {**state["event_data"], "theme": theme_data}}
 
 # Wrapper for get_BudgetData() from file2
+@traced("budget_step", "node")
 def budget_node(state: GraphState) -> GraphState:
     """
-    Calls the existing get_BudgetData() function and updates the state.
+    Calls the existing get_BudgetData() function and returns the budget allocation.
     """
     # We pass the event data to get_BudgetData
     event_details = state.get("event_details", {})
     
     # Call the existing function
     budget_result = get_BudgetData(event_details)
-    print(budget_result)
-    return budget_result
-    # Return updated state with both event data and budget data
+    return {"budget_allocation": budget_result["budget_allocation"]}
+
+
+@traced("keyword_step", "node")
+def keyword_node(state: GraphState) -> GraphState:
+    """
+    Generates the decoration search keywords. Runs in parallel with budget_node
+    because the keywords only depend on the event and theme.
+    """
+    keywords = generate_decoration_keywords(state.get("event_details", {}))
+    return {"decoration_keywords": keywords}
+
+
+@traced("budget_keyword_step", "node")
+def budget_keyword_node(state: GraphState) -> GraphState:
+    """
+    Fused budget_step and keyword_step (BUDGET_ALLOCATION_MODE=fused): one LLM call
+    returns both the allocation and the keywords. If the response fails validation
+    the node writes neither, and after_budget_keywords sends the plan down the
+    separate budget and keyword steps instead.
+    """
+    event_details = state.get("event_details", {})
+    try:
+        allocation, keywords = allocate_budget_and_keywords(event_details)
+    except LLMOutputError as e:
+        print(f"Fused budget/keyword response invalid, using separate calls: {e}")
+        current_span().set(fallback="separate_calls")
+        return {}
+    except UpstreamUnavailable as e:
+        # No model tier answered in time: separate calls would wait just as long
+        print(f"Budget/keyword LLM unavailable, using rule-based allocation: {e}")
+        current_span().set(fallback="rules")
+        allocation = dict(allocate_budget_rule_based(event_details), error=str(e))
+        keywords = fallback_decoration_keywords(event_details)
+    return {"budget_allocation": allocation, "decoration_keywords": keywords}
+
+
+def after_budget_keywords(state: GraphState):
+    """
+    Routes the fused step to the decoration step, or to the separate budget and
+    keyword steps when it produced no keywords.
+    """
+    if state.get("decoration_keywords"):
+        return "decoration_step"
+    return ["budget_step", "keyword_step"]
+
+
+def _decoration_block_writer():
+    """
+    Returns a callback that writes a keyword's product block to the graph's
+    "custom" stream (a no-op unless the graph is streamed in that mode).
+    """
+    writer = get_stream_writer()
+    return lambda block: writer({"decoration_block": block})
+
+
+def _enriched_budget_update(allocation):
+    """
+    Returns a budget_allocation update carrying the background reasoning
+    (BUDGET_REASONING_ENRICHMENT) as "enriched_reasoning", waiting up to
+    BUDGET_REASONING_WAIT_SECONDS for it, so the plan itself carries it to the
+    UI and to planning service clients. Empty if it is off or not ready.
+    """
+    if not BUDGET_REASONING_ENRICHMENT or not allocation or "enriched_reasoning" in allocation:
+        return {}
+    enriched = get_enriched_reasoning(allocation, wait=BUDGET_REASONING_WAIT_SECONDS)
+    if not enriched:
+        return {}
+    return {"budget_allocation": {**allocation, "enriched_reasoning": enriched}}
 
 
-# Wrapper for get_amazon_products_for_decorations_with_allData() from file3
+# Join of the budget and keyword branches
+@traced("decoration_step", "node")
 def decoration_node(state: GraphState) -> GraphState:
     """
-    Calls the existing get_amazon_products_for_decorations_with_allData() function
-    and updates the state.
+    Applies the decorations budget to the generated keywords and fetches
+    the Amazon products for them.
     """
-    # We need to pass both event and budget data to this function
-    combined_data = {
-        "event_details": state.get("event_details", {}),
-        "budget_allocation": state.get("budget_allocation", {})
-    }
+    decorations_budget = state.get("budget_allocation", {}).get("decorations", 0)
+    keyword_data = apply_price_constraint(state.get("decoration_keywords", []), decorations_budget)
     
-    # Call the existing function
-    decoration_result = get_amazon_products_for_decorations_with_allData(combined_data)
-    print(decoration_result)
+    # Each keyword's products go out on the "custom" stream as soon as they arrive
+    decoration_result = fetch_amazon_products_from_keywords(keyword_data,
+                                                            on_block=_decoration_block_writer())
+
+    return {"Decoration_Recommandations": decoration_result,
+            **_enriched_budget_update(state.get("budget_allocation"))}
+
+# Async variants of the nodes, used by arun_event_planning
+async def aselect_theme_node(state: GraphState) -> GraphState:
+    """
+    Async version of select_theme_node (no I/O, so it runs inline).
+    """
+    return select_theme_node(state)
 
-    return decoration_result
 
-def create_event_planning_graph():
+@traced("budget_step", "node")
+async def abudget_node(state: GraphState) -> GraphState:
+    """
+    Async version of budget_node.
+    """
+    budget_result = await aget_BudgetData(state.get("event_details", {}))
+    return {"budget_allocation": budget_result["budget_allocation"]}
+
+
+@traced("keyword_step", "node")
+async def akeyword_node(state: GraphState) -> GraphState:
+    """
+    Async version of keyword_node.
+    """
+    keywords = await agenerate_decoration_keywords(state.get("event_details", {}))
+    return {"decoration_keywords": keywords}
+
+
+@traced("budget_keyword_step", "node")
+async def abudget_keyword_node(state: GraphState) -> GraphState:
+    """
+    Async version of budget_keyword_node.
+    """
+    event_details = state.get("event_details", {})
+    try:
+        allocation, keywords = await aallocate_budget_and_keywords(event_details)
+    except LLMOutputError as e:
+        print(f"Fused budget/keyword response invalid, using separate calls: {e}")
+        current_span().set(fallback="separate_calls")
+        return {}
+    except UpstreamUnavailable as e:
+        print(f"Budget/keyword LLM unavailable, using rule-based allocation: {e}")
+        current_span().set(fallback="rules")
+        allocation = dict(allocate_budget_rule_based(event_details), error=str(e))
+        keywords = fallback_decoration_keywords(event_details)
+    return {"budget_allocation": allocation, "decoration_keywords": keywords}
+
+
+@traced("decoration_step", "node")
+async def adecoration_node(state: GraphState) -> GraphState:
+    """
+    Async version of decoration_node.
+    """
+    decorations_budget = state.get("budget_allocation", {}).get("decorations", 0)
+    keyword_data = apply_price_constraint(state.get("decoration_keywords", []), decorations_budget)
+    decoration_result = await afetch_amazon_products_from_keywords(keyword_data,
+                                                                   on_block=_decoration_block_writer())
+    # Waiting for the reasoning blocks, so it stays off the event loop
+    enriched = await asyncio.to_thread(_enriched_budget_update, state.get("budget_allocation"))
+    return {"Decoration_Recommandations": decoration_result, **enriched}
+
+
+def create_event_planning_graph(use_async=False, checkpointed=False, fused=None):
     """
     Constructs the LangGraph workflow for event planning.
     Nodes:
         - theme_selection: Selects the user-preferred theme.
         - budget_step: Allocates budget based on event details.
-        - decoration_step: Suggests Amazon products for decorations.
+        - keyword_step: Generates decoration search keywords from the theme.
+        - budget_keyword_step: Both of the above in one LLM call (fused graph only).
+        - decoration_step: Applies the decorations budget and suggests Amazon products.
     Flow:
-        theme_selection -> budget_step -> decoration_step -> END
+        theme_selection -> (budget_step || keyword_step) -> decoration_step -> END
+    Fused flow:
+        theme_selection -> budget_keyword_step -> decoration_step -> END, or
+        -> (budget_step || keyword_step) -> decoration_step when its response is invalid
+
+    Args:
+        use_async (bool): Build the graph from the async node variants, for ainvoke.
+        checkpointed (bool): Compile with the SQLite checkpointer so runs can resume by thread id.
+        fused (bool): Build the fused graph; defaults to BUDGET_ALLOCATION_MODE == "fused".
     """
+    if fused is None:
+        fused = BUDGET_ALLOCATION_MODE == "fused"
     workflow = StateGraph(GraphState)
     
 
     # workflow.add_node("theme_generation", generate_themes_node)
-    workflow.add_node("theme_selection", select_theme_node)  # <-- YOUR NEW NODE
-    workflow.add_node("budget_step", budget_node)
-    workflow.add_node("decoration_step", decoration_node)
+    if use_async:
+        workflow.add_node("theme_selection", aselect_theme_node)
+        workflow.add_node("budget_step", abudget_node)
+        workflow.add_node("keyword_step", akeyword_node)
+        workflow.add_node("decoration_step", adecoration_node)
+        if fused:
+            workflow.add_node("budget_keyword_step", abudget_keyword_node)
+    else:
+        workflow.add_node("theme_selection", select_theme_node)  # <-- YOUR NEW NODE
+        workflow.add_node("budget_step", budget_node)
+        workflow.add_node("keyword_step", keyword_node)
+        workflow.add_node("decoration_step", decoration_node)
+        if fused:
+            workflow.add_node("budget_keyword_step", budget_keyword_node)
 
     # workflow.add_edge("theme_generation", "theme_selection")
-    workflow.add_edge("theme_selection", "budget_step")
-    workflow.add_edge("budget_step", "decoration_step")
+    if fused:
+        # One call for budget and keywords; the separate steps only run if it fails validation
+        workflow.add_edge("theme_selection", "budget_keyword_step")
+        workflow.add_conditional_edges("budget_keyword_step", after_budget_keywords,
+                                       ["decoration_step", "budget_step", "keyword_step"])
+    else:
+        # Budget and keywords fan out in parallel and join at the decoration step
+        workflow.add_edge("theme_selection", "budget_step")
+        workflow.add_edge("theme_selection", "keyword_step")
+    workflow.add_edge(["budget_step", "keyword_step"], "decoration_step")
     workflow.add_edge("decoration_step", END)
 
     
@@ -117,16 +295,285 @@ def create_event_planning_graph():
     workflow.set_entry_point("theme_selection")
     
     # Compile the graph
-    return workflow.compile()
+    return workflow.compile(checkpointer=get_checkpointer() if checkpointed else None)
+
+
+# Process-wide registry of compiled graphs, keyed by graph shape and configuration
+_compiled_graphs = {}
+_compiled_graphs_lock = threading.Lock()
+graph_compile_stats = {
+    "compiles": 0,
+    "cache_hits": 0,
+    "last_compile_seconds": 0.0,
+    "total_compile_seconds": 0.0,
+}
+
+
+def _graph_key(builder, config):
+    """
+    Builds the registry key for a graph builder and its configuration.
+    """
+    return (builder.__module__, builder.__qualname__, tuple(sorted(config.items())))
+
+
+def get_compiled_graph(builder=None, **config):
+    """
+    Returns the compiled graph for the given builder and configuration,
+    compiling it only the first time it is requested in this process.
+
+    Args:
+        builder: Function that builds and compiles the graph. Defaults to create_event_planning_graph.
+        **config: Keyword arguments passed to the builder; part of the registry key.
+
+    Returns:
+        The compiled LangGraph graph.
+    """
+    builder = builder or create_event_planning_graph
+    key = _graph_key(builder, config)
+
+    graph = _compiled_graphs.get(key)
+    if graph is not None:
+        with _compiled_graphs_lock:
+            graph_compile_stats["cache_hits"] += 1
+        return graph
+
+    with _compiled_graphs_lock:
+        # Another thread may have compiled it while we were waiting for the lock
+        graph = _compiled_graphs.get(key)
+        if graph is not None:
+            graph_compile_stats["cache_hits"] += 1
+            return graph
+
+        start = time.perf_counter()
+        graph = builder(**config)
+        elapsed = time.perf_counter() - start
+
+        _compiled_graphs[key] = graph
+        graph_compile_stats["compiles"] += 1
+        graph_compile_stats["last_compile_seconds"] = elapsed
+        graph_compile_stats["total_compile_seconds"] += elapsed
+        return graph
+
+
+def invalidate_compiled_graphs(builder=None, **config):
+    """
+    Drops compiled graphs from the registry so the next run recompiles them.
+    With no arguments every compiled graph is dropped.
+    """
+    with _compiled_graphs_lock:
+        if builder is None and not config:
+            _compiled_graphs.clear()
+        else:
+            _compiled_graphs.pop(_graph_key(builder or create_event_planning_graph, config), None)
+
+
+def get_graph_compile_stats():
+    """
+    Returns a snapshot of the graph compile metrics.
+    """
+    with _compiled_graphs_lock:
+        stats = dict(graph_compile_stats)
+        stats["cached_graphs"] = len(_compiled_graphs)
+    return stats
+
+
+def _prepare_run(graph_state, thread_id, plan_span, graph=None):
+    """
+    Picks the compiled graph, config and input for a run (see run_event_planning).
+
+    Args:
+        graph (optional): Graph to run instead of the process's sync graph; the
+            checkpointed one when a thread_id is given (arun_event_planning passes its own).
+
+    Returns:
+        tuple: (graph, config, run_input, finished_plan); finished_plan is the stored
+               plan if the checkpoint thread already finished, else None.
+    """
+    if thread_id is None:
+        # Reuse the compiled graph for this process
+        return graph or get_compiled_graph(), None, graph_state, None
+
+    graph = graph or get_compiled_graph(checkpointed=True)
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = graph.get_state(config)
+    if snapshot.values and not snapshot.next:
+        # Finished earlier: return the stored plan without recomputing anything
+        plan_span.set(checkpoint="finished")
+        return graph, config, graph_state, snapshot.values
+    if snapshot.next:
+        # Interrupted earlier: resume from the last completed node
+        plan_span.set(checkpoint="resumed")
+        return graph, config, None, None
+    prune_checkpoints()
+    return graph, config, graph_state, None
+
+
+def _track_stage(chunk, started, stage_timings):
+    """
+    Records a node's wall time in stage_timings from its debug task / task_result events.
+    """
+    if chunk["type"] == "task":
+        started[chunk["payload"]["id"]] = time.perf_counter()
+    elif chunk["type"] == "task_result":
+        task_start = started.pop(chunk["payload"]["id"], None)
+        if task_start is not None:
+            stage_timings[chunk["payload"]["name"]] = time.perf_counter() - task_start
 
 
 # Function to run the graph with initial input
-def run_event_planning(graph_state: GraphState):
-    # Create the graph
-    graph = create_event_planning_graph()
+@traced("plan", "plan")
+def run_event_planning(graph_state: GraphState, stage_timings=None, thread_id=None, cancel=None):
+    """
+    Runs the event planning graph on the initial state.
+
+    Args:
+        graph_state: Initial graph state.
+        stage_timings (dict, optional): If given, filled with the wall time in
+            seconds of each node, from task start to task result.
+        thread_id (str, optional): Checkpoint thread (see planCheckpoints.plan_thread_id).
+            A finished thread returns its stored plan, an interrupted one resumes from
+            the last completed node, and a new one runs from the start.
+        cancel (threading.Event, optional): Checked after every graph step; once set
+            the run stops there. With a thread_id the completed steps stay checkpointed.
+
+    Returns:
+        dict: The final graph state, or None if the run was cancelled.
+    """
+    graph, config, run_input, finished_plan = _prepare_run(graph_state, thread_id, current_span())
+    if finished_plan is not None:
+        return finished_plan
     
-    # Run the graph
-    result = graph.invoke(graph_state)
+    if stage_timings is None and cancel is None:
+        # Run the graph
+        return graph.invoke(run_input, config)
+
+    # Stream the graph step by step: debug events time each node
+    result = dict(graph_state)
+    started = {}
+    stream_mode = ["debug", "values"] if stage_timings is not None else ["values"]
+    for mode, chunk in graph.stream(run_input, config, stream_mode=stream_mode):
+        if cancel is not None and cancel.is_set():
+            current_span().set(cancelled=True)
+            return None
+        if mode == "values":
+            result = chunk
+        else:
+            _track_stage(chunk, started, stage_timings)
     
     return result
 
+
+def stream_event_planning(graph_state: GraphState, thread_id=None):
+    """
+    Streaming version of run_event_planning, used by the UI to show products
+    while the remaining keyword searches are still running.
+
+    Yields:
+        tuple: ("decoration_keywords", keywords) once the keywords are generated,
+               ("decoration_block", block) for each keyword's ranked
+               {"keyword", "items"} block as soon as its search completes,
+               then ("plan", final_state) once the graph has finished.
+    """
+    # The plan span is current only while the graph advances, not while the caller
+    # renders between events
+    s = start_span("plan", "plan", streamed=True)
+    context = span_context(s)
+    try:
+        graph, config, run_input, finished_plan = context.run(_prepare_run, graph_state, thread_id, s)
+        result = finished_plan
+        if finished_plan is None:
+            result = dict(graph_state)
+            events = context.run(graph.stream, run_input, config, stream_mode=["custom", "updates", "values"])
+            try:
+                while True:
+                    event = context.run(next, events, None)
+                    if event is None:
+                        break
+                    mode, chunk = event
+                    if mode == "values":
+                        result = chunk
+                    elif mode == "updates":
+                        # From keyword_step, or budget_keyword_step in the fused graph
+                        for update in chunk.values():
+                            if (update or {}).get("decoration_keywords"):
+                                yield "decoration_keywords", update["decoration_keywords"]
+                    elif "decoration_block" in chunk:
+                        yield "decoration_block", chunk["decoration_block"]
+            finally:
+                context.run(events.close)
+    except GeneratorExit:
+        # The caller stopped reading before the plan finished
+        s.set(cancelled=True)
+        end_span(s)
+        raise
+    except Exception as e:
+        end_span(s, e)
+        raise
+    end_span(s)
+    yield "plan", result
+
+
+def load_event_plan_checkpoint(thread_id):
+    """
+    Returns the finished plan stored for a checkpoint thread, or None if the
+    thread has no checkpoint or did not finish.
+    """
+    graph = get_compiled_graph(checkpointed=True)
+    snapshot = graph.get_state({"configurable": {"thread_id": thread_id}})
+    if snapshot.values and not snapshot.next:
+        return snapshot.values
+    return None
+
+
+# Async checkpointed graph per async checkpointer, i.e. per event loop
+_async_checkpointed_graphs = weakref.WeakKeyDictionary()
+
+
+async def _aget_checkpointed_graph():
+    """
+    Returns the async graph bound to the running loop's async SQLite checkpointer.
+    It is a copy of the registry's async graph, so nothing is recompiled.
+    """
+    saver = await get_async_checkpointer()
+    graph = _async_checkpointed_graphs.get(saver)
+    if graph is None:
+        graph = _async_checkpointed_graphs[saver] = get_compiled_graph(use_async=True).copy(
+            update={"checkpointer": saver})
+    return graph
+
+
+@traced("plan", "plan")
+async def arun_event_planning(graph_state: GraphState, stage_timings=None, thread_id=None, cancel=None):
+    """
+    Async version of run_event_planning. Runs the async graph with ainvoke so
+    many plans can share one event loop while they wait on the LLM and RapidAPI.
+    Takes the same arguments; with a thread_id the run is checkpointed through the
+    loop's AsyncSqliteSaver, and cancel may be a threading.Event or an asyncio.Event.
+    """
+    if thread_id is None:
+        graph = get_compiled_graph(use_async=True)
+    else:
+        graph = await _aget_checkpointed_graph()
+    # Reads the checkpoint (through the async saver's sync interface) and may prune
+    # old threads, so keep it off the event loop
+    graph, config, run_input, finished_plan = await asyncio.to_thread(
+        _prepare_run, graph_state, thread_id, current_span(), graph)
+    if finished_plan is not None:
+        return finished_plan
+
+    if stage_timings is None and cancel is None:
+        return await graph.ainvoke(run_input, config)
+
+    result = dict(graph_state)
+    started = {}
+    stream_mode = ["debug", "values"] if stage_timings is not None else ["values"]
+    async for mode, chunk in graph.astream(run_input, config, stream_mode=stream_mode):
+        if cancel is not None and cancel.is_set():
+            current_span().set(cancelled=True)
+            return None
+        if mode == "values":
+            result = chunk
+        else:
+            _track_stage(chunk, started, stage_timings)
+
+    return result
@@ -0,0 +1,438 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from singleFlight import get_single_flight
+from planTracing import span, start_span, end_span, current_span, span_context
+from rateLimiter import get_upstream
+
+# Cache settings, overridable from the environment
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite3"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", 6 * 60 * 60))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000))
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache with TTL expiry.
+    """
+
+    def __init__(self, ttl_seconds=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if time.time() - created_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskCacheBackend:
+    """
+    SQLite-backed LRU cache with TTL expiry, shared by every process using the same file.
+    """
+
+    def __init__(self, path=LLM_CACHE_PATH, ttl_seconds=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS llm_response (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        try:
+            row = conn.execute("SELECT value, created_at FROM llm_response WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM llm_response WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE llm_response SET accessed_at = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"LLM cache read failed: {e}")
+            return None
+
+    def set(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_response (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            conn.execute(
+                "DELETE FROM llm_response WHERE key IN "
+                "(SELECT key FROM llm_response ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"LLM cache write failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM llm_response WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM llm_response")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_chain_stats = {}
+_stats_lock = threading.Lock()
+_llm_flight = get_single_flight("llm")
+
+
+def get_llm_cache_backend():
+    """
+    Returns the active cache backend, creating it from LLM_CACHE_BACKEND on first use.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = DiskCacheBackend() if LLM_CACHE_BACKEND == "disk" else MemoryCacheBackend()
+    return _backend
+
+
+def set_llm_cache_backend(backend):
+    """
+    Replaces the active cache backend (any object with get/set/delete/clear).
+    """
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def _record(chain_name, outcome, seconds=0.0):
+    with _stats_lock:
+        stats = _chain_stats.setdefault(chain_name, {
+            "hits": 0,
+            "misses": 0,
+            "bypassed": 0,
+            "coalesced": 0,
+            "llm_seconds": 0.0,
+        })
+        stats[outcome] += 1
+        stats["llm_seconds"] += seconds
+
+
+def get_llm_cache_stats():
+    """
+    Returns per-chain hit rates and the estimated LLM latency saved by cache hits
+    and coalesced calls.
+    """
+    with _stats_lock:
+        report = {}
+        for chain_name, stats in _chain_stats.items():
+            calls = stats["misses"] + stats["bypassed"]
+            lookups = stats["hits"] + stats["misses"]
+            avg_llm_seconds = stats["llm_seconds"] / calls if calls else 0.0
+            report[chain_name] = dict(
+                stats,
+                hit_rate=stats["hits"] / lookups if lookups else 0.0,
+                avg_llm_seconds=avg_llm_seconds,
+                estimated_saved_seconds=(stats["hits"] + stats["coalesced"]) * avg_llm_seconds,
+            )
+        return report
+
+
+def reset_llm_cache_stats():
+    with _stats_lock:
+        _chain_stats.clear()
+
+
+def _payload_size(value):
+    """
+    Size in bytes of a prompt input dict or a text response, for span attributes.
+    """
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    return len(json.dumps(value, default=str).encode("utf-8"))
+
+
+_token_usage_handler = None
+
+
+def _token_usage_callback(s):
+    """
+    Returns a LangChain callback that adds the model's token usage to span s.
+    """
+    global _token_usage_handler
+    if _token_usage_handler is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class TokenUsageHandler(BaseCallbackHandler):
+            run_inline = True
+
+            def __init__(self, s):
+                self.span = s
+
+            def on_llm_end(self, response, **kwargs):
+                for generations in response.generations:
+                    for generation in generations:
+                        usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                        if usage:
+                            self.span.add("prompt_tokens", usage.get("input_tokens", 0))
+                            self.span.add("completion_tokens", usage.get("output_tokens", 0))
+
+        _token_usage_handler = TokenUsageHandler
+    return _token_usage_handler(s)
+
+
+class CachedChain:
+    """
+    A `prompt | llm | parser` chain with an exact-match response cache in front of it.
+
+    The cache key combines the prompt template text, the canonicalized prompt
+    inputs, the model name and the temperature, so changing any of them misses.
+
+    `llm` may be a chat model or a zero-argument factory returning one; a factory
+    (e.g. llmClient.llm_factory) is only called when the model is first called.
+    A factory with a cache_identity() method keys the cache without creating the
+    model, so cache hits never build the client.
+
+    Model calls go through the rateLimiter upstream named `upstream`.
+    """
+
+    def __init__(self, name, prompt, llm, parser=None, upstream="gemini"):
+        self.name = name
+        self.upstream = upstream
+        self.prompt = prompt
+        self._llm = llm
+        self._parser = parser
+        self._chain = None
+        self._chain_llm = None
+
+    @property
+    def llm(self):
+        # A factory is asked every time, so a model swapped in with llmClient.set_llm is used
+        return self._llm if hasattr(self._llm, "invoke") else self._llm()
+
+    @property
+    def chain(self):
+        llm = self.llm
+        if self._chain is None or self._chain_llm is not llm:
+            from langchain_core.output_parsers import StrOutputParser
+
+            self._chain = self.prompt | llm | (self._parser or StrOutputParser())
+            self._chain_llm = llm
+        return self._chain
+
+    def cache_key(self, inputs):
+        # Only the variables the template actually uses take part in the key
+        canonical_inputs = {}
+        for var in sorted(self.prompt.input_variables):
+            value = inputs.get(var)
+            canonical_inputs[var] = value.strip() if isinstance(value, str) else value
+        identity = getattr(self._llm, "cache_identity", None)
+        if identity is not None:
+            model = identity()
+        else:
+            llm = self.llm
+            model = {"model": getattr(llm, "model", type(llm).__name__), "temperature": getattr(llm, "temperature", None)}
+        payload = json.dumps({
+            "template": self.prompt.template,
+            "inputs": canonical_inputs,
+            **model,
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def invoke(self, inputs, bypass=False):
+        """
+        Returns the chain output for the inputs, from the cache when possible.
+
+        Args:
+            inputs (dict): Prompt inputs.
+            bypass (bool): Skip the cache lookup and always call the model. The
+                fresh response still replaces the cached one.
+        """
+        with span(self.name, "llm", request_bytes=_payload_size(inputs)) as s:
+            response, outcome = self._invoke(inputs, bypass)
+            s.set(cache=outcome, response_bytes=_payload_size(response))
+            return response
+
+    def _invoke(self, inputs, bypass):
+        backend = get_llm_cache_backend()
+        key = self.cache_key(inputs)
+        bypass = bypass or LLM_CACHE_DISABLED
+
+        if bypass:
+            return self._call(inputs, key, "bypassed"), "bypassed"
+
+        cached = backend.get(key)
+        if cached is not None:
+            _record(self.name, "hits")
+            return cached, "hit"
+
+        # Identical concurrent misses share one model call
+        response, shared = _llm_flight.do(key, self._call, inputs, key, "misses")
+        if shared:
+            _record(self.name, "coalesced")
+        return response, "coalesced" if shared else "miss"
+
+    def _call(self, inputs, key, outcome):
+        start = time.perf_counter()
+        response = get_upstream(self.upstream).call(self.chain.invoke, inputs, config=self._trace_config())
+        _record(self.name, outcome, time.perf_counter() - start)
+
+        if not LLM_CACHE_DISABLED:
+            get_llm_cache_backend().set(key, response)
+        return response
+
+    async def ainvoke(self, inputs, bypass=False):
+        """
+        Async version of invoke, awaiting the chain with ainvoke on a cache miss.
+        """
+        with span(self.name, "llm", request_bytes=_payload_size(inputs)) as s:
+            response, outcome = await self._ainvoke(inputs, bypass)
+            s.set(cache=outcome, response_bytes=_payload_size(response))
+            return response
+
+    async def _ainvoke(self, inputs, bypass):
+        backend = get_llm_cache_backend()
+        key = self.cache_key(inputs)
+        bypass = bypass or LLM_CACHE_DISABLED
+
+        if bypass:
+            return await self._acall(inputs, key, "bypassed"), "bypassed"
+
+        cached = backend.get(key)
+        if cached is not None:
+            _record(self.name, "hits")
+            return cached, "hit"
+
+        # Identical concurrent misses share one model call
+        response, shared = await _llm_flight.ado(key, self._acall, inputs, key, "misses")
+        if shared:
+            _record(self.name, "coalesced")
+        return response, "coalesced" if shared else "miss"
+
+    async def _acall(self, inputs, key, outcome):
+        start = time.perf_counter()
+        response = await get_upstream(self.upstream).acall(self.chain.ainvoke, inputs, config=self._trace_config())
+        _record(self.name, outcome, time.perf_counter() - start)
+
+        if not LLM_CACHE_DISABLED:
+            get_llm_cache_backend().set(key, response)
+        return response
+
+    def stream(self, inputs, bypass=False):
+        """
+        Streams the chain output for the inputs as text chunks. A cache hit is
+        yielded as a single chunk; a fresh response is cached once it completes.
+        """
+        backend = get_llm_cache_backend()
+        key = self.cache_key(inputs)
+        bypass = bypass or LLM_CACHE_DISABLED
+        # The span is not made current: the caller's code runs between the chunks
+        s = start_span(self.name, "llm", request_bytes=_payload_size(inputs), streamed=True)
+
+        if not bypass:
+            cached = backend.get(key)
+            if cached is not None:
+                _record(self.name, "hits")
+                s.set(cache="hit", response_bytes=_payload_size(cached))
+                end_span(s)
+                yield cached
+                return
+
+        start = time.perf_counter()
+        chunks = []
+        try:
+            # Only opening the stream is rate limited and retried: yielded chunks cannot be taken back
+            first, rest = span_context(s).run(get_upstream(self.upstream).call, self._open_stream, inputs, s)
+            for chunk in itertools.chain([first] if first is not None else [], rest):
+                if not chunks:
+                    s.set(first_chunk_ms=round((time.perf_counter() - start) * 1000, 3))
+                chunks.append(chunk)
+                yield chunk
+        except GeneratorExit:
+            # The caller stopped reading before the response completed
+            s.set(cancelled=True)
+            end_span(s)
+            raise
+        except Exception as e:
+            end_span(s, e)
+            raise
+        _record(self.name, "bypassed" if bypass else "misses", time.perf_counter() - start)
+        s.set(cache="bypassed" if bypass else "miss", response_bytes=_payload_size("".join(chunks)))
+        end_span(s)
+
+        if not LLM_CACHE_DISABLED:
+            backend.set(key, "".join(chunks))
+
+    def _open_stream(self, inputs, s):
+        """
+        Starts streaming the chain and waits for the first chunk, so connection
+        and quota errors surface here. Returns (first chunk or None, the rest).
+        """
+        chunks = iter(self.chain.stream(inputs, config={"callbacks": [_token_usage_callback(s)]}))
+        return next(chunks, None), chunks
+
+    @staticmethod
+    def _trace_config():
+        # The model call runs inside the caller's span (or the coalescing leader's)
+        s = current_span()
+        return {"callbacks": [_token_usage_callback(s)]} if s is not None else None
+
+    def invalidate(self, inputs):
+        """
+        Drops the cached response for the inputs, e.g. after it failed to parse.
+        """
+        get_llm_cache_backend().delete(self.cache_key(inputs))
@@ -0,0 +1,124 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+# Model settings, overridable from the environment or a .env file
+load_dotenv()
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.0-flash")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0.2))
+# Model per tier; modelRouter maps each chain to a tier
+MODEL_TIERS = {
+    "large": LLM_MODEL,
+    "small": os.getenv("LLM_SMALL_MODEL", "gemini-2.0-flash-lite"),
+}
+
+_llms = {}
+_llm_lock = threading.Lock()
+_model_class = None
+
+
+def _single_attempt_model_class():
+    """
+    Returns a ChatGoogleGenerativeAI subclass that makes exactly one API call per
+    request, so Gemini retries are left to rateLimiter.Upstream, whose backoff
+    honors the server's RetryInfo and whose every attempt waits for a token.
+
+    langchain-google-genai wraps each call in a tenacity retry hard-coded to two
+    attempts (max_retries is ignored), and the generated API client retries 503s
+    for up to ten minutes; both bypass the rate limiter and are switched off here.
+    """
+    global _model_class
+    if _model_class is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI, chat_models
+
+        # The tenacity decorator is only built through this factory; make it a pass-through
+        chat_models._create_retry_decorator = lambda *args, **kwargs: (lambda fn: fn)
+
+        class SingleAttemptGemini(ChatGoogleGenerativeAI):
+            # retry=None is passed on to the API client call and disables its default retry
+            def _generate(self, *args, **kwargs):
+                return super()._generate(*args, retry=None, **kwargs)
+
+            async def _agenerate(self, *args, **kwargs):
+                return await super()._agenerate(*args, retry=None, **kwargs)
+
+            def _stream(self, *args, **kwargs):
+                return super()._stream(*args, retry=None, **kwargs)
+
+            def _astream(self, *args, **kwargs):
+                return super()._astream(*args, retry=None, **kwargs)
+
+        _model_class = SingleAttemptGemini
+    return _model_class
+
+
+def get_llm(tier="large"):
+    """
+    Returns the process-wide Gemini chat model for a tier, creating it on first use.
+    The model makes one API call per request; rateLimiter.Upstream retries it.
+
+    langchain_google_genai is imported here rather than at module import, so
+    importing the planner modules (and painting the UI) does not load the LLM stack.
+
+    Raises:
+        RuntimeError: If GOOGLE_API_KEY is not set in the environment or .env file.
+        KeyError: If the tier is not in MODEL_TIERS.
+    """
+    llm = _llms.get(tier)
+    if llm is None:
+        with _llm_lock:
+            llm = _llms.get(tier)
+            if llm is None:
+                model = MODEL_TIERS[tier]
+                if not os.getenv("GOOGLE_API_KEY"):
+                    raise RuntimeError("GOOGLE_API_KEY is not set; add it to your environment or .env file")
+                llm = _llms[tier] = _single_attempt_model_class()(
+                    model=model,
+                    temperature=LLM_TEMPERATURE,
+                    max_retries=0
+                )
+    return llm
+
+
+class _TierFactory:
+    """
+    Zero-argument factory for a tier's model that can also describe the model
+    without creating it, so CachedChain can compute cache keys (and serve hits)
+    before the client exists.
+    """
+
+    def __init__(self, tier):
+        self.tier = tier
+
+    def __call__(self):
+        return get_llm(self.tier)
+
+    def cache_identity(self):
+        """
+        Returns the {"model", "temperature"} the tier's responses are cached under.
+        """
+        llm = _llms.get(self.tier)
+        if llm is not None:
+            # Created already, or swapped in with set_llm
+            return {"model": getattr(llm, "model", type(llm).__name__), "temperature": getattr(llm, "temperature", None)}
+        model = MODEL_TIERS[self.tier]
+        # The created client reports the name with this prefix, so keys do not change once it exists
+        return {"model": model if model.startswith("models/") else f"models/{model}", "temperature": LLM_TEMPERATURE}
+
+
+def llm_factory(tier):
+    """
+    Returns a zero-argument factory for a tier's model, for CachedChain.
+    """
+    return _TierFactory(tier)
+
+
+def set_llm(llm, tier=None):
+    """
+    Replaces the shared chat model of one tier, or of every tier when tier is None,
+    e.g. with a stand-in for offline benchmarks. Chains created with get_llm or
+    llm_factory pick it up on their next call.
+    """
+    with _llm_lock:
+        for name in ([tier] if tier else MODEL_TIERS):
+            _llms[name] = llm
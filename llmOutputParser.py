@@ -0,0 +1,256 @@
+import ast
+import json
+import re
+
+THEME_FIELDS = ("Name", "Description", "Aesthetic/Visual Style")
+BUDGET_FIELDS = ("food", "entertainment", "decorations")
+
+
+class LLMOutputError(ValueError):
+    """
+    Raised when an LLM response does not contain the expected structured payload.
+    """
+
+
+_STRUCTURAL_CHARS = re.compile(r"""[\[\]{}"'\\]""")
+# Extra scans after a string left open at the end of the text, one per quote kind
+_MAX_RESCANS = 2
+
+
+def _candidate_spans(text, openers):
+    """
+    Yields (begin, end) for every bracketed span whose opening bracket is one of
+    `openers`, in order of the opening bracket. Brackets are matched with a stack
+    in one forward pass over the structural characters, so plain text is skipped
+    at C speed and nothing is scanned again when a bracket never closes. Brackets
+    inside strings are ignored, and so are quotes outside any bracket (prose).
+
+    A string still open at the end (e.g. an apostrophe in prose after a bracket
+    that never closes) hides the brackets after it, so the text after its quote
+    is scanned once more, at most _MAX_RESCANS times.
+    """
+    start = 0
+    for _ in range(_MAX_RESCANS + 1):
+        # Spans opened since the stack was last empty, and the open brackets as
+        # indexes into it (None for brackets that are not candidates)
+        spans = []
+        stack = []
+        quote = None
+        quote_at = None
+        escaped_at = -1
+        for match in _STRUCTURAL_CHARS.finditer(text, start):
+            i = match.start()
+            ch = text[i]
+            if quote:
+                if i == escaped_at:
+                    continue
+                if ch == "\\":
+                    escaped_at = i + 1
+                elif ch == quote:
+                    quote = None
+            elif not stack:
+                if ch in openers:
+                    stack.append(len(spans))
+                    spans.append([i, None])
+            elif ch in "\"'":
+                quote = ch
+                quote_at = i
+            elif ch in "[{":
+                if ch in openers:
+                    stack.append(len(spans))
+                    spans.append([i, None])
+                else:
+                    stack.append(None)
+            elif ch in "]}":
+                index = stack.pop()
+                if index is not None:
+                    spans[index][1] = i + 1
+                if not stack:
+                    yield from spans
+                    spans = []
+        # Spans that closed inside a bracket that never did
+        yield from (span for span in spans if span[1] is not None)
+        if quote is None:
+            return
+        start = quote_at + 1
+
+
+def extract_json(text, expect=None):
+    """
+    Extracts the first JSON object or array from LLM text.
+    Tolerates ```json fences and prose around the payload, and Python literals
+    (single quotes, True/False/None) when the text is not strict JSON. Candidate
+    payloads are found in one bracket-matching pass (see _candidate_spans), so
+    extraction stays linear in the text length even for truncated output with
+    brackets that never close; only bracketed prose that fails to decode moves
+    on to the next candidate.
+
+    Args:
+        text (str): Raw LLM output.
+        expect: dict or list to only accept that kind of payload.
+
+    Returns:
+        The parsed dict or list.
+
+    Raises:
+        LLMOutputError: If no payload of the expected kind can be parsed.
+    """
+    if not isinstance(text, str):
+        raise LLMOutputError(f"Expected text, got {type(text).__name__}")
+
+    openers = {dict: "{", list: "["}.get(expect, "{[")
+    for begin, end in _candidate_spans(text, openers):
+        snippet = text[begin:end]
+        try:
+            return json.loads(snippet)
+        except json.JSONDecodeError:
+            pass
+        try:
+            value = ast.literal_eval(snippet)
+            if isinstance(value, (dict, list)):
+                return value
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            pass
+        # Not a payload (e.g. "[optional]" in prose); try the next candidate
+    raise LLMOutputError(f"No JSON {'object' if expect is dict else 'array' if expect is list else 'payload'} found")
+
+
+def _to_number(value, field):
+    if isinstance(value, bool):
+        raise LLMOutputError(f"'{field}' must be a number")
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        cleaned = value.replace(",", "").replace("₹", "").replace("INR", "").strip()
+        try:
+            number = float(cleaned)
+        except ValueError:
+            raise LLMOutputError(f"'{field}' must be a number, got {value!r}")
+        return int(number) if number.is_integer() else number
+    raise LLMOutputError(f"'{field}' must be a number")
+
+
+def parse_themes(payload):
+    """
+    Parses and validates a theme list. Accepts raw LLM text or an already parsed list.
+
+    Returns:
+        list: Theme dicts, each with Name, Description and Aesthetic/Visual Style.
+    """
+    themes = payload if isinstance(payload, list) else extract_json(payload, expect=list)
+    if not themes:
+        raise LLMOutputError("Theme list is empty")
+    for i, theme in enumerate(themes, start=1):
+        if not isinstance(theme, dict):
+            raise LLMOutputError(f"Theme {i} is not an object")
+        missing = [field for field in THEME_FIELDS if not isinstance(theme.get(field), str)]
+        if missing:
+            raise LLMOutputError(f"Theme {i} is missing {', '.join(missing)}")
+    return themes
+
+
+def parse_budget_allocation(payload):
+    """
+    Parses and validates a budget allocation. Accepts raw LLM text or an already parsed dict.
+
+    Returns:
+        dict: Allocation with numeric food, entertainment and decorations.
+    """
+    allocation = dict(payload) if isinstance(payload, dict) else extract_json(payload, expect=dict)
+    for field in BUDGET_FIELDS:
+        if field not in allocation:
+            raise LLMOutputError(f"Budget allocation is missing '{field}'")
+        allocation[field] = _to_number(allocation[field], field)
+    if "total" in allocation:
+        allocation["total"] = _to_number(allocation["total"], "total")
+    allocation["reasoning"] = str(allocation.get("reasoning", ""))
+    return allocation
+
+
+def parse_keywords(payload):
+    """
+    Parses and validates a decoration keyword list. Accepts raw LLM text or an
+    already parsed list. Numbers in the list (old amount fields) are dropped.
+
+    Returns:
+        list: Non-empty keyword strings.
+    """
+    values = payload if isinstance(payload, list) else extract_json(payload, expect=list)
+    keywords = [value.strip() for value in values if isinstance(value, str) and value.strip()]
+    if not keywords:
+        raise LLMOutputError("Keyword list is empty")
+    return keywords
+
+
+def parse_budget_and_keywords(payload):
+    """
+    Parses and validates a budget allocation that also carries a "keywords" list,
+    as returned by the fused budget and keyword prompt. Accepts raw LLM text or
+    an already parsed dict.
+
+    Returns:
+        tuple: (allocation, keywords), validated like parse_budget_allocation and parse_keywords.
+    """
+    combined = dict(payload) if isinstance(payload, dict) else extract_json(payload, expect=dict)
+    if not isinstance(combined.get("keywords"), list):
+        raise LLMOutputError("Budget allocation is missing the 'keywords' list")
+    keywords = parse_keywords(combined.pop("keywords"))
+    return parse_budget_allocation(combined), keywords
+
+
+class IncrementalJSONArrayParser:
+    """
+    Parses a JSON array of objects from streamed LLM text, emitting each object
+    as soon as its closing brace arrives. Text before the opening bracket, such
+    as prose or a ```json fence, is skipped. Each character is scanned once.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._in_array = False
+        self._done = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._object_start = None
+
+    def feed(self, chunk):
+        """
+        Adds a chunk of text and returns the list of objects completed by it.
+        """
+        self.buffer += chunk
+        completed = []
+        buffer = self.buffer
+        i = self._pos
+        while i < len(buffer) and not self._done:
+            ch = buffer[i]
+            if not self._in_array:
+                if ch == "[":
+                    self._in_array = True
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._object_start = i
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._object_start is not None:
+                    try:
+                        completed.append(json.loads(buffer[self._object_start:i + 1]))
+                    except json.JSONDecodeError as e:
+                        print(f"Skipping malformed streamed object: {e}")
+                    self._object_start = None
+            elif ch == "]" and self._depth == 0:
+                self._done = True
+            i += 1
+        self._pos = i
+        return completed
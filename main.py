@@ -1,11 +1,14 @@
 import streamlit as st
 import json
-import pandas as pd
-import re
-from urllib.parse import quote
-from langgprahCode import run_event_planning
-from themeBaseCode import extract_theme_details,generate_themes
-from langgprahCode import select_theme_node,GraphState
+from planCheckpoints import plan_thread_id
+from planningClient import PLANNING_SERVICE_URL, PlanningServiceError, fetch_themes, fetch_event_plan
+from imageCache import get_thumbnails, is_image_url, placeholder_image
+from speculativePlanning import SPECULATIVE_PLANNING, get_speculative_planner, plan_in_process, plan_with_service
+import requests
+import uuid
+
+# pandas and the planner modules (langgraph, langchain, Gemini) are imported where
+# they are first used, so the page shell paints before the LLM stack is loaded.
 
 def load_event_plan(json_data=None):
     """Load event plan from JSON data or file upload."""
@@ -112,14 +115,11 @@ def display_theme(theme):
                         unsafe_allow_html=True
                     )
 
-def display_budget(budget_allocation):
-    """Display budget allocation with chart."""
-    if not budget_allocation:
-        st.warning("No budget information available")
-        return
-        
-    st.header("💰 Budget Allocation")
-    
+@st.cache_data(show_spinner=False)
+def build_budget_dataframe(budget_allocation):
+    """Build the budget table once per allocation; reruns reuse the cached frame."""
+    import pandas as pd
+
     # Get the main budget categories
     categories = []
     amounts = []
@@ -135,17 +135,30 @@ def display_budget(budget_allocation):
             except (ValueError, TypeError):
                 pass
     
-    # Create and display budget table
-    if categories and amounts:
-        budget_df = pd.DataFrame({
-            "Category": categories,
-            "Amount": amounts
-        })
-        
-        # Calculate percentages
-        total = budget_allocation.get("total", sum(amounts))
-        budget_df["Percentage"] = budget_df["Amount"].apply(lambda x: f"{(x/total)*100:.1f}%")
+    if not (categories and amounts):
+        return None
+    
+    budget_df = pd.DataFrame({
+        "Category": categories,
+        "Amount": amounts
+    })
+    
+    # Calculate percentages
+    total = budget_allocation.get("total", sum(amounts))
+    budget_df["Percentage"] = budget_df["Amount"].apply(lambda x: f"{(x/total)*100:.1f}%")
+    return budget_df
+
+def display_budget(budget_allocation):
+    """Display budget allocation with chart."""
+    if not budget_allocation:
+        st.warning("No budget information available")
+        return
         
+    st.header("💰 Budget Allocation")
+    
+    # Create and display budget table
+    budget_df = build_budget_dataframe(budget_allocation)
+    if budget_df is not None:
         # Display as table
         st.table(budget_df)
         
@@ -153,11 +166,20 @@ def display_budget(budget_allocation):
         st.subheader("Budget Distribution")
         st.bar_chart(budget_df.set_index("Category")["Amount"])
     
+    # Costs the budget could not cover (e.g. food above its guideline share)
+    for category, amount in budget_allocation.get("shortfall", {}).items():
+        st.warning(f"{category.title()} is {amount:,} short of its full cost; see the reasoning below.")
+
     # Display reasoning if available
     if "reasoning" in budget_allocation:
+        from BudgetAllocation import get_enriched_reasoning
+
         with st.expander("Budget Reasoning", expanded=True):
+            # Prefer the LLM-written reasoning: carried in the plan, or finished since
+            reasoning_text = (budget_allocation.get("enriched_reasoning")
+                              or get_enriched_reasoning(budget_allocation)
+                              or budget_allocation["reasoning"])
             # Format the reasoning text into paragraphs
-            reasoning_text = budget_allocation["reasoning"]
             paragraphs = reasoning_text.split("\n\n")
             
             for paragraph in paragraphs:
@@ -178,6 +200,9 @@ def display_decorations(decoration_data):
     # Show budget info
     st.info(f"Total Decoration Budget: ₹{total_amount:,}")
     
+    if decoration_data.get("basket"):
+        display_basket(decoration_data["basket"])
+    
     if "products" not in decoration_data or not decoration_data["products"]:
         st.warning("No specific products found in recommendations")
         return
@@ -196,6 +221,131 @@ def display_decorations(decoration_data):
             with tab:
                 display_product_category(product_categories[i], amount_per_product)
 
+@st.cache_data(show_spinner=False)
+def build_basket_dataframe(basket_items):
+    """Build the basket table once per basket."""
+    import pandas as pd
+
+    return pd.DataFrame([{
+        "Category": item.get("keyword", ""),
+        "Product": item.get("title", ""),
+        "Unit Price": f"₹{item['unit_price']:,.2f}",
+        "Qty": item["quantity"],
+        "Total": f"₹{item['line_total']:,.2f}",
+    } for item in basket_items])
+
+def display_basket(basket):
+    """Display the basket chosen to fit the decorations budget."""
+    st.subheader("🧺 Suggested Basket")
+    
+    if not basket.get("items"):
+        st.info("No combination of the products found fits the decoration budget")
+        return
+    
+    cols = st.columns(3)
+    cols[0].metric("Basket Total", f"₹{basket['total_cost']:,.2f}")
+    cols[1].metric("Remaining Budget", f"₹{basket['remaining_budget']:,.2f}")
+    cols[2].metric("Items", sum(item["quantity"] for item in basket["items"]))
+    
+    st.table(build_basket_dataframe(basket["items"]))
+
+@st.cache_data(show_spinner=False)
+def build_product_grid(items, keyword, cols_per_row=3):
+    """Prepare the product cards once per product list, split into rows of the grid.
+    No I/O here: photos are resolved to thumbnails on every run (see display_product_category)."""
+    cards = []
+    for item in items:
+        if is_image_url(item.get("imageUrl")):
+            image_url, image = item["imageUrl"], None
+        else:
+            # Create placeholder
+            placeholder_text = keyword.split()[0] if keyword.split() else "Product"
+            image_url, image = None, placeholder_image(placeholder_text)
+        
+        # Product info
+        title = item.get("title", "No title")
+        if len(title) > 60:
+            display_title = title[:57] + "..."
+        else:
+            display_title = title
+        
+        rating = item.get("rating")
+        rating_text = "Not available"
+        if rating:
+            try:
+                rating_float = float(rating)
+                rating_text = f"{'⭐' * int(rating_float)} ({rating})"
+            except (ValueError, TypeError):
+                pass
+        
+        cards.append({
+            "image_url": image_url,
+            "image": image,
+            "title": display_title,
+            "url": item.get("url", "#"),
+            "price": item.get("price", "Price not available"),
+            "rating": rating_text,
+        })
+    return [cards[i:i + cols_per_row] for i in range(0, len(cards), cols_per_row)]
+
+def build_graph_state(user_input, themes, selected_theme_index):
+    """Initial langgprahCode.GraphState for planning one of the generated themes (1-based index)."""
+    return {
+        "event_data": user_input,
+        "themes_json": themes,
+        "selected_theme_index": selected_theme_index,
+        "event_details": {},
+        "budget_allocation": {},
+        "Decoration_Recommandations": {}
+    }
+
+def clear_event_plan(session_id, speculative=False):
+    """Drops the plan on screen (and its checkpoint link) when it no longer matches the
+    themes or inputs; with speculative=True the session's background plans are cancelled too."""
+    st.session_state.pop("event_plan", None)
+    if "plan" in st.query_params:
+        del st.query_params["plan"]
+    if speculative and SPECULATIVE_PLANNING:
+        get_speculative_planner().discard(session_id)
+
+
+def wait_for_speculative_plan(future):
+    """Result of a claimed speculative plan, waiting if it is still running; None if it failed or was cancelled."""
+    if future is None:
+        return None
+    try:
+        if future.done():
+            return future.result()
+        with st.spinner("Finishing the plan started in the background..."):
+            return future.result()
+    except Exception as e:
+        print(f"Speculative plan failed, planning again: {e}")
+        return None
+
+def stream_decorations(graph_state, thread_id):
+    """Run the plan while showing each category's products as soon as its search completes."""
+    from langgprahCode import stream_event_planning
+
+    event_plan = None
+    progress = st.empty()
+    with progress.container():
+        st.header("✨ Finding Decorations...")
+        placeholders = {}
+        for kind, payload in stream_event_planning(graph_state, thread_id=thread_id):
+            if kind == "decoration_keywords":
+                for keyword in payload:
+                    placeholders[keyword] = st.empty()
+                    placeholders[keyword].info(f"Searching products for {keyword}...")
+            elif kind == "decoration_block":
+                placeholder = placeholders.get(payload.get("keyword")) or st.empty()
+                with placeholder.container():
+                    display_product_category(payload, None)
+            else:
+                event_plan = payload
+    # The finished plan is rendered in full below
+    progress.empty()
+    return event_plan
+
 def display_product_category(category, budget_per_category):
     """Display products for a specific category."""
     keyword = category.get("keyword", "Unknown Category")
@@ -203,7 +353,8 @@ def display_product_category(category, budget_per_category):
     error = category.get("error", None)
     
     st.subheader(keyword)
-    st.write(f"Budget allocated: ₹{budget_per_category:,}")
+    if budget_per_category is not None:
+        st.write(f"Budget allocated: ₹{budget_per_category:,}")
     
     if error:
         st.warning(f"Error retrieving products: {error}")
@@ -215,53 +366,34 @@ def display_product_category(category, budget_per_category):
     
     # Display products in a grid
     cols_per_row = 3
+    rows = build_product_grid(items, keyword, cols_per_row)
+    # Local thumbnails, usually prefetched right after the product search and read from
+    # the disk cache; looked up outside the cached grid so a failed download is retried
+    thumbnails = get_thumbnails([card["image_url"] for row in rows for card in row if card["image_url"]])
     
-    for i in range(0, len(items), cols_per_row):
+    for row in rows:
         # Create a row of columns
         cols = st.columns(cols_per_row)
         
         # Fill each column with a product
-        for j in range(cols_per_row):
-            if i + j < len(items):
-                item = items[i + j]
-                with cols[j]:
-                    # Display image if available
-                    if "imageUrl" in item and item["imageUrl"]:
-                        st.image(item["imageUrl"], use_container_width=True)
-                    else:
-                        # Create placeholder
-                        placeholder_text = quote(keyword.split()[0])
-                        st.image(f"https://via.placeholder.com/200x150?text={placeholder_text}")
-                    
-                    # Product info
-                    title = item.get("title", "No title")
-                    if len(title) > 60:
-                        display_title = title[:57] + "..."
-                    else:
-                        display_title = title
-                    
-                    # Make title clickable to Amazon
-                    url = item.get("url", "#")
-                    st.markdown(f"**[{display_title}]({url})**")
-                    
-                    # Price and rating
-                    price = item.get("price", "Price not available")
-                    rating = item.get("rating")
-                    
-                    st.write(f"**Price:** {price}")
-                    
-                    if rating:
-                        try:
-                            rating_float = float(rating)
-                            st.write(f"**Rating:** {'⭐' * int(rating_float)} ({rating})")
-                        except (ValueError, TypeError):
-                            st.write(f"**Rating:** Not available")
-                    else:
-                        st.write("**Rating:** Not available")
-                    
-                    # Add Buy button
-                    if url != "#":
-                        st.markdown(f"[Buy on Amazon]({url})")
+        for j, card in enumerate(row):
+            with cols[j]:
+                if card["image_url"]:
+                    # Fall back to the full-size photo if the thumbnail could not be fetched
+                    st.image(thumbnails.get(card["image_url"]) or card["image_url"], use_container_width=True)
+                else:
+                    st.image(card["image"], use_container_width=False)
+                
+                # Make title clickable to Amazon
+                st.markdown(f"**[{card['title']}]({card['url']})**")
+                
+                # Price and rating
+                st.write(f"**Price:** {card['price']}")
+                st.write(f"**Rating:** {card['rating']}")
+                
+                # Add Buy button
+                if card["url"] != "#":
+                    st.markdown(f"[Buy on Amazon]({card['url']})")
 
 def main():
     st.set_page_config(
@@ -332,6 +464,11 @@ def main():
         value=40  # Default non-veg guests
     )
 
+    # Session id lives in the URL so checkpointed plans survive reruns and page refreshes
+    if "session" not in st.query_params:
+        st.query_params["session"] = uuid.uuid4().hex
+    session_id = st.query_params["session"]
+
     event_plan = None
     if total_budget > 0 and guest_count > 0:
         user_input = {
@@ -343,20 +480,53 @@ def main():
                 "veg_count": veg_count,
                 "nonveg_count": nonveg_count
             }
+        if st.session_state.get("user_input") not in (None, user_input):
+            # The plan and its speculative siblings were made for the old inputs;
+            # the themes stay, and confirming one plans it with the new inputs
+            clear_event_plan(session_id, speculative=True)
+            st.session_state["user_input"] = user_input
 
     # Generate Themes Button
     if st.sidebar.button("Generate Themes"):
-        theme_output = generate_themes(user_input)
-        print(theme_output)
-        json_pattern = r"```json\s*([\s\S]*?)\s*```"
-        match = re.search(json_pattern, theme_output)
+        # The plan on screen belongs to the previous themes
+        clear_event_plan(session_id)
+        # Render each theme as soon as it has streamed in
+        st.subheader("Generating themes...")
+        themes_json = []
+        if PLANNING_SERVICE_URL:
+            # Thin-client mode: the planning service returns all themes at once
+            try:
+                theme_stream = fetch_themes(user_input)
+            except (PlanningServiceError, requests.RequestException) as e:
+                st.error(f"Planning service error: {e}")
+                theme_stream = []
+        else:
+            from themeBaseCode import stream_themes
+
+            theme_stream = stream_themes(user_input)
+        for theme in theme_stream:
+            themes_json.append(theme)
+            with st.expander(f"{len(themes_json)}. {theme.get('Name', 'Theme')}", expanded=True):
+                st.write(theme.get("Description", ""))
+                st.caption(theme.get("Aesthetic/Visual Style", ""))
         
-        if match:
-            themes_json = json.loads(match.group(1))
+        if themes_json:
             st.session_state["themes"] = themes_json
-            st.session_state["theme_output"] = theme_output
+            st.session_state["theme_output"] = json.dumps(themes_json)
             st.session_state["user_input"] = user_input
+            if SPECULATIVE_PLANNING:
+                # Plan every theme in the background while the user reads them
+                get_speculative_planner().start(
+                    session_id,
+                    [build_graph_state(user_input, themes_json, i + 1) for i in range(len(themes_json))],
+                    plan_with_service if PLANNING_SERVICE_URL else plan_in_process
+                )
         else:
+            from themeBaseCode import invalidate_theme_cache
+
+            invalidate_theme_cache(user_input)
+            if SPECULATIVE_PLANNING:
+                get_speculative_planner().discard(session_id)
             st.error("Couldn't parse themes. Try again.")
 
     # Theme selection
@@ -366,18 +536,44 @@ def main():
         
         if st.sidebar.button("Confirm and Continue Planning"):
             st.session_state["selected_theme_index"] = selected_index + 1
-            graph_state: GraphState = {
-                "event_data": st.session_state["user_input"],
-                "themes_json": st.session_state["themes"],
-                "selected_theme_index": st.session_state["selected_theme_index"],  # if user selected the 3rd theme: "Around the World in an Evening"
-                "event_details": {},
-                "budget_allocation": {},
-                "Decoration_Recommandations": {}
-            }
+            # if user selected the 3rd theme: "Around the World in an Evening"
+            graph_state = build_graph_state(st.session_state["user_input"], st.session_state["themes"],
+                                            st.session_state["selected_theme_index"])
             # st.json(st.session_state["themes"])
             # st.json(graph_state)
-            event_plan = run_event_planning(graph_state)
+            thread_id = plan_thread_id(session_id, graph_state)
+            # The plan started in the background when the themes came in, if any;
+            # the other themes' plans are cancelled
+            if SPECULATIVE_PLANNING:
+                event_plan = wait_for_speculative_plan(get_speculative_planner().claim(session_id, thread_id))
+            if event_plan:
+                st.session_state["event_plan"] = event_plan
+                if not PLANNING_SERVICE_URL:
+                    st.query_params["plan"] = thread_id
+            elif PLANNING_SERVICE_URL:
+                try:
+                    event_plan = fetch_event_plan(graph_state["event_data"], graph_state["themes_json"],
+                                                  graph_state["selected_theme_index"], thread_id=thread_id)
+                    st.session_state["event_plan"] = event_plan
+                except (PlanningServiceError, requests.RequestException) as e:
+                    st.error(f"Planning service error: {e}")
+            else:
+                # Resumes from the last completed node if this plan was interrupted
+                event_plan = stream_decorations(graph_state, thread_id)
+                st.session_state["event_plan"] = event_plan
+                st.query_params["plan"] = thread_id
+                # Land on the products that were just streamed in
+                st.session_state["active_tab"] = "Decorations"
 
+    # Widget reruns reuse the plan kept in the session; page refreshes reload it from its checkpoint
+    if not event_plan:
+        event_plan = st.session_state.get("event_plan")
+    if not event_plan and "plan" in st.query_params and not PLANNING_SERVICE_URL:
+        from langgprahCode import load_event_plan_checkpoint
+
+        event_plan = load_event_plan_checkpoint(st.query_params["plan"])
+        if event_plan:
+            st.session_state["event_plan"] = event_plan
 
     
     # Display the event plan if available
@@ -388,10 +584,11 @@ def main():
     # Get event type for dynamic title
     event_type = event_plan.get("event_details", {}).get("event_type", "Event")
     
-    # Navigation tabs with dynamic naming
-    tab1, tab2, tab3 = st.tabs(["Overview", "Budget", "Decorations"])
+    # Navigation tabs; only the selected view is rendered on each rerun
+    active_tab = st.radio("View", ["Overview", "Budget", "Decorations"], key="active_tab",
+                          horizontal=True, label_visibility="collapsed")
     
-    with tab1:
+    if active_tab == "Overview":
         # Display event details
         if "event_details" in event_plan:
             display_event_details(event_plan["event_details"])
@@ -400,14 +597,14 @@ def main():
             if "theme" in event_plan["event_details"]:
                 display_theme(event_plan["event_details"]["theme"])
     
-    with tab2:
+    elif active_tab == "Budget":
         # Display budget allocation
         if "budget_allocation" in event_plan:
             display_budget(event_plan["budget_allocation"])
     
-    with tab3:
-        # Check for various decoration key naming patterns
-        decoration_keys = [k for k in event_plan.keys() if any(term in k.lower() for term in ["decoration", "recomm", "decor"])]
+    else:
+        # Check for various decoration key naming patterns (the keyword list is not a recommendation)
+        decoration_keys = [k for k in event_plan.keys() if k != "decoration_keywords" and any(term in k.lower() for term in ["decoration", "recomm", "decor"])]
         
         if decoration_keys:
             display_decorations(event_plan[decoration_keys[0]])
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from llmClient import llm_factory
+from llmCache import CachedChain
+from planTracing import span
+from rateLimiter import UpstreamUnavailable
+
+# Model tiers tried in order for each chain, the timeout of one attempt and the
+# latency budget of all attempts together, in seconds. Callers fall back to a
+# deterministic path when every tier has failed or the budget is spent.
+ROUTES = {
+    "theme_generation": {"tiers": ["large", "small"], "timeout": 20, "budget": 30},
+    "budget_allocation": {"tiers": ["large", "small"], "timeout": 15, "budget": 20},
+    # Fused budget allocation and decoration keywords (BUDGET_ALLOCATION_MODE=fused)
+    "budget_keywords": {"tiers": ["large", "small"], "timeout": 15, "budget": 20},
+    # Background enrichment of text that already has a rule-based version
+    "budget_reasoning": {"tiers": ["small"], "timeout": 20, "budget": 20},
+    # A three-item list does not need the large model
+    "decoration_keywords": {"tiers": ["small"], "timeout": 8, "budget": 8},
+}
+# JSON overrides merged into ROUTES, e.g. '{"decoration_keywords": {"tiers": ["large"], "timeout": 5}}'
+_overrides = json.loads(os.getenv("LLM_ROUTES", "") or "{}")
+for _name, _override in _overrides.items():
+    ROUTES[_name] = {**ROUTES.get(_name, {"tiers": ["large"], "timeout": 30, "budget": 30}), **_override}
+
+# Sync attempts run on a pool per tier so they can be abandoned when their timeout
+# passes; abandoned calls on a slow tier never hold up the fallback tier
+MAX_ROUTE_WORKERS = int(os.getenv("MAX_ROUTE_WORKERS", 16))
+_route_executors = {}
+_route_executors_lock = threading.Lock()
+
+
+def _route_executor(tier):
+    with _route_executors_lock:
+        executor = _route_executors.get(tier)
+        if executor is None:
+            executor = _route_executors[tier] = ThreadPoolExecutor(
+                max_workers=MAX_ROUTE_WORKERS, thread_name_prefix=f"llm-route-{tier}")
+        return executor
+
+
+def _run_started(started, fn, *args):
+    started.set()
+    return fn(*args)
+
+
+class RouteUnavailable(UpstreamUnavailable):
+    """
+    Raised when every tier of a route timed out or failed within its latency budget.
+    """
+
+
+class RoutedChain:
+    """
+    A chain whose model is chosen per route (see ROUTES): one CachedChain per
+    tier, tried in order, each attempt bounded by the route's timeout and by
+    what is left of its latency budget. Each tier calls its own upstream
+    ("gemini:<tier>"), so failures of one tier do not open the other's circuit. Every attempt is recorded as a "route"
+    span named "<route>:<tier>", so per-route latency shows up in the span
+    metrics and the JSONL trace.
+
+    Usage:
+        chain = RoutedChain("decoration_keywords", keyword_prompt)
+        try:
+            response = chain.invoke(inputs)
+        except RouteUnavailable:
+            ...  # deterministic fallback
+    """
+
+    def __init__(self, name, prompt, parser=None):
+        self.name = name
+        self.route = ROUTES.get(name, {"tiers": ["large"], "timeout": 30, "budget": 30})
+        self.chains = [(tier, CachedChain(name, prompt, llm_factory(tier), parser, upstream=f"gemini:{tier}"))
+                       for tier in self.route["tiers"]]
+
+    def _attempts(self):
+        """
+        Yields (tier, chain, deadline) for each tier while the latency budget lasts.
+        """
+        deadline = time.monotonic() + self.route["budget"]
+        for tier, chain in self.chains:
+            if deadline <= time.monotonic():
+                return
+            yield tier, chain, deadline
+
+    def _timeout(self, deadline):
+        return max(0.0, min(self.route["timeout"], deadline - time.monotonic()))
+
+    def _unavailable(self, errors):
+        return RouteUnavailable(f"{self.name}: " + ("; ".join(errors) or "latency budget spent"))
+
+    def invoke(self, inputs, bypass=False):
+        """
+        Invokes the route's tiers in order until one answers in time; a tier
+        that times out or fails (after its own retries) moves on to the next.
+
+        Raises:
+            RouteUnavailable: If no tier answered within the timeout and budget.
+        """
+        errors = []
+        for tier, chain, deadline in self._attempts():
+            with span(f"{self.name}:{tier}", "route") as s:
+                started = threading.Event()
+                future = _route_executor(tier).submit(contextvars.copy_context().run, _run_started,
+                                                      started, chain.invoke, inputs, bypass)
+                # The timeout runs from when the call starts, not while it waits for a worker
+                if not started.wait(self._timeout(deadline)) and future.cancel():
+                    s.set(outcome="queued")
+                    errors.append(f"{tier} found no free worker")
+                    continue
+                timeout = self._timeout(deadline)
+                s.set(timeout=round(timeout, 3))
+                try:
+                    response = future.result(timeout=timeout)
+                    s.set(outcome="ok")
+                    return response
+                except FuturesTimeoutError:
+                    # The call keeps running and still fills the cache for the next request
+                    s.set(outcome="timeout")
+                    errors.append(f"{tier} timed out after {timeout:.1f}s")
+                except Exception as e:
+                    s.set(outcome="failed")
+                    errors.append(f"{tier} failed: {e}")
+        raise self._unavailable(errors)
+
+    async def ainvoke(self, inputs, bypass=False):
+        """
+        Async version of invoke; a timed-out attempt is cancelled.
+        """
+        errors = []
+        for tier, chain, deadline in self._attempts():
+            timeout = self._timeout(deadline)
+            with span(f"{self.name}:{tier}", "route", timeout=round(timeout, 3)) as s:
+                try:
+                    response = await asyncio.wait_for(chain.ainvoke(inputs, bypass), timeout)
+                    s.set(outcome="ok")
+                    return response
+                except asyncio.TimeoutError:
+                    s.set(outcome="timeout")
+                    errors.append(f"{tier} timed out after {timeout:.1f}s")
+                except Exception as e:
+                    s.set(outcome="failed")
+                    errors.append(f"{tier} failed: {e}")
+        raise self._unavailable(errors)
+
+    def stream(self, inputs, bypass=False):
+        """
+        Streams from the first tier whose stream opens. Streams show progress as
+        they go, so they are not cut off by the timeout; only a tier that fails
+        before its first chunk moves on to the next one.
+        """
+        errors = []
+        for tier, chain in self.chains:
+            chunks = chain.stream(inputs, bypass)
+            try:
+                first = next(chunks, None)
+            except Exception as e:
+                errors.append(f"{tier} failed: {e}")
+                continue
+            if first is not None:
+                yield first
+            yield from chunks
+            return
+        raise self._unavailable(errors)
+
+    def invalidate(self, inputs):
+        """
+        Drops the cached response of every tier for these inputs.
+        """
+        for _, chain in self.chains:
+            chain.invalidate(inputs)
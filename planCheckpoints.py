@@ -0,0 +1,120 @@
+import os
+import json
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import weakref
+
+# Checkpoint settings, overridable from the environment
+PLAN_CHECKPOINT_PATH = os.getenv("PLAN_CHECKPOINT_PATH", os.path.join(".cache", "plan_checkpoints.sqlite3"))
+# Number of most recent plan threads whose checkpoints are kept
+PLAN_CHECKPOINT_MAX_THREADS = int(os.getenv("PLAN_CHECKPOINT_MAX_THREADS", 500))
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+# One async checkpointer per event loop (AsyncSqliteSaver is bound to the loop that
+# created it), kept with the generator that closes its connection
+_async_checkpointers = weakref.WeakKeyDictionary()
+
+
+def _checkpoint_path():
+    directory = os.path.dirname(PLAN_CHECKPOINT_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return PLAN_CHECKPOINT_PATH
+
+
+def get_checkpointer():
+    """
+    Returns the process-wide SQLite checkpointer for planning graph runs.
+    """
+    global _checkpointer
+    if _checkpointer is None:
+        with _checkpointer_lock:
+            if _checkpointer is None:
+                from langgraph.checkpoint.sqlite import SqliteSaver
+
+                conn = sqlite3.connect(_checkpoint_path(), check_same_thread=False, timeout=10)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA busy_timeout=10000")
+                _checkpointer = SqliteSaver(conn)
+                _checkpointer.setup()
+    return _checkpointer
+
+
+async def _close_on_loop_shutdown(conn):
+    """
+    Suspends until the event loop finalizes its async generators on shutdown
+    (asyncio.run does, via loop.shutdown_asyncgens), then closes the connection.
+    """
+    try:
+        yield
+    finally:
+        await conn.close()
+
+
+async def get_async_checkpointer():
+    """
+    Returns the async SQLite checkpointer for planning graph runs on the running
+    event loop. It shares the database file (WAL mode) with get_checkpointer.
+    """
+    loop = asyncio.get_running_loop()
+    entry = _async_checkpointers.get(loop)
+    if entry is None:
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+        conn = await aiosqlite.connect(_checkpoint_path(), timeout=10)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA busy_timeout=10000")
+        saver = AsyncSqliteSaver(conn)
+        await saver.setup()
+        closer = _close_on_loop_shutdown(conn)
+        # Started on this loop, so the loop tracks it until shutdown
+        await closer.__anext__()
+        # Another plan on this loop may have opened one while this one was connecting
+        entry = _async_checkpointers.get(loop)
+        if entry is None:
+            entry = _async_checkpointers[loop] = (saver, closer)
+        else:
+            await closer.aclose()
+    return entry[0]
+
+
+def plan_thread_id(session_id, graph_state):
+    """
+    Builds the checkpoint thread id for a session and its planning inputs, so the
+    same inputs in the same session resume one run and new inputs start a new one.
+    """
+    inputs = {
+        "event_data": graph_state.get("event_data", {}),
+        "themes_json": graph_state.get("themes_json", []),
+        "selected_theme_index": graph_state.get("selected_theme_index", 1),
+    }
+    digest = hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{session_id}:{digest[:16]}"
+
+
+def prune_checkpoints(max_threads=PLAN_CHECKPOINT_MAX_THREADS):
+    """
+    Deletes checkpoints of all but the most recently updated plan threads.
+    Checkpoint ids are time-ordered, so the newest id of a thread is its last update.
+
+    Returns:
+        int: Number of threads removed.
+    """
+    saver = get_checkpointer()
+    with saver.lock:
+        cur = saver.conn.cursor()
+        cur.execute(
+            "SELECT thread_id FROM checkpoints GROUP BY thread_id "
+            "ORDER BY MAX(checkpoint_id) DESC LIMIT -1 OFFSET ?",
+            (max_threads,)
+        )
+        stale = [(row[0],) for row in cur.fetchall()]
+        if stale:
+            cur.executemany("DELETE FROM checkpoints WHERE thread_id = ?", stale)
+            cur.executemany("DELETE FROM writes WHERE thread_id = ?", stale)
+            saver.conn.commit()
+    return len(stale)
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import uuid
+import inspect
+import threading
+import functools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+
+# Tracing settings, overridable from the environment
+# Append every finished span to this JSONL file (unset: keep spans in memory only)
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "")
+# Number of finished spans kept in memory for get_recent_spans()
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", 10000))
+TRACE_DISABLED = os.getenv("TRACE_DISABLED", "").lower() in ("1", "true", "yes")
+
+# Upper bounds of the span duration histogram, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Numeric span attributes that are summed per span name for the Prometheus export
+COUNTED_ATTRIBUTES = ("prompt_tokens", "completion_tokens", "retries", "limiter_wait_ms", "request_bytes", "response_bytes")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """
+    One timed operation: a graph node, an LLM chain call, a cache lookup or a
+    RapidAPI request. Spans started inside another span share its trace_id.
+    """
+
+    def __init__(self, name, kind, parent=None, attributes=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        """
+        Sets attributes on the span, e.g. token counts or payload sizes.
+        """
+        self.attributes.update(attributes)
+
+    def add(self, name, amount=1):
+        """
+        Adds to a numeric attribute, e.g. span.add("retries").
+        """
+        self.attributes[name] = self.attributes.get(name, 0) + amount
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanRecorder:
+    """
+    Collects finished spans: keeps the most recent ones, aggregates per-name
+    latency histograms and counters, and optionally appends each span to a JSONL file.
+    """
+
+    def __init__(self, buffer_size=TRACE_BUFFER_SIZE, jsonl_path=TRACE_JSONL_PATH):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=buffer_size)
+        self._stats = {}
+        self.jsonl_path = jsonl_path
+
+    def record(self, span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._spans.append(span)
+            stats = self._stats.get((span.kind, span.name))
+            if stats is None:
+                stats = self._stats[(span.kind, span.name)] = {
+                    "count": 0,
+                    "errors": 0,
+                    "seconds": 0.0,
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                    "cache_hits": 0,
+                    "counters": dict.fromkeys(COUNTED_ATTRIBUTES, 0),
+                }
+            stats["count"] += 1
+            stats["errors"] += 1 if span.error else 0
+            stats["seconds"] += span.duration
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if span.duration <= bound:
+                    stats["buckets"][i] += 1
+            if span.attributes.get("cache") == "hit":
+                stats["cache_hits"] += 1
+            for name in COUNTED_ATTRIBUTES:
+                value = span.attributes.get(name)
+                if isinstance(value, (int, float)):
+                    stats["counters"][name] += value
+
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                        f.write(line + "\n")
+                except OSError:
+                    # A broken trace file must never fail a plan
+                    pass
+
+    def recent(self, trace_id=None):
+        with self._lock:
+            spans = list(self._spans)
+        return [s.to_dict() for s in spans if trace_id is None or s.trace_id == trace_id]
+
+    def stats(self):
+        with self._lock:
+            return {key: {**stats, "buckets": list(stats["buckets"]), "counters": dict(stats["counters"])}
+                    for key, stats in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+            self._stats.clear()
+
+
+_recorder = SpanRecorder()
+
+
+def get_span_recorder():
+    """
+    Returns the process-wide span recorder.
+    """
+    return _recorder
+
+
+def current_span():
+    """
+    Returns the span active in this context, or None.
+    """
+    return _current_span.get()
+
+
+def start_span(name, kind, parent=None, **attributes):
+    """
+    Starts a span without making it the current one, for work that is not a
+    single block (e.g. a generator). Finish it with end_span.
+    """
+    return Span(name, kind, parent or _current_span.get(), attributes)
+
+
+def end_span(s, error=None):
+    """
+    Finishes a span from start_span (or span) and records it.
+    """
+    s.duration = time.perf_counter() - s._start
+    if error is not None:
+        s.error = f"{type(error).__name__}: {error}"
+    if not TRACE_DISABLED:
+        _recorder.record(s)
+
+
+def span_context(s):
+    """
+    Returns a copy of the current context in which s is the current span.
+    Run the steps of a generator in it (context.run(next, gen)) so the work done
+    while advancing it nests under s, but the caller's code between steps does not.
+    """
+    context = contextvars.copy_context()
+    context.run(_current_span.set, s)
+    return context
+
+
+@contextmanager
+def span(name, kind, **attributes):
+    """
+    Times the enclosed block as a child of the current span and records it when
+    the block exits. Exceptions mark the span as failed and are re-raised.
+
+    Usage:
+        with span("rapidapi.search", "http", keyword=keyword) as s:
+            ...
+            s.set(response_bytes=len(res.content))
+    """
+    s = start_span(name, kind, **attributes)
+    token = _current_span.set(s)
+    error = None
+    try:
+        yield s
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _current_span.reset(token)
+        end_span(s, error)
+
+
+def traced(name, kind):
+    """
+    Decorator that runs a sync or async function inside span(name, kind).
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, kind):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def get_recent_spans(trace_id=None):
+    """
+    Returns the most recent finished spans as dicts, optionally for one trace only.
+    """
+    return _recorder.recent(trace_id)
+
+
+def export_spans_jsonl(path, trace_id=None):
+    """
+    Writes the spans kept in memory to a JSON lines file, one span per line.
+
+    Returns:
+        int: Number of spans written.
+    """
+    spans = get_recent_spans(trace_id)
+    with open(path, "w", encoding="utf-8") as f:
+        for s in spans:
+            f.write(json.dumps(s, default=str) + "\n")
+    return len(spans)
+
+
+def render_span_metrics():
+    """
+    Renders the per-span aggregates in the Prometheus text exposition format.
+    """
+    stats = sorted(_recorder.stats().items())
+    lines = ["# TYPE planning_span_seconds histogram"]
+    for (kind, name), s in stats:
+        labels = f'kind="{kind}",name="{name}"'
+        for bound, count in zip(LATENCY_BUCKETS, s["buckets"]):
+            lines.append(f'planning_span_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'planning_span_seconds_bucket{{{labels},le="+Inf"}} {s["count"]}')
+        lines.append(f'planning_span_seconds_sum{{{labels}}} {s["seconds"]:.6f}')
+        lines.append(f'planning_span_seconds_count{{{labels}}} {s["count"]}')
+
+    lines.append("# TYPE planning_span_errors_total counter")
+    for (kind, name), s in stats:
+        lines.append(f'planning_span_errors_total{{kind="{kind}",name="{name}"}} {s["errors"]}')
+    lines.append("# TYPE planning_span_cache_hits_total counter")
+    for (kind, name), s in stats:
+        lines.append(f'planning_span_cache_hits_total{{kind="{kind}",name="{name}"}} {s["cache_hits"]}')
+    for attribute in COUNTED_ATTRIBUTES:
+        lines.append(f"# TYPE planning_span_{attribute}_total counter")
+        for (kind, name), s in stats:
+            if s["counters"][attribute]:
+                lines.append(f'planning_span_{attribute}_total{{kind="{kind}",name="{name}"}} '
+                             f'{s["counters"][attribute]}')
+    return "\n".join(lines) + "\n"
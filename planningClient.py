@@ -0,0 +1,55 @@
+import os
+import requests
+
+# Base URL of planningService.py; when unset, main.py plans in-process
+PLANNING_SERVICE_URL = os.getenv("PLANNING_SERVICE_URL", "").rstrip("/")
+PLANNING_CLIENT_TIMEOUT_SECONDS = float(os.getenv("PLANNING_CLIENT_TIMEOUT_SECONDS", 90))
+
+_session = requests.Session()
+
+
+class PlanningServiceError(Exception):
+    """
+    Raised when the planning service rejects or fails a request.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(f"Planning service returned {status}: {message}")
+        self.status = status
+
+
+def _post(path, payload, base_url=None):
+    res = _session.post(f"{base_url or PLANNING_SERVICE_URL}{path}", json=payload,
+                        timeout=PLANNING_CLIENT_TIMEOUT_SECONDS)
+    data = res.json()
+    if res.status_code != 200:
+        raise PlanningServiceError(res.status_code, data.get("error", "Unknown error"))
+    return data
+
+
+def fetch_themes(user_input, base_url=None):
+    """
+    Asks the planning service for themes.
+
+    Returns:
+        list: Parsed theme dicts.
+    """
+    return _post("/themes", user_input, base_url)["themes"]
+
+
+def fetch_event_plan(event_data, themes, selected_theme_index, base_url=None, thread_id=None):
+    """
+    Asks the planning service to run the full planning graph. With a thread_id the
+    service checkpoints the run and resumes or returns it on a repeat request.
+
+    Returns:
+        dict: The final graph state, as returned by run_event_planning.
+    """
+    payload = {
+        "event_data": event_data,
+        "themes": themes,
+        "selected_theme_index": selected_theme_index,
+    }
+    if thread_id:
+        payload["thread_id"] = thread_id
+    return _post("/plan", payload, base_url)["plan"]
@@ -0,0 +1,328 @@
+"""
+Headless HTTP planning service.
+
+Endpoints:
+    POST /themes   - body: event details; returns {"themes": [...]}
+    POST /plan     - body: {"event_data": {...}, "themes": [...] (optional), "selected_theme_index": 1,
+                            "thread_id": "..." (optional, checkpoints and resumes the run)}
+                     returns {"plan": {...}}
+    GET  /metrics  - Prometheus text metrics, including span latencies (see planTracing)
+    GET  /healthz  - liveness check
+
+Requests run on a bounded worker pool. When every worker is busy and the
+queue is full the service answers 429, and requests that miss their deadline
+answer 504 and are cancelled: a queued job never starts and a running plan
+stops after its current graph step.
+
+Usage:
+    python planningService.py --port 8000 --workers 8 --queue 16 --deadline 60
+"""
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from langgprahCode import run_event_planning, get_graph_compile_stats
+from themeBaseCode import generate_themes, invalidate_theme_cache
+from llmCache import get_llm_cache_stats
+from singleFlight import get_single_flight_stats
+from rateLimiter import get_upstream_stats
+from planTracing import render_span_metrics
+from llmOutputParser import LLMOutputError, parse_themes
+
+PLANNING_SERVICE_WORKERS = int(os.getenv("PLANNING_SERVICE_WORKERS", 8))
+PLANNING_SERVICE_QUEUE = int(os.getenv("PLANNING_SERVICE_QUEUE", 16))
+PLANNING_SERVICE_DEADLINE_SECONDS = float(os.getenv("PLANNING_SERVICE_DEADLINE_SECONDS", 60))
+
+
+class ServiceSaturated(Exception):
+    """
+    Raised when every worker is busy and the wait queue is full.
+    """
+
+
+class WorkerPool:
+    """
+    Bounded thread pool that rejects work instead of queueing without limit.
+    At most `workers + queue_size` jobs are admitted at once.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planning-worker")
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.running = 0
+        self.cancelled = 0
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ServiceSaturated()
+        with self._lock:
+            self.admitted += 1
+
+        def run():
+            with self._lock:
+                self.running += 1
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.admitted -= 1
+                self._slots.release()
+
+        future = self._executor.submit(run)
+        future.add_done_callback(self._release_cancelled)
+        return future
+
+    def _release_cancelled(self, future):
+        # A job cancelled while queued never runs, so its slot is given back here
+        if future.cancelled():
+            with self._lock:
+                self.admitted -= 1
+            self._slots.release()
+
+    def cancel(self, future, cancel_event):
+        """
+        Cancels a job whose caller stopped waiting: a queued job never starts, and a
+        running one sees cancel_event set and stops at its next check.
+        """
+        cancel_event.set()
+        future.cancel()
+        with self._lock:
+            self.cancelled += 1
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": self.admitted, "running": self.running, "queued": self.admitted - self.running,
+                    "cancelled": self.cancelled}
+
+
+class ServiceMetrics:
+    """
+    Request counters and latency totals per endpoint and status code.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+
+    def record(self, endpoint, status, seconds):
+        with self._lock:
+            self.requests[(endpoint, status)] = self.requests.get((endpoint, status), 0) + 1
+            total, count = self.latency.get(endpoint, (0.0, 0))
+            self.latency[endpoint] = (total + seconds, count + 1)
+
+    def render(self, pool):
+        """
+        Renders the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# TYPE planning_requests_total counter",
+        ]
+        with self._lock:
+            for (endpoint, status), count in sorted(self.requests.items()):
+                lines.append(f'planning_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            lines.append("# TYPE planning_request_seconds summary")
+            for endpoint, (total, count) in sorted(self.latency.items()):
+                lines.append(f'planning_request_seconds_sum{{endpoint="{endpoint}"}} {total:.6f}')
+                lines.append(f'planning_request_seconds_count{{endpoint="{endpoint}"}} {count}')
+
+        pool_stats = pool.stats()
+        lines += [
+            "# TYPE planning_workers gauge",
+            f"planning_workers {pool.workers}",
+            "# TYPE planning_in_flight gauge",
+            f"planning_in_flight {pool_stats['in_flight']}",
+            "# TYPE planning_running gauge",
+            f"planning_running {pool_stats['running']}",
+            "# TYPE planning_queued gauge",
+            f"planning_queued {pool_stats['queued']}",
+            "# TYPE planning_cancelled_total counter",
+            f"planning_cancelled_total {pool_stats['cancelled']}",
+        ]
+
+        compile_stats = get_graph_compile_stats()
+        lines += [
+            "# TYPE planning_graph_compiles_total counter",
+            f"planning_graph_compiles_total {compile_stats['compiles']}",
+            "# TYPE planning_graph_compile_seconds_total counter",
+            f"planning_graph_compile_seconds_total {compile_stats['total_compile_seconds']:.6f}",
+        ]
+
+        single_flight = get_single_flight_stats()
+        lines.append("# TYPE planning_singleflight_coalesced_total counter")
+        for group, stats in sorted(single_flight.items()):
+            lines.append(f'planning_singleflight_coalesced_total{{group="{group}"}} {stats["coalesced"]}')
+        lines.append("# TYPE planning_singleflight_waiters gauge")
+        for group, stats in sorted(single_flight.items()):
+            for key, waiters in sorted(stats["in_flight"].items()):
+                label = key.replace("\\", "\\\\").replace('"', '\\"')
+                lines.append(f'planning_singleflight_waiters{{group="{group}",key="{label}"}} {waiters}')
+
+        upstreams = sorted(get_upstream_stats().items())
+        for counter in ("requests", "retries", "throttled", "failures", "rejected"):
+            lines.append(f"# TYPE planning_upstream_{counter}_total counter")
+            for upstream, stats in upstreams:
+                lines.append(f'planning_upstream_{counter}_total{{upstream="{upstream}"}} {stats[counter]}')
+        lines.append("# TYPE planning_upstream_queue_depth gauge")
+        for upstream, stats in upstreams:
+            lines.append(f'planning_upstream_queue_depth{{upstream="{upstream}"}} {stats["queue_depth"]}')
+        lines.append("# TYPE planning_upstream_limiter_wait_seconds summary")
+        for upstream, stats in upstreams:
+            lines.append(f'planning_upstream_limiter_wait_seconds_sum{{upstream="{upstream}"}} '
+                         f'{stats["limiter_wait_seconds"]:.6f}')
+            lines.append(f'planning_upstream_limiter_wait_seconds_count{{upstream="{upstream}"}} '
+                         f'{stats["limiter_waits"]}')
+        lines.append("# TYPE planning_upstream_circuit_open gauge")
+        for upstream, stats in upstreams:
+            lines.append(f'planning_upstream_circuit_open{{upstream="{upstream}"}} '
+                         f'{int(stats["circuit_state"] != "closed")}')
+
+        lines.append("# TYPE planning_llm_cache_hit_ratio gauge")
+        for chain_name, stats in sorted(get_llm_cache_stats().items()):
+            lines.append(f'planning_llm_cache_hit_ratio{{chain="{chain_name}"}} {stats["hit_rate"]:.4f}')
+        # Per-node, per-chain and per-request span latencies, tokens and payload sizes
+        return "\n".join(lines) + "\n" + render_span_metrics()
+
+
+def handle_themes(body, cancel=None):
+    """
+    Generates and parses themes for the event details in the request body.
+    One LLM call, so cancel is only checked before it starts.
+    """
+    if cancel is not None and cancel.is_set():
+        return None
+    try:
+        themes = parse_themes(generate_themes(body))
+    except LLMOutputError:
+        invalidate_theme_cache(body)
+        raise
+    return {"themes": themes}
+
+
+def handle_plan(body, cancel=None):
+    """
+    Runs the planning graph. Themes are generated first if the request has none.
+    A thread_id in the body checkpoints the run so a retry resumes it. Once cancel
+    is set the run stops after its current graph step.
+    """
+    event_data = body["event_data"]
+    themes = body.get("themes") or (handle_themes(event_data, cancel) or {}).get("themes")
+    if cancel is not None and cancel.is_set():
+        return None
+    graph_state = {
+        "event_data": event_data,
+        "themes_json": themes,
+        "selected_theme_index": int(body.get("selected_theme_index", 1)),
+        "event_details": {},
+        "budget_allocation": {},
+        "Decoration_Recommandations": {}
+    }
+    plan = run_event_planning(graph_state, thread_id=body.get("thread_id"), cancel=cancel)
+    return {"plan": plan}
+
+
+ROUTES = {
+    "/themes": handle_themes,
+    "/plan": handle_plan,
+}
+
+
+class PlanningRequestHandler(BaseHTTPRequestHandler):
+    """
+    Routes requests to the worker pool and enforces the request deadline.
+    """
+    server_version = "EventPlannerService/1.0"
+
+    def _send(self, status, payload, content_type="application/json", headers=None):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            text = self.server.metrics.render(self.server.pool)
+            self._send(200, text.encode("utf-8"), "text/plain; version=0.0.4")
+        elif self.path == "/healthz":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": "Not found"})
+
+    def do_POST(self):
+        handler = ROUTES.get(self.path)
+        if handler is None:
+            self._send(404, {"error": "Not found"})
+            return
+
+        start = time.perf_counter()
+        status = 200
+        cancel = threading.Event()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            future = self.server.pool.submit(handler, body, cancel)
+            payload = future.result(timeout=self.server.deadline)
+        except ServiceSaturated:
+            status, payload = 429, {"error": "Service is saturated, retry later"}
+        except FutureTimeoutError:
+            # Nobody will read the result, so free the worker instead of finishing the job
+            self.server.pool.cancel(future, cancel)
+            status, payload = 504, {"error": f"Request exceeded the {self.server.deadline:.0f}s deadline"}
+        except (json.JSONDecodeError, KeyError, LLMOutputError) as e:
+            status, payload = 400, {"error": str(e)}
+        except Exception as e:
+            print(f"Error handling {self.path}: {e}")
+            status, payload = 500, {"error": str(e)}
+
+        headers = {"Retry-After": "1"} if status == 429 else None
+        self._send(status, payload, headers=headers)
+        self.server.metrics.record(self.path, status, time.perf_counter() - start)
+
+
+def create_server(host="0.0.0.0", port=8000, workers=PLANNING_SERVICE_WORKERS,
+                  queue_size=PLANNING_SERVICE_QUEUE, deadline=PLANNING_SERVICE_DEADLINE_SECONDS):
+    """
+    Creates the HTTP server with its worker pool and metrics attached.
+    """
+    server = ThreadingHTTPServer((host, port), PlanningRequestHandler)
+    server.daemon_threads = True
+    server.pool = WorkerPool(workers, queue_size)
+    server.metrics = ServiceMetrics()
+    server.deadline = deadline
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the event planning HTTP service.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=PLANNING_SERVICE_WORKERS)
+    parser.add_argument("--queue", type=int, default=PLANNING_SERVICE_QUEUE)
+    parser.add_argument("--deadline", type=float, default=PLANNING_SERVICE_DEADLINE_SECONDS)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.workers, args.queue, args.deadline)
+    print(f"Planning service listening on http://{args.host}:{args.port} "
+          f"({args.workers} workers, queue {args.queue}, deadline {args.deadline:.0f}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Cache settings, overridable from the environment
+PRODUCT_CACHE_PATH = os.getenv("PRODUCT_CACHE_PATH", os.path.join(".cache", "product_cache.sqlite3"))
+PRODUCT_CACHE_TTL_SECONDS = int(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 24 * 60 * 60))
+PRODUCT_CACHE_MAX_ENTRIES = int(os.getenv("PRODUCT_CACHE_MAX_ENTRIES", 5000))
+PRODUCT_CACHE_DISABLED = os.getenv("PRODUCT_CACHE_DISABLED", "").lower() in ("1", "true", "yes")
+PRICE_BUCKET_SIZE = 250
+
+
+class ProductSearchCache:
+    """
+    On-disk TTL + LRU cache for RapidAPI product searches.
+    Backed by SQLite in WAL mode so several Streamlit worker processes can
+    read and write the same file at once. Each thread gets its own connection.
+    """
+
+    def __init__(self, path=PRODUCT_CACHE_PATH, ttl_seconds=PRODUCT_CACHE_TTL_SECONDS,
+                 max_entries=PRODUCT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS product_search (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_product_search_accessed ON product_search (accessed_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO cache_stats (name, value) VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @staticmethod
+    def make_key(keyword, max_price, country="IN"):
+        """
+        Builds the cache key from the normalized keyword, price bucket and country.
+        """
+        normalized = " ".join(str(keyword).lower().split())
+        try:
+            bucket = int(float(max_price) // PRICE_BUCKET_SIZE)
+        except (TypeError, ValueError):
+            bucket = str(max_price)
+        return f"{country.upper()}|{bucket}|{normalized}"
+
+    def _bump(self, conn, name, amount=1):
+        conn.execute("UPDATE cache_stats SET value = value + ? WHERE name = ?", (amount, name))
+
+    def get(self, keyword, max_price, country="IN"):
+        """
+        Returns the cached value for the search, or None on a miss or expired entry.
+        """
+        key = self.make_key(keyword, max_price, country)
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value, created_at FROM product_search WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute("DELETE FROM product_search WHERE key = ?", (key,))
+                self._bump(conn, "misses")
+                return None
+            conn.execute("UPDATE product_search SET accessed_at = ? WHERE key = ?", (now, key))
+            self._bump(conn, "hits")
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            print(f"Product cache read failed: {e}")
+            return None
+
+    def set(self, keyword, max_price, value, country="IN"):
+        """
+        Stores a search result and evicts least recently used entries over the size bound.
+        """
+        key = self.make_key(keyword, max_price, country)
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO product_search (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            count = conn.execute("SELECT COUNT(*) FROM product_search").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    "DELETE FROM product_search WHERE key IN "
+                    "(SELECT key FROM product_search ORDER BY accessed_at ASC LIMIT ?)",
+                    (overflow,)
+                )
+                self._bump(conn, "evictions", overflow)
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            print(f"Product cache write failed: {e}")
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+
+    def clear(self):
+        """
+        Removes every cached search and resets the counters.
+        """
+        conn = self._connect()
+        conn.execute("DELETE FROM product_search")
+        conn.execute("UPDATE cache_stats SET value = 0")
+
+    def stats(self):
+        """
+        Returns hit/miss/eviction counters (shared by every process using the file) and the entry count.
+        """
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT name, value FROM cache_stats").fetchall())
+        stats["entries"] = conn.execute("SELECT COUNT(*) FROM product_search").fetchone()[0]
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        stats["hit_rate"] = stats.get("hits", 0) / lookups if lookups else 0.0
+        return stats
+
+
+_product_cache = None
+_product_cache_lock = threading.Lock()
+
+
+def get_product_cache():
+    """
+    Returns the process-wide product search cache, creating it on first use.
+    """
+    global _product_cache
+    if _product_cache is None:
+        with _product_cache_lock:
+            if _product_cache is None:
+                _product_cache = ProductSearchCache()
+    return _product_cache
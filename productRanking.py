@@ -0,0 +1,150 @@
+import os
+import math
+# Products kept per keyword after ranking, and candidates collected per keyword search (across result pages)
+# Products kept per keyword after ranking, and candidates kept per search response
+RANKED_PRODUCTS_PER_KEYWORD = int(os.getenv("RANKED_PRODUCTS_PER_KEYWORD", 5))
+CANDIDATE_POOL_SIZE = int(os.getenv("CANDIDATE_POOL_SIZE", 48))
+
+# Score weights: how well the price uses the per-product budget, the review-adjusted
+# rating, how many people reviewed it, and RapidAPI's own relevance order
+RANKING_WEIGHTS = {
+    "price_fit": 0.4,
+    "rating": 0.3,
+    "reviews": 0.2,
+    "relevance": 0.1,
+}
+# Bayesian rating prior: a product with few reviews is pulled towards PRIOR_RATING
+PRIOR_RATING = 3.5
+PRIOR_REVIEWS = 20
+# Review counts at or above this score the full reviews weight
+REVIEWS_SATURATION = 10000
+
+ITEM_FIELDS = ("title", "price", "url", "rating", "imageUrl")
+
+
+def candidate_from_product(product):
+    """
+    Maps one RapidAPI search result to the candidate fields kept for ranking.
+    """
+    return {
+        "title": product.get("product_title", "Not Available"),
+        "price": product.get("product_price", "Not Available"),
+        "url": product.get("product_url", "Not Available"),
+        "rating": product.get("product_star_rating", "Not Available"),
+        "imageUrl": product.get("product_photo", "Not Available"),
+        "reviews": product.get("product_num_ratings", 0),
+    }
+
+
+def parse_numbers(values):
+    """
+    Parses the first number in strings like "₹1,299.00", "4.3" or "12,345" into a
+    float array in bulk (NaN when there is none). Uses Arrow compute kernels (the
+    engine behind pandas' Arrow strings), which avoids a Python-level regex per value.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    text = pa.array([None if v is None else str(v) for v in values], type=pa.string())
+    numbers = pc.struct_field(pc.extract_regex(text, r"(?P<number>\d[\d,]*(?:\.\d+)?)"), [0])
+    numbers = pc.replace_substring(numbers, ",", "")
+    return pc.cast(numbers, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def warm_up():
+    """
+    Pays the one-off cost of the first ranking (loading NumPy, pyarrow and its
+    compute kernels, about 0.3s) ahead of time, e.g. while searches are in flight.
+    """
+    parse_numbers(["1"])
+
+
+def score_candidates(prices, ratings, reviews, relevance_rank, pool_sizes, budgets):
+    """
+    Scores candidates in one vectorized pass. All arguments are equal-length
+    NumPy arrays; NaN marks a missing price, rating or review count.
+
+    Returns:
+        numpy.ndarray: Score per candidate, higher is better.
+    """
+    import numpy as np
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = prices / budgets
+        # Within budget: prefer products that use more of it; over budget: fall off fast
+        price_fit = np.where(ratio <= 1, 0.6 + 0.4 * ratio, np.maximum(0.0, 1 - 2 * (ratio - 1)))
+    price_fit = np.where(np.isfinite(price_fit) & (budgets > 0), price_fit, 0.3)
+
+    reviews = np.nan_to_num(reviews, nan=0.0)
+    ratings = np.where(np.isnan(ratings), PRIOR_RATING, ratings)
+    adjusted_rating = (reviews * ratings + PRIOR_REVIEWS * PRIOR_RATING) / (reviews + PRIOR_REVIEWS)
+    review_score = np.minimum(np.log1p(reviews) / math.log1p(REVIEWS_SATURATION), 1.0)
+    relevance = 1 - relevance_rank / np.maximum(pool_sizes, 1)
+
+    return (RANKING_WEIGHTS["price_fit"] * price_fit
+            + RANKING_WEIGHTS["rating"] * adjusted_rating / 5
+            + RANKING_WEIGHTS["reviews"] * review_score
+            + RANKING_WEIGHTS["relevance"] * relevance)
+
+
+def rank_products(blocks, amount_per_product, top_n=RANKED_PRODUCTS_PER_KEYWORD):
+    """
+    Ranks the candidates of every keyword block at once and keeps the top_n per keyword.
+
+    Args:
+        blocks (list): {"keyword", "candidates"} blocks, candidates in RapidAPI relevance order.
+            Blocks without candidates (e.g. errors or older cache entries) are returned unchanged.
+        amount_per_product: Per-product budget the prices are scored against.
+        top_n (int): Products kept per keyword.
+
+    Returns:
+        list: The blocks in the same order, with "items" holding the ranked products
+              (each with a numeric "score") and without "candidates".
+    """
+    rankable = [i for i, block in enumerate(blocks) if block.get("candidates")]
+    if not rankable:
+        return [{k: v for k, v in block.items() if k != "candidates"} for block in blocks]
+
+    import numpy as np
+
+    candidates = [c for i in rankable for c in blocks[i]["candidates"]]
+    pool_sizes = np.array([len(blocks[i]["candidates"]) for i in rankable])
+    block_index = np.repeat(np.array(rankable), pool_sizes)
+    # Position of each candidate in RapidAPI's relevance order within its block
+    starts = np.repeat(np.cumsum(pool_sizes) - pool_sizes, pool_sizes)
+    relevance_rank = np.arange(len(candidates)) - starts
+
+    try:
+        budget = float(amount_per_product)
+    except (TypeError, ValueError):
+        budget = 0.0
+
+    # Prices, ratings and review counts parsed in one bulk pass
+    n = len(candidates)
+    numbers = parse_numbers([c.get("price") for c in candidates]
+                          + [c.get("rating") for c in candidates]
+                          + [c.get("reviews") for c in candidates])
+    scores = score_candidates(numbers[:n], numbers[n:2 * n], numbers[2 * n:], relevance_rank,
+                              np.repeat(pool_sizes, pool_sizes), np.full(n, budget))
+
+    # Sort by block, then score descending (lexsort is stable, so ties keep RapidAPI's order),
+    # and keep the first top_n rows of each block
+    order = np.lexsort((-scores, block_index))
+    sorted_blocks = block_index[order]
+    rank_in_block = np.arange(n) - np.searchsorted(sorted_blocks, sorted_blocks, side="left")
+    top = order[rank_in_block < top_n]
+
+    ranked = {i: [] for i in rankable}
+    for row in top.tolist():
+        candidate = candidates[row]
+        item = {field: candidate.get(field, "Not Available") for field in ITEM_FIELDS}
+        item["score"] = round(float(scores[row]), 4)
+        ranked[int(block_index[row])].append(item)
+
+    results = []
+    for i, block in enumerate(blocks):
+        block = {k: v for k, v in block.items() if k != "candidates"}
+        if i in ranked:
+            block["items"] = ranked[i]
+        results.append(block)
+    return results
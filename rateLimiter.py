@@ -0,0 +1,400 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from planTracing import current_span
+
+# Attempts per request (first try included) and the jittered exponential backoff between them
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 4))
+# Quotas per upstream in requests per second (0 disables the limit) and the burst
+# allowed on top, overridable from the environment.
+# Gemini quotas are per model, so each model tier (modelRouter) has its own
+# upstream and a failing tier does not open the circuit of the other
+UPSTREAM_QUOTAS = {
+    "gemini": {
+        "rate": float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 2000)) / 60,
+        "burst": int(os.getenv("GEMINI_BURST", 20)),
+    },
+    "gemini:large": {
+        "rate": float(os.getenv("GEMINI_REQUESTS_PER_MINUTE", 2000)) / 60,
+        "burst": int(os.getenv("GEMINI_BURST", 20)),
+    },
+    "gemini:small": {
+        "rate": float(os.getenv("GEMINI_SMALL_REQUESTS_PER_MINUTE", 4000)) / 60,
+        "burst": int(os.getenv("GEMINI_SMALL_BURST", 40)),
+    },
+    "rapidapi": {
+        "rate": float(os.getenv("RAPIDAPI_REQUESTS_PER_SECOND", 10)),
+        "burst": int(os.getenv("RAPIDAPI_BURST", 10)),
+    },
+}
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 20))
+# A request that would wait longer than this for its turn fails instead of queueing
+LIMITER_MAX_WAIT = float(os.getenv("LIMITER_MAX_WAIT", 30))
+# Consecutive failures that open the circuit, and how long it stays open before a trial request
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", 30))
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """
+    A failed upstream response worth retrying, e.g. HTTP 429 or 503.
+    retry_after is the upstream's Retry-After in seconds, if it sent one.
+    """
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class UpstreamUnavailable(RuntimeError):
+    """
+    Raised without calling the upstream: its circuit is open, or the rate
+    limiter queue is too long to get a turn within LIMITER_MAX_WAIT.
+    """
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header given in seconds; HTTP dates are ignored.
+    """
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _status_of(error):
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after_of(error):
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    # Gemini quota errors carry a google.rpc.RetryInfo detail instead of a header
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            return delay.seconds + delay.nanos / 1e9
+    return None
+
+
+def classify_error(error):
+    """
+    Decides how the retry policy treats an exception.
+
+    Returns:
+        tuple: (retryable, throttled, retry_after). Throttled errors (HTTP 429)
+               mean the upstream is up but over quota, so they do not count
+               towards opening the circuit.
+    """
+    status = _status_of(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS, status == 429, _retry_after_of(error)
+    # Connection errors and timeouts (requests' exceptions are OSErrors)
+    retryable = isinstance(error, (UpstreamError, OSError, TimeoutError))
+    return retryable, False, _retry_after_of(error)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at rate tokens per second, holding at most burst tokens.
+    Callers reserve a token and then sleep until it is theirs, so waiters are
+    served in arrival order without a condition variable, from threads or coroutines.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def _refill(self):
+        # Caller holds the lock
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _reserve(self):
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > LIMITER_MAX_WAIT:
+                raise UpstreamUnavailable(f"rate limit queue is {wait:.1f}s long")
+            # May go negative: later callers queue behind this reservation
+            self._tokens -= 1
+            if wait:
+                self.waiting += 1
+                self.waits += 1
+                self.wait_seconds += wait
+            return wait
+
+    def _done_waiting(self):
+        with self._lock:
+            self.waiting -= 1
+
+    def acquire(self):
+        """
+        Blocks until a token is available. Returns the seconds waited.
+        """
+        wait = self._reserve()
+        if wait:
+            try:
+                time.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    async def aacquire(self):
+        """
+        Async version of acquire.
+        """
+        wait = self._reserve()
+        if wait:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                self._done_waiting()
+        return wait
+
+    def pause(self, seconds):
+        """
+        Holds back every caller for at least seconds, e.g. after a 429 with Retry-After.
+        """
+        with self._lock:
+            # Bring the tokens up to date first, or the next refill would credit the pause back
+            self._refill()
+            self._tokens = min(self._tokens, 1 - seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures so callers fail fast,
+    lets one trial request through after reset_seconds (half-open), and closes
+    again when it succeeds.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opens = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """
+        Raises UpstreamUnavailable while the circuit is open. Returns True when
+        the call is the half-open trial, which must end in record_success,
+        record_failure or release.
+        """
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    raise UpstreamUnavailable("circuit open")
+                self.state = "half_open"
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    raise UpstreamUnavailable("circuit half-open, trial request in flight")
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Gives back a half-open trial that ended without an outcome (e.g. the
+        limiter rejected it or the caller was cancelled).
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opens += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+
+class Upstream:
+    """
+    Rate limiter, retry policy and circuit breaker for one upstream service.
+
+    Usage:
+        response = get_upstream("rapidapi").call(fetch, url)
+        response = await get_upstream("gemini").acall(chain.ainvoke, inputs)
+    """
+
+    def __init__(self, name, rate, burst, max_attempts=RETRY_MAX_ATTEMPTS):
+        self.name = name
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.breaker = CircuitBreaker()
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0, "rejected": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _before_attempt(self):
+        try:
+            trial = self.breaker.before_call()
+        except UpstreamUnavailable:
+            self._count("rejected")
+            raise
+        self._count("requests")
+        return trial
+
+    def _after_wait(self, waited):
+        if waited and current_span() is not None:
+            current_span().add("limiter_wait_ms", round(waited * 1000, 3))
+
+    def _after_failure(self, error, attempt):
+        """
+        Records a failed attempt. Returns the seconds to sleep before retrying,
+        or raises the error when it should not be retried.
+        """
+        retryable, throttled, retry_after = classify_error(error)
+        if throttled:
+            # The upstream is up but over quota: slow every caller down, not just this one
+            self._count("throttled")
+            if self.bucket is not None and retry_after:
+                self.bucket.pause(retry_after)
+        else:
+            self._count("failures")
+        if retryable and not throttled:
+            # Server errors, timeouts and connection errors point at an outage
+            self.breaker.record_failure()
+        else:
+            # The upstream answered, even if it refused this request
+            self.breaker.record_success()
+        if not retryable or attempt >= self.max_attempts:
+            raise error
+        self._count("retries")
+        if current_span() is not None:
+            current_span().add("retries")
+        if retry_after is not None:
+            return min(retry_after, RETRY_MAX_DELAY)
+        # Full jitter, so retries from many callers do not arrive together
+        return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Calls fn(*args, **kwargs) once a token is available, retrying retryable
+        errors with backoff. Raises UpstreamUnavailable when the circuit is open.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            trial = self._before_attempt()
+            try:
+                if self.bucket is not None:
+                    try:
+                        self._after_wait(self.bucket.acquire())
+                    except UpstreamUnavailable:
+                        self._count("rejected")
+                        raise
+                try:
+                    result = fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._after_failure(e, attempt)
+                else:
+                    self.breaker.record_success()
+                    return result
+            except BaseException:
+                # Rejected or interrupted before an outcome was recorded: free the trial
+                if trial:
+                    self.breaker.release()
+                raise
+            time.sleep(delay)
+
+    async def acall(self, coro_fn, *args, **kwargs):
+        """
+        Async version of call, awaiting coro_fn(*args, **kwargs).
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            trial = self._before_attempt()
+            try:
+                if self.bucket is not None:
+                    try:
+                        self._after_wait(await self.bucket.aacquire())
+                    except UpstreamUnavailable:
+                        self._count("rejected")
+                        raise
+                try:
+                    result = await coro_fn(*args, **kwargs)
+                except Exception as e:
+                    delay = self._after_failure(e, attempt)
+                else:
+                    self.breaker.record_success()
+                    return result
+            except BaseException:
+                # Rejected, cancelled or timed out before an outcome was recorded: free the trial
+                if trial:
+                    self.breaker.release()
+                raise
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """
+        Returns the counters, limiter queue depth and wait time, and circuit state.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update({
+            "queue_depth": self.bucket.waiting if self.bucket else 0,
+            "limiter_waits": self.bucket.waits if self.bucket else 0,
+            "limiter_wait_seconds": self.bucket.wait_seconds if self.bucket else 0.0,
+            "circuit_state": self.breaker.state,
+            "circuit_opens": self.breaker.opens,
+        })
+        return stats
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name):
+    """
+    Returns the process-wide Upstream for a name in UPSTREAM_QUOTAS (unlimited
+    for other names), creating it on first use.
+    """
+    with _upstreams_lock:
+        upstream = _upstreams.get(name)
+        if upstream is None:
+            quota = UPSTREAM_QUOTAS.get(name, {"rate": 0, "burst": 1})
+            upstream = _upstreams[name] = Upstream(name, quota["rate"], quota["burst"])
+        return upstream
+
+
+def get_upstream_stats():
+    """
+    Returns the stats of every upstream, keyed by name.
+    """
+    with _upstreams_lock:
+        upstreams = list(_upstreams.values())
+    return {upstream.name: upstream.stats() for upstream in upstreams}
@@ -0,0 +1,121 @@
+import asyncio
+import threading
+
+_groups = {}
+_groups_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls: while a call for a key is in flight,
+    later callers with the same key wait for it and share its result (or error)
+    instead of calling upstream themselves.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) once per key among concurrent callers.
+
+        Returns:
+            tuple: (result, shared) where shared is True if this caller waited
+                   on another caller's call instead of making its own.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key, coro_fn, *args, **kwargs):
+        """
+        Async version of do: awaits coro_fn(*args, **kwargs) once per key among
+        concurrent callers on the same event loop. Returns (result, shared).
+        """
+        loop_key = (id(asyncio.get_running_loop()), key)
+        with self._lock:
+            entry = self._async_calls.get(loop_key)
+            shared = entry is not None
+            if shared:
+                entry[1] += 1
+                self.coalesced += 1
+            else:
+                entry = self._async_calls[loop_key] = [asyncio.ensure_future(coro_fn(*args, **kwargs)), 0]
+                self.leaders += 1
+                entry[0].add_done_callback(lambda _: self._forget(loop_key))
+        # Shield so one cancelled waiter does not cancel the shared call
+        return await asyncio.shield(entry[0]), shared
+
+    def _forget(self, loop_key):
+        with self._lock:
+            self._async_calls.pop(loop_key, None)
+
+    def stats(self):
+        """
+        Returns leader/coalesced totals and the waiter count of each in-flight key.
+        """
+        with self._lock:
+            waiters = {str(key): call.waiters for key, call in self._calls.items()}
+            waiters.update({str(key): entry[1] for (_, key), entry in self._async_calls.items()})
+            return {
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+                "in_flight": waiters,
+            }
+
+
+def get_single_flight(name):
+    """
+    Returns the process-wide SingleFlight group with this name, creating it on first use.
+    """
+    with _groups_lock:
+        group = _groups.get(name)
+        if group is None:
+            group = _groups[name] = SingleFlight(name)
+        return group
+
+
+def get_single_flight_stats():
+    """
+    Returns the stats of every SingleFlight group, keyed by group name.
+    """
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
@@ -0,0 +1,185 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from planCheckpoints import plan_thread_id
+from planningClient import fetch_event_plan
+from planTracing import span
+
+# Plan every generated theme in the background while the user reads them. Off by
+# default: it multiplies LLM and RapidAPI usage by the number of themes
+SPECULATIVE_PLANNING = os.getenv("SPECULATIVE_PLANNING", "0").lower() in ("1", "true", "yes")
+# Speculative plans running at once, process-wide
+SPECULATIVE_MAX_WORKERS = int(os.getenv("SPECULATIVE_MAX_WORKERS", 3))
+# Cost cap: speculative plans queued or running at once, process-wide; themes over
+# the cap are only planned once confirmed
+SPECULATIVE_MAX_PENDING = int(os.getenv("SPECULATIVE_MAX_PENDING", 9))
+# Sessions whose speculative plans are kept until claimed
+SPECULATIVE_MAX_SESSIONS = int(os.getenv("SPECULATIVE_MAX_SESSIONS", 100))
+
+
+class _Speculation:
+    def __init__(self, future, cancel):
+        self.future = future
+        self.cancel = cancel
+
+
+class SpeculativePlanner:
+    """
+    Plans every generated theme of a session on a bounded pool before the user
+    confirms one, so the confirmed plan is often finished already. Confirming
+    cancels the session's other plans: queued ones never start and running ones
+    stop after their current graph step.
+
+    Each plan runs under the checkpoint thread the confirm step uses
+    (plan_thread_id), so a plan cancelled halfway resumes from its checkpoint
+    if its theme is confirmed later.
+
+    Usage:
+        planner.start(session_id, graph_states, plan_in_process)
+        future = planner.claim(session_id, thread_id)
+    """
+
+    def __init__(self, max_workers=SPECULATIVE_MAX_WORKERS, max_pending=SPECULATIVE_MAX_PENDING,
+                 max_sessions=SPECULATIVE_MAX_SESSIONS):
+        self.max_pending = max_pending
+        self.max_sessions = max_sessions
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative-plan")
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.counters = {"started": 0, "skipped": 0, "hits": 0, "running": 0, "misses": 0, "cancelled": 0}
+
+    def _pending(self):
+        return sum(1 for plans in self._sessions.values()
+                   for speculation in plans.values() if not speculation.future.done())
+
+    @staticmethod
+    def _reusable(speculation):
+        # Queued, running or finished with a plan; not cancelled or failed
+        future = speculation.future
+        if speculation.cancel.is_set() or future.cancelled():
+            return False
+        return not future.done() or future.exception() is None
+
+    def _cancel(self, plans):
+        for speculation in plans.values():
+            speculation.cancel.set()
+            if not speculation.future.done():
+                speculation.future.cancel()
+                self.counters["cancelled"] += 1
+
+    @staticmethod
+    def _run(plan_fn, graph_state, thread_id, cancel):
+        if cancel.is_set():
+            return None
+        with span("speculative_plan", "speculation", selected_theme_index=graph_state.get("selected_theme_index")):
+            return plan_fn(graph_state, thread_id, cancel)
+
+    def start(self, session_id, graph_states, plan_fn):
+        """
+        Starts speculative plans for a session (e.g. when themes are generated
+        again). Earlier plans whose thread_id is still among the themes are kept
+        as they are; only those for themes no longer offered are cancelled.
+
+        Args:
+            session_id: Session the plans belong to.
+            graph_states (list): Initial graph state per theme, in the order to plan them.
+            plan_fn: Called on the pool as plan_fn(graph_state, thread_id, cancel).
+
+        Returns:
+            int: Plans newly started; kept plans are not counted, and fewer are
+            started once SPECULATIVE_MAX_PENDING is reached.
+        """
+        thread_ids = [(plan_thread_id(session_id, graph_state), graph_state) for graph_state in graph_states]
+        with self._lock:
+            earlier = self._sessions.pop(session_id, {})
+            plans = {thread_id: earlier.pop(thread_id) for thread_id, _ in thread_ids
+                     if thread_id in earlier and self._reusable(earlier[thread_id])}
+            self._cancel(earlier)
+            self._sessions[session_id] = plans
+            room = max(0, self.max_pending - self._pending())
+            started = 0
+            for thread_id, graph_state in thread_ids:
+                if thread_id in plans:
+                    continue
+                if started >= room:
+                    self.counters["skipped"] += 1
+                    continue
+                cancel = threading.Event()
+                future = self._executor.submit(self._run, plan_fn, graph_state, thread_id, cancel)
+                plans[thread_id] = _Speculation(future, cancel)
+                started += 1
+            self.counters["started"] += started
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                self._cancel(evicted)
+            return started
+
+    def claim(self, session_id, thread_id):
+        """
+        Takes the speculative plan of the confirmed theme and cancels the session's others.
+
+        Returns:
+            Future or None: The plan's future once it has started (it may still be
+            running). None if it was never started or was still queued; a queued
+            plan is cancelled so the caller can plan it in the foreground.
+        """
+        with self._lock:
+            plans = self._sessions.pop(session_id, {})
+            speculation = plans.pop(thread_id, None)
+            self._cancel(plans)
+            if speculation is None or speculation.future.cancel():
+                self.counters["misses"] += 1
+                return None
+            self.counters["hits" if speculation.future.done() else "running"] += 1
+            return speculation.future
+
+    def discard(self, session_id):
+        """
+        Cancels every speculative plan of a session, e.g. when its inputs change.
+        """
+        with self._lock:
+            self._cancel(self._sessions.pop(session_id, {}))
+
+    def stats(self):
+        """
+        Returns the counters, pending plans and tracked sessions.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats.update({"pending": self._pending(), "sessions": len(self._sessions)})
+        return stats
+
+
+def plan_in_process(graph_state, thread_id, cancel):
+    """
+    plan_fn running the checkpointed planning graph in this process.
+    """
+    from langgprahCode import run_event_planning
+
+    return run_event_planning(graph_state, thread_id=thread_id, cancel=cancel)
+
+
+def plan_with_service(graph_state, thread_id, cancel):
+    """
+    plan_fn asking the planning service. A running request cannot be cancelled,
+    but the service checkpoints it under thread_id, so confirming returns it.
+    """
+    return fetch_event_plan(graph_state["event_data"], graph_state["themes_json"],
+                            graph_state["selected_theme_index"], thread_id=thread_id)
+
+
+_planner = None
+_planner_lock = threading.Lock()
+
+
+def get_speculative_planner():
+    """
+    Returns the process-wide SpeculativePlanner, creating it on first use.
+    """
+    global _planner
+    if _planner is None:
+        with _planner_lock:
+            if _planner is None:
+                _planner = SpeculativePlanner()
+    return _planner
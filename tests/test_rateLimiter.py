@@ -0,0 +1,79 @@
+import time
+import asyncio
+import pytest
+from google.api_core.exceptions import ResourceExhausted
+from google.protobuf.duration_pb2 import Duration
+from google.rpc.error_details_pb2 import RetryInfo
+import llmClient
+from rateLimiter import Upstream
+
+
+def _quota_error(delay):
+    return ResourceExhausted("quota exceeded", details=[RetryInfo(retry_delay=Duration(nanos=int(delay * 1e9)))])
+
+
+class _FlakyGemini:
+    """
+    Answers 429 with a RetryInfo delay on the first call, then succeeds.
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self):
+        self.calls.append(time.monotonic())
+        if len(self.calls) == 1:
+            raise _quota_error(self.delay)
+        return "ok"
+
+
+def test_429_is_retried_after_retry_info_delay():
+    upstream = Upstream("gemini-test", rate=100, burst=10)
+    gemini = _FlakyGemini(0.3)
+
+    assert upstream.call(gemini) == "ok"
+    assert len(gemini.calls) == 2
+    assert gemini.calls[1] - gemini.calls[0] >= 0.3
+    assert upstream.counters["throttled"] == 1
+    assert upstream.counters["retries"] == 1
+    assert upstream.breaker.state == "closed"
+
+
+def test_429_is_retried_after_retry_info_delay_async():
+    upstream = Upstream("gemini-test", rate=100, burst=10)
+    gemini = _FlakyGemini(0.3)
+
+    async def call():
+        return gemini()
+
+    assert asyncio.run(upstream.acall(call)) == "ok"
+    assert gemini.calls[1] - gemini.calls[0] >= 0.3
+
+
+def test_retry_info_pauses_other_callers():
+    upstream = Upstream("gemini-test", rate=100, burst=10, max_attempts=1)
+    with pytest.raises(ResourceExhausted):
+        upstream.call(_FlakyGemini(0.3))
+    start = time.monotonic()
+    upstream.call(lambda: "ok")
+    assert time.monotonic() - start >= 0.25
+
+
+def test_gemini_client_makes_one_call_per_request(monkeypatch):
+    class FakeClient:
+        def __init__(self):
+            self.calls = []
+
+        def generate_content(self, request=None, **kwargs):
+            self.calls.append(kwargs)
+            raise _quota_error(1)
+
+    llm = llmClient._single_attempt_model_class()(model="gemini-2.0-flash", google_api_key="x", max_retries=0)
+    client = FakeClient()
+    monkeypatch.setattr(llm, "client", client)
+
+    with pytest.raises(ResourceExhausted):
+        llm.invoke("hi")
+    assert len(client.calls) == 1
+    assert client.calls[0]["retry"] is None
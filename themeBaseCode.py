@@ -1,19 +1,8 @@
 import os
-from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-import re
+from modelRouter import RoutedChain
+from llmOutputParser import IncrementalJSONArrayParser, LLMOutputError, parse_themes
 import json
-import ast
-
-load_dotenv()
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
-
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0.2
-)
 
 # Prompt Template
 theme_prompt = PromptTemplate(
@@ -58,17 +47,68 @@ give each theme in json list l
 """
 )
 
-# Chain
-chain = theme_prompt | llm | StrOutputParser()
+# Chain (responses are cached on exact-match inputs; the model tier and its
+# fallback come from the "theme_generation" route in modelRouter.ROUTES)
+chain = RoutedChain("theme_generation", theme_prompt)
 
-def generate_themes(user_input):
+def generate_themes(user_input, bypass_cache=False):
     """
     Generates 3 theme options based on user input (budget, guests, etc.) using Gemini.
+    Set bypass_cache to ask the model for fresh themes instead of the cached ones.
     """
-    response = chain.invoke(user_input)
+    response = chain.invoke(user_input, bypass=bypass_cache)
     return response
 
 
+async def agenerate_themes(user_input, bypass_cache=False):
+    """
+    Async version of generate_themes.
+    """
+    return await chain.ainvoke(user_input, bypass=bypass_cache)
+
+
+def stream_themes(user_input, bypass_cache=False):
+    """
+    Streams theme generation and yields each theme dict as soon as its JSON
+    object is complete, instead of waiting for the whole response.
+    """
+    parser = IncrementalJSONArrayParser()
+    for chunk in chain.stream(user_input, bypass=bypass_cache):
+        for theme in parser.feed(chunk):
+            yield theme
+
+
+def invalidate_theme_cache(user_input):
+    """
+    Forgets the cached theme response for these inputs, e.g. after it failed to parse.
+    """
+    chain.invalidate(user_input)
+
+
+
+def select_theme(themes, theme_number):
+    """
+    Returns the selected theme dict from a parsed theme list (or raw LLM text).
+
+    Args:
+        themes (list | str): Parsed theme list, or the raw text response from the LLM.
+        theme_number (int): The 1-based index of the theme to select.
+
+    Returns:
+        dict: The selected theme, or None if the themes are invalid or the number is out of range.
+    """
+    try:
+        themes = parse_themes(themes)
+    except LLMOutputError as e:
+        print(f"Error parsing themes: {e}")
+        return None
+
+    # Check if the theme number is valid
+    if theme_number < 1 or theme_number > len(themes):
+        print(f"Invalid theme number. Please select a theme between 1 and {len(themes)}")
+        return None
+    return themes[theme_number - 1]
+
 
 def extract_theme_details(output_text, theme_number):
     """
@@ -76,61 +116,13 @@ def extract_theme_details(output_text, theme_number):
     Handles both direct JSON responses and Markdown-formatted code blocks.
     
     Args:
-        output_text (str): The raw text response from the LLM.
+        output_text (str | list): The raw text response from the LLM, or the parsed theme list.
         theme_number (int): The 1-based index of the theme to select.
         
     Returns:
         str: JSON string of the selected theme, or empty dict string on failure.
     """
-    # First check if the output_text is already a representation of a Python list
-    if output_text.startswith('[') and output_text.endswith(']'):
-        try:
-            # given output txt in python dict in string so so eval to convert str to proper json format
-            print("output_text",output_text,type(output_text))
-            # themes = json.loads(output_text[1:-1])
-            themes = ast.literal_eval(output_text)
-            
-            # Check if the theme number is valid
-            if theme_number < 1 or theme_number > len(themes):
-                print(f"Invalid theme number. Please select a theme between 1 and {len(themes)}")
-                return None
-            
-            # Return the selected theme as a JSON string
-            return json.dumps(themes[theme_number - 1])
-        except json.JSONDecodeError:
-            # If direct parsing fails, continue with the regex approach
-            print("Direct JSON parsing failed, trying regex approach")
-        
-    # Extract JSON string from between triple backticks (original approach)
-    json_pattern = r"```json\s*([\s\S]*?)\s*```"
-    match = re.search(json_pattern, output_text)
-    
-    if not match:
-        print("No JSON match found in the output")
+    theme = select_theme(output_text, theme_number)
+    if theme is None:
         return "{}"  # Return empty JSON object instead of None
-     
-    json_str = match.group(1)
-    
-    try:
-        # Parse JSON string into Python object
-        themes = json.loads(json_str)
-         
-        # Check if the theme number is valid
-        if theme_number < 1 or theme_number > len(themes):
-            print(f"Invalid theme number. Please select a theme between 1 and {len(themes)}")
-            return "{}"
-         
-        # Return the requested theme as a JSON string
-        return json.dumps(themes[theme_number - 1])
-     
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON data: {e}")
-        return "{}"
-    except Exception as e:
-        print(f"An error occurred: {str(e)}")
-        return "{}"
-
-
-
-
-    
+    return json.dumps(theme)